@@ -1,72 +1,99 @@
+import time
+# Taken before the other imports so that the startup timing includes them
+STARTED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox
-import json
-import matplotlib.pyplot as plt
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from tkinter import ttk, messagebox, filedialog
 import os
 import datetime
+import sqlite3
+from expense import Expense
+from expense_store import SQLiteExpenseStore, ConflictError
+from virtual_list import VirtualExpenseList
+from currency import CURRENCY_RATES, format_minor, huf_to_eur
+from ledger import Ledger, USERS, CATEGORIES
+from search_index import SearchScheduler
+from jobs import JobRunner, warm_up
+from csv_import import read_header, guess_mapping, ImportCancelled
+from import_dialog import CsvImportDialog
+from export import ExportCancelled
+from export_dialog import ExportDialog
 
 # Global variables and constants
-HUF_TO_EUR_RATE = 0.002562
-expenses = []
-modifying_index = None
+# The store with the totals and indexes kept in step with it; shared with the command line
+ledger = Ledger(resident=True)
+modifying_id = None
+# The expense being modified as it was read, so edits made elsewhere meanwhile are noticed
+modifying_expense = None
+report_job = None
+ledger_job = None
+import_job = None
+chart = None
+spending_chart = None
+
+# matplotlib and reportlab are imported on first use; these modules are imported in the
+# background this many milliseconds after the window appears (EXPENSE_TRACKER_WARM_UP=0 turns it off)
+WARM_UP_MODULES = ("chart_panel", "reports")
+WARM_UP_DELAY_MS = 1000
+WARM_UP = os.environ.get("EXPENSE_TRACKER_WARM_UP", "") != "0"
+
+# Set EXPENSE_TRACKER_STARTUP_TIMING=1 to print the time to the first window and exit
+STARTUP_TIMING = os.environ.get("EXPENSE_TRACKER_STARTUP_TIMING", "") not in ("", "0")
+
+# Set EXPENSE_TRACKER_SERVER=http://host:port to work on a running api_server instead of the local database
+SERVER_URL = os.environ.get("EXPENSE_TRACKER_SERVER", "")
+
+# How often, in milliseconds, the changes other processes (or server clients) made are fetched
+POLL_MS = 2000
 
 # List of users for the Combobox
-users = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J"]
+users = USERS
 
 # List of categories for the Combobox
-categories = ["Food", "Transportation", "Tips", "Gift", "SIM Card", "Office Equipment", "Else"]
-
-# Currency rates relative to 1 HUF (Hungarian Forint)
-CURRENCY_RATES = {
-    "HUF": 1.0,
-    "EUR": 380.0,
-    "USD": 350.0,
-    "HKD": 45.0,
-    "IDR": 0.022
-}
-
-
-def convert_to_huf(amount, currency):
-    """Converts a given amount to HUF based on the currency rates."""
-    rate = CURRENCY_RATES.get(currency, 1.0)
-    if currency == "HUF":
-        return amount
-    else:
-        return amount * rate
+categories = CATEGORIES
 
 
 def save_expenses():
-    """Saves the expenses list to a JSON file."""
+    """Flushes and closes the expense store."""
     try:
-        with open("expenses.json", "w") as f:
-            json.dump(expenses, f, indent=4)
-    except IOError:
+        ledger.close()
+    except (IOError, sqlite3.Error):
         messagebox.showerror("Error", "Could not save data to file.")
 
 
 def load_expenses():
-    """Loads expenses from a JSON file."""
-    global expenses
+    """Opens the expense store, bringing over the old expenses.json ledger on first run."""
     try:
-        with open("expenses.json", "r") as f:
-            expenses = json.load(f)
-            # Add date and invoice field for old entries if they don't exist
-            for exp in expenses:
-                if "date" not in exp:
-                    exp["date"] = "N/A"
-                if "invoice" not in exp:
-                    exp["invoice"] = "N/A"
-            messagebox.showinfo("Data Loaded", "Expenses have been loaded from file.")
-    except FileNotFoundError:
-        pass
-    except IOError:
+        ledger.load_rates()
+    except (IOError, ValueError):
+        messagebox.showerror("Error", "Could not read the exchange rate file; using the fixed rates.")
+    try:
+        if SERVER_URL:
+            ledger.open("http", SERVER_URL)
+            # The expense list shows the ledger is loaded; the title tells where it lives
+            root.title(f"Expense Tracker - {SERVER_URL}")
+        else:
+            ledger.open()
+    except (IOError, ValueError, sqlite3.Error):
         messagebox.showerror("Error", "Could not read data from file.")
+        # Keep the app usable for this session even though nothing will be saved
+        ledger.attach(SQLiteExpenseStore(":memory:"))
     update_expense_list()
     update_total()
+    root.after(POLL_MS, poll_store)
+
+
+def poll_store():
+    """Shows the changes other processes made to the ledger, then polls again."""
+    try:
+        changed = ledger.poll()
+    except (IOError, sqlite3.Error):
+        # The file may be locked or the server restarting; try again at the next poll
+        changed = False
+    if changed:
+        update_expense_list()
+        update_total()
+    root.after(POLL_MS, poll_store)
 
 
 def get_category_from_input():
@@ -74,6 +101,19 @@ def get_category_from_input():
     return category_combobox.get()
 
 
+def confirm_if_duplicate(expense, exclude=None):
+    """Asks before saving an expense whose invoice or content is already recorded."""
+    found = ledger.duplicates_of(expense, exclude)
+    if not found:
+        return True
+    other = ledger.store.get(found[0])
+    return messagebox.askyesno(
+        "Possible Duplicate",
+        f"Invoice {other['invoice']} of {other['user']} ({other['amount']:.2f} {other['currency']} on "
+        f"{other['date']}, {other['description']}) looks like the same expense"
+        + (f", as do {len(found) - 1} more" if len(found) > 1 else "") + ".\n\nSave it anyway?")
+
+
 def add_expense():
     """Adds a new expense from the GUI inputs."""
     try:
@@ -89,7 +129,7 @@ def add_expense():
             messagebox.showerror("Input Error", "All fields must be filled.")
             return
 
-        expenses.append({
+        expense = {
             "amount": amount,
             "currency": currency,
             "category": category,
@@ -97,9 +137,15 @@ def add_expense():
             "user": user,
             "date": date,
             "invoice": invoice
-        })
+        }
+        if not confirm_if_duplicate(expense):
+            return
+        try:
+            ledger.add(expense)
+        except (IOError, sqlite3.Error):
+            messagebox.showerror("Error", "Could not save data to file.")
+            return
 
-        save_expenses()
         amount_entry.delete(0, tk.END)
         category_combobox.set('')
         description_entry.delete(0, tk.END)
@@ -118,16 +164,25 @@ def add_expense():
 
 def delete_expense():
     """Deletes the selected expense from the list."""
-    selected_index = expense_listbox.curselection()
-    if not selected_index:
+    selected_id = expense_list.selected_id()
+    if selected_id is None:
         messagebox.showerror("Selection Error", "Please select an expense to delete.")
         return
 
-    index = selected_index[0]
+    expense = ledger.store.get(selected_id)
     response = messagebox.askyesno("Confirm Deletion", "Are you sure you want to delete this expense?")
     if response:
-        expenses.pop(index)
-        save_expenses()
+        try:
+            ledger.delete(selected_id, expected=expense)
+        except ConflictError:
+            messagebox.showerror("Changed Elsewhere", "The expense was changed by someone else meanwhile and "
+                                                      "was not deleted. Please check it and try again.")
+            update_expense_list()
+            update_total()
+            return
+        except (IOError, sqlite3.Error):
+            messagebox.showerror("Error", "Could not save data to file.")
+            return
         update_expense_list()
         update_total()
         delete_button.pack_forget()
@@ -136,28 +191,28 @@ def delete_expense():
 
 def modify_expense():
     """Prepares the UI to modify the selected expense."""
-    global modifying_index
-    selected_index = expense_listbox.curselection()
-    if not selected_index:
+    global modifying_id, modifying_expense
+    if expense_list.selected_id() is None:
         messagebox.showerror("Selection Error", "Please select an expense to modify.")
         return
 
-    modifying_index = selected_index[0]
-    expense_to_modify = expenses[modifying_index]
+    modifying_id = expense_list.selected_id()
+    modifying_expense = ledger.store.get(modifying_id)
+    expense_to_modify = Expense.from_dict(modifying_expense)
 
     amount_entry.delete(0, tk.END)
-    amount_entry.insert(0, str(expense_to_modify["amount"]))
+    amount_entry.insert(0, str(expense_to_modify.amount))
     description_entry.delete(0, tk.END)
-    description_entry.insert(0, expense_to_modify["description"])
-    user_combobox.set(expense_to_modify.get("user", ""))
-    currency_combobox.set(expense_to_modify.get("currency", "HUF"))
+    description_entry.insert(0, expense_to_modify.description)
+    user_combobox.set(expense_to_modify.user)
+    currency_combobox.set(expense_to_modify.currency)
     date_entry.delete(0, tk.END)
-    date_entry.insert(0, expense_to_modify.get("date", datetime.date.today().strftime('%Y-%m-%d')))
+    date_entry.insert(0, expense_to_modify.date)
     invoice_entry.delete(0, tk.END)
-    invoice_entry.insert(0, expense_to_modify.get("invoice", ""))
+    invoice_entry.insert(0, expense_to_modify.invoice)
 
     # Set category correctly
-    category = expense_to_modify["category"]
+    category = expense_to_modify.category
     if category in categories:
         category_combobox.set(category)
         category_combobox.config(state="readonly")
@@ -170,7 +225,7 @@ def modify_expense():
 
 def save_modified_expense():
     """Saves the changes made during a modification."""
-    global modifying_index
+    global modifying_id, modifying_expense
     try:
         new_amount = float(amount_entry.get())
         new_category = get_category_from_input()
@@ -184,7 +239,7 @@ def save_modified_expense():
             messagebox.showerror("Input Error", "All fields must be filled.")
             return
 
-        expenses[modifying_index] = {
+        modified_expense = {
             "amount": new_amount,
             "currency": new_currency,
             "category": new_category,
@@ -193,9 +248,20 @@ def save_modified_expense():
             "date": new_date,
             "invoice": new_invoice
         }
-
-        save_expenses()
-        modifying_index = None
+        if not confirm_if_duplicate(modified_expense, exclude=modifying_id):
+            return
+        try:
+            ledger.update(modifying_id, modified_expense, expected=modifying_expense)
+        except ConflictError as error:
+            # Saving again overwrites the other change knowingly
+            modifying_expense = ledger.store.get(modifying_id)
+            messagebox.showerror("Changed Elsewhere", f"{error}.\nSave again to overwrite it with your values.")
+            return
+        except (IOError, sqlite3.Error):
+            messagebox.showerror("Error", "Could not save data to file.")
+            return
+        modifying_id = None
+        modifying_expense = None
 
         # Reset the UI to add mode
         add_button.config(text="Add Expense", command=add_expense)
@@ -218,31 +284,68 @@ def save_modified_expense():
 
 
 def update_expense_list():
-    """Refreshes the Listbox with the current expenses."""
-    expense_listbox.delete(0, tk.END)
-    if expenses:
-        for exp in expenses:
-            user = exp.get("user", "Unknown")
-            currency = exp.get("currency", "HUF")
-            amount = exp.get("amount", 0)
-            date = exp.get("date", "N/A")
-            invoice = exp.get("invoice", "N/A")
-            display_text = f"INV#{invoice} | {date} | {amount:.2f} {currency} - {exp['category']} - {exp['description']} - by {user}"
-            expense_listbox.insert(tk.END, display_text)
+    """Refreshes the expense list, keeping the current search and scroll position."""
+    query = search_entry.get().lower()
+    if query:
+        search_scheduler.schedule(query, True)
+    else:
+        expense_list.set_source(ledger.store.count, lambda offset, limit: ledger.store.query(limit=limit, offset=offset),
+                                keep_position=True)
+
+
+def show_search_results(matching_ids, keep_position=False):
+    """Shows the expenses with the given ids in the expense list."""
+    expense_list.set_source(lambda: len(matching_ids),
+                            lambda offset, limit: ledger.store.get_many(matching_ids[offset:offset + limit]),
+                            keep_position)
 
 
 def update_total():
     """Calculates and updates the total expense label in HUF and EUR."""
-    total_huf = sum(convert_to_huf(exp["amount"], exp.get("currency", "HUF")) for exp in expenses)
-    total_label.config(text=f"Total Spent: {total_huf:.2f} HUF")
+    total_huf = ledger.total()
+    total_label.config(text=f"Total Spent: {format_minor(total_huf, 'HUF')} HUF")
+
+    total_eur = huf_to_eur(total_huf)
+    total_eur_label.config(text=f"Total in EUR: {format_minor(total_eur, 'EUR')} EUR")
+    update_charts()
+    update_undo_buttons()
+
+
+def update_undo_buttons():
+    """Enables Undo and Redo when there is a step to take, naming it in the button."""
+    for button, name, label in ((undo_button, "Undo", ledger.history.undo_label()),
+                                (redo_button, "Redo", ledger.history.redo_label())):
+        button.config(text=f"{name} {label}" if label else name, state=tk.NORMAL if label else tk.DISABLED)
+
+
+def undo_change(event=None):
+    """Reverses the last add, modify, delete, ledger load or CSV import."""
+    step_history(ledger.undo)
+
+
+def redo_change(event=None):
+    """Makes the last undone change again."""
+    step_history(ledger.redo)
+
 
-    total_eur = total_huf * HUF_TO_EUR_RATE
-    total_eur_label.config(text=f"Total in EUR: {total_eur:.2f} EUR")
+def step_history(step):
+    """Runs ledger.undo or ledger.redo, unless a load or import is still adding expenses."""
+    if ledger_job is not None or import_job is not None:
+        messagebox.showinfo("Import Running", "Please wait until the expenses are loaded or cancel the import.")
+        return
+    try:
+        step()
+    except ConflictError as error:
+        messagebox.showerror("Changed Elsewhere", f"{error}.\nNothing was changed.")
+    except (IOError, sqlite3.Error):
+        messagebox.showerror("Error", "Could not save data to file.")
+    update_expense_list()
+    update_total()
 
 
 def on_list_select(event):
     """Shows/hides the delete and modify buttons based on selection."""
-    if expense_listbox.curselection():
+    if expense_list.selected_id() is not None:
         delete_button.pack(side=tk.LEFT, padx=5)
         modify_button.pack(side=tk.LEFT, padx=5)
     else:
@@ -250,57 +353,75 @@ def on_list_select(event):
         modify_button.pack_forget()
 
 
+def category_totals():
+    """Returns the HUF total per category in minor units, merging categories that only differ in case."""
+    totals = {}
+    for category, amount_huf in ledger.totals_by("category").items():
+        category = category.capitalize()
+        totals[category] = totals.get(category, 0) + amount_huf
+    return totals
+
+
 def show_expense_chart():
-    """Generates and displays a pie chart of expenses by category."""
-    if not expenses:
+    """Shows or hides the pie chart of expenses by category next to the expense list."""
+    global chart
+    if chart is not None and chart.winfo_manager():
+        chart.pack_forget()
+        show_chart_button.config(text="Show Chart")
+        return
+
+    if not len(ledger.columns):
         messagebox.showinfo("No Data", "No expenses recorded to create a chart.")
         return
 
-    category_totals = {}
-    for exp in expenses:
-        category = exp.get("category", "Unknown").capitalize()
-        amount_huf = convert_to_huf(exp.get("amount", 0), exp.get("currency", "HUF"))
-        category_totals[category] = category_totals.get(category, 0) + amount_huf
+    if chart is None:
+        from chart_panel import CategoryPieChart
+        chart = CategoryPieChart(list_frame)
+    chart.pack(side=tk.RIGHT, fill=tk.BOTH, padx=(10, 0))
+    show_chart_button.config(text="Hide Chart")
+    update_charts()
+
+
+def show_spending_chart():
+    """Shows or hides the chart of spending over time next to the expense list."""
+    global spending_chart
+    if spending_chart is not None and spending_chart.winfo_manager():
+        spending_chart.pack_forget()
+        show_spending_button.config(text="Spending Over Time")
+        return
 
-    categories_chart = list(category_totals.keys())
-    amounts = list(category_totals.values())
+    if spending_chart is None:
+        from chart_panel import SpendingChart
+        spending_chart = SpendingChart(list_frame, ledger.columns.daily_totals)
+    spending_chart.pack(side=tk.RIGHT, fill=tk.BOTH, padx=(10, 0))
+    show_spending_button.config(text="Hide Spending")
+    update_charts()
 
-    plt.figure(figsize=(8, 8))
-    plt.pie(amounts, labels=categories_chart, autopct='%1.1f%%', startangle=90, colors=plt.cm.Paired.colors)
-    plt.title("Expense Breakdown by Category")
-    plt.ylabel('')
 
-    plt.show()
+def update_charts():
+    """Brings the charts up to date with the totals while they are shown."""
+    if chart is not None and chart.winfo_manager():
+        chart.set_totals(category_totals())
+    if spending_chart is not None and spending_chart.winfo_manager():
+        spending_chart.refresh()
 
 
 def filter_expenses(event):
-    """Filters the listbox based on the search query."""
+    """Filters the expense list based on the search query."""
     query = search_entry.get().lower()
-    expense_listbox.delete(0, tk.END)
 
     if not query:
-        update_expense_list()
+        search_scheduler.cancel()
+        expense_list.set_source(ledger.store.count, lambda offset, limit: ledger.store.query(limit=limit, offset=offset))
         return
 
-    filtered_expenses = [
-        exp for exp in expenses
-        if query in exp.get("category", "").lower() or query in exp["description"].lower() or query in exp.get("user",
-                                                                                                               "").lower() or query in exp.get(
-            "date", "").lower() or query in exp.get("invoice", "").lower()
-    ]
-
-    for exp in filtered_expenses:
-        user = exp.get("user", "Unknown")
-        currency = exp.get("currency", "HUF")
-        amount = exp.get("amount", 0)
-        date = exp.get("date", "N/A")
-        invoice = exp.get("invoice", "N/A")
-        display_text = f"INV#{invoice} | {date} | {amount:.2f} {currency} - {exp['category']} - {exp['description']} - by {user}"
-        expense_listbox.insert(tk.END, display_text)
+    # The search runs in the background; show_search_results() gets the newest result
+    search_scheduler.schedule(query, False)
 
 
 def save_and_print_report():
-    """Generates a PDF report for the selected user and opens it."""
+    """Starts generating a PDF report for the selected user in the background."""
+    global report_job
     selected_user = user_combobox.get()
     report_number = report_number_entry.get()
 
@@ -308,98 +429,269 @@ def save_and_print_report():
         messagebox.showerror("Selection Error", "Please select a user and enter an expense report number.")
         return
 
-    user_expenses = [exp for exp in expenses if exp.get("user") == selected_user]
-    if not user_expenses:
+    if report_job is not None:
+        messagebox.showinfo("Report Running", "Please wait until the current report is finished or cancel it.")
+        return
+
+    if not ledger.store.count(user=selected_user):
         messagebox.showinfo("No Data", f"No expenses found for {selected_user}.")
         return
 
-    # PDF generation logic
     file_name = f"expense_report_{report_number}.pdf"
-    doc = SimpleDocTemplate(file_name, pagesize=letter)
-    story = []
-
-    styles = getSampleStyleSheet()
-    title_style = styles['Title']
-    body_style = styles['Normal']
-    body_style.spaceAfter = 12
-
-    # Title with report number
-    title_text = f"Expense Report #{report_number}"
-    story.append(Paragraph(title_text, title_style))
-    story.append(Spacer(1, 12))
-
-    # User and Date
-    story.append(Paragraph(f"<b>User:</b> {selected_user}", body_style))
-    story.append(Paragraph(f"<b>Date:</b> {datetime.date.today()}", body_style))
-    story.append(Spacer(1, 12))
-
-    # Table of expenses
-    table_data = [['Invoice #', 'Date', 'Amount (HUF)', 'Original Amount', 'Currency', 'Category', 'Description']]
-
-    total_huf_report = 0
-    for exp in user_expenses:
-        amount_huf = convert_to_huf(exp.get("amount", 0), exp.get("currency", "HUF"))
-        table_data.append([
-            exp.get("invoice", "N/A"),
-            exp.get("date", "N/A"),
-            f"{amount_huf:.2f}",
-            f"{exp['amount']:.2f}",
-            exp.get("currency", "HUF"),
-            exp['category'],
-            exp['description']
-        ])
-        total_huf_report += amount_huf
-
-    table_style = TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-    ])
-
-    expense_table = Table(table_data)
-    expense_table.setStyle(table_style)
-    story.append(expense_table)
-    story.append(Spacer(1, 12))
-
-    # Total
-    total_eur = total_huf_report * HUF_TO_EUR_RATE
-    story.append(Paragraph(f"<b>Total Expenses for {selected_user}:</b> {total_huf_report:.2f} HUF", body_style))
-    story.append(Paragraph(f"<b>Total in EUR:</b> {total_eur:.2f} EUR", body_style))
-    story.append(Spacer(1, 24))
-
-    # Signature lines
-    signature_data = [
-        [f'Employee Name: {selected_user}', 'Approval Name: _______________'],
-        ['Signature: __________________', 'Signature: __________________']
-    ]
-    signature_table_style = TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('BOX', (0, 0), (0, -1), 1, colors.black),
-        ('BOX', (1, 0), (1, -1), 1, colors.black),
-        ('LEFTPADDING', (0, 0), (1, -1), 10),
-        ('RIGHTPADDING', (0, 0), (1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (1, -1), 10),
-    ])
-
-    signature_table = Table(signature_data, colWidths=[2.5 * 100, 2.5 * 100])
-    signature_table.setStyle(signature_table_style)
-    story.append(signature_table)
-
-    # Build the PDF
-    doc.build(story)
+    report_job = job_runner.submit(run_report_job, file_name, report_number, selected_user,
+                                   on_progress=on_report_progress, on_done=on_report_done,
+                                   on_error=on_report_error)
+    report_status_label.config(text=f"Generating report #{report_number}...")
+    report_progressbar.config(value=0)
+    report_frame.pack(pady=5)
+
+
+def run_report_job(job, file_name, report_number, user):
+    """Streams the user's expenses from the store into the PDF; runs on the job pool."""
+    return ledger.report(file_name, report_number, user, job.report_progress, job.is_cancelled)
+
+
+def on_report_progress(done, total):
+    """Shows how many expense rows of the report have been laid out."""
+    report_progressbar.config(maximum=max(total, 1), value=done)
+    report_status_label.config(text=f"Generating report: {done} of {total} expenses")
+
+
+def on_report_done(file_name):
+    """Hides the progress bar and opens the finished report."""
+    global report_job
+    report_job = None
+    report_frame.pack_forget()
     messagebox.showinfo("Report Generated", f"PDF report saved as '{file_name}'.")
 
     # Automatically open the PDF
     os.startfile(file_name)
 
 
+def on_report_error(error):
+    """Hides the progress bar after a report was cancelled or failed."""
+    global report_job
+    from reports import ReportCancelled
+
+    report_job = None
+    report_frame.pack_forget()
+    if not isinstance(error, ReportCancelled):
+        messagebox.showerror("Error", f"Could not generate the report: {error}")
+
+
+def cancel_report():
+    """Stops the report that is being generated."""
+    if report_job is not None:
+        report_job.cancel()
+        report_status_label.config(text="Cancelling report...")
+
+
+def save_all_reports():
+    """Starts generating the reports of every user, optionally one per month, in the background."""
+    global report_job
+    report_number = report_number_entry.get()
+
+    if not report_number:
+        messagebox.showerror("Selection Error", "Please enter an expense report number.")
+        return
+
+    if report_job is not None:
+        messagebox.showinfo("Report Running", "Please wait until the current report is finished or cancel it.")
+        return
+
+    if not len(ledger.columns):
+        messagebox.showinfo("No Data", "No expenses recorded to create reports.")
+        return
+
+    report_job = job_runner.submit(run_batch_report_job, report_number, per_month_var.get(),
+                                   on_progress=on_batch_progress, on_done=on_batch_done,
+                                   on_error=on_report_error)
+    report_status_label.config(text="Generating reports...")
+    report_progressbar.config(value=0)
+    report_frame.pack(pady=5)
+
+
+def run_batch_report_job(job, report_number, by_month):
+    """Reads the whole ledger once and builds every report on a process pool; runs on the job pool."""
+    return ledger.all_reports(report_number, by_month, job.report_progress, job.is_cancelled)
+
+
+def on_batch_progress(done, total):
+    """Shows how many reports of the batch are finished."""
+    report_progressbar.config(maximum=max(total, 1), value=done)
+    report_status_label.config(text=f"Generating reports: {done} of {total} done")
+
+
+def on_batch_done(result):
+    """Hides the progress bar and reports how fast the batch went."""
+    global report_job
+    report_job = None
+    report_frame.pack_forget()
+    files, seconds = result
+    rate = len(files) / seconds if seconds else 0
+    messagebox.showinfo("Reports Generated",
+                        f"{len(files)} PDF reports saved in {seconds:.1f} s ({rate:.1f} reports per second).")
+
+
+def load_ledger():
+    """Asks for a JSON or JSON Lines ledger and adds its expenses in the background."""
+    global ledger_job
+    if ledger_job is not None:
+        messagebox.showinfo("Ledger Loading", "Please wait until the current ledger is loaded.")
+        return
+    file_name = filedialog.askopenfilename(title="Load Ledger",
+                                           filetypes=[("JSON ledgers", "*.json *.jsonl"), ("All files", "*.*")])
+    if not file_name:
+        return
+    ledger_job = job_runner.submit(run_ledger_job, file_name, on_progress=on_ledger_progress,
+                                   on_done=on_ledger_done, on_error=on_ledger_error)
+    load_status_label.config(text="Loading ledger...")
+    load_status_label.pack(pady=5)
+
+
+def run_ledger_job(job, file_name):
+    """Parses the ledger a batch at a time and adds every batch to the store; runs on the job pool."""
+    return ledger.load_json(file_name, job.report_progress, job.is_cancelled)
+
+
+def on_ledger_progress(done, total):
+    """Shows the expenses loaded so far, so the first page is up before the rest is parsed."""
+    load_status_label.config(text=f"Loading ledger: {done} expenses so far")
+    update_expense_list()
+    update_total()
+
+
+def on_ledger_done(added):
+    """Hides the loading status and shows the complete ledger."""
+    global ledger_job
+    ledger_job = None
+    load_status_label.pack_forget()
+    update_expense_list()
+    update_total()
+    messagebox.showinfo("Ledger Loaded", f"{added} expenses have been added.")
+
+
+def on_ledger_error(error):
+    """Keeps what was loaded before the ledger turned out to be unreadable."""
+    global ledger_job
+    ledger_job = None
+    load_status_label.pack_forget()
+    update_expense_list()
+    update_total()
+    messagebox.showerror("Error", f"Could not load the ledger: {error}")
+
+
+def import_statement():
+    """Asks for a bank or card statement CSV and lets the user map its columns."""
+    if import_job is not None:
+        messagebox.showinfo("Import Running", "Please wait until the current import is finished.")
+        return
+    file_name = filedialog.askopenfilename(title="Import CSV",
+                                           filetypes=[("CSV files", "*.csv *.txt"), ("All files", "*.*")])
+    if not file_name:
+        return
+    try:
+        header = read_header(file_name)[0]
+    except (IOError, UnicodeDecodeError) as error:
+        messagebox.showerror("Error", f"Could not read the CSV file: {error}")
+        return
+    CsvImportDialog(root, header, guess_mapping(header), users, categories,
+                    lambda settings: start_import(file_name, settings))
+
+
+def start_import(file_name, settings):
+    """Starts importing the statement in the background with the chosen column mapping."""
+    global import_job
+    import_job = job_runner.submit(run_import_job, file_name, settings, on_progress=on_import_progress,
+                                   on_done=on_import_done, on_error=on_import_error)
+    load_status_label.config(text="Importing CSV...")
+    load_status_label.pack(pady=5)
+
+
+def run_import_job(job, file_name, settings):
+    """Parses and validates the whole file, then adds the new rows in one transaction; runs on the job pool."""
+    return ledger.import_csv(file_name, job.report_progress, job.is_cancelled, **settings)
+
+
+def on_import_progress(done, total):
+    """Shows how many rows have been read; the list itself is refreshed once, at the end."""
+    load_status_label.config(text=f"Importing CSV: {done} rows read")
+
+
+def on_import_done(result):
+    """Refreshes the list and totals once and reports the rows that were left out."""
+    global import_job
+    import_job = None
+    load_status_label.pack_forget()
+    update_expense_list()
+    update_total()
+    added, errors, duplicates = result
+    message = f"{added} expenses have been imported."
+    if duplicates:
+        message += f"\n{duplicates} rows were already recorded and have been skipped."
+    if errors:
+        shown = "\n".join(f"Line {line}: {error}" for line, error in errors[:10])
+        more = f"\n...and {len(errors) - 10} more" if len(errors) > 10 else ""
+        message += f"\n\n{len(errors)} rows were left out:\n{shown}{more}"
+    messagebox.showinfo("Import Finished", message)
+
+
+def on_import_error(error):
+    """Reports an import that failed before anything was added."""
+    global import_job
+    import_job = None
+    load_status_label.pack_forget()
+    if not isinstance(error, ImportCancelled):
+        messagebox.showerror("Error", f"Could not import the CSV file: {error}")
+
+
+def export_ledger():
+    """Asks which expenses to export and starts writing them in the background."""
+    if report_job is not None:
+        messagebox.showinfo("Report Running", "Please wait until the current report is finished or cancel it.")
+        return
+    ExportDialog(root, users, categories, start_export)
+
+
+def start_export(file_name, filters):
+    """Starts streaming the chosen expenses to file_name; shares the report progress bar."""
+    global report_job
+    report_job = job_runner.submit(run_export_job, file_name, filters, on_progress=on_export_progress,
+                                   on_done=on_export_done, on_error=on_export_error)
+    report_status_label.config(text="Exporting...")
+    report_progressbar.config(value=0)
+    report_frame.pack(pady=5)
+
+
+def run_export_job(job, file_name, filters):
+    """Writes the export a chunk at a time; runs on the job pool."""
+    return file_name, ledger.export(file_name, job.report_progress, job.is_cancelled, **filters)
+
+
+def on_export_progress(done, total):
+    """Shows how many expenses have been written."""
+    report_progressbar.config(maximum=max(total, 1), value=done)
+    report_status_label.config(text=f"Exporting: {done} of {total} expenses")
+
+
+def on_export_done(result):
+    """Hides the progress bar and says where the export went."""
+    global report_job
+    report_job = None
+    report_frame.pack_forget()
+    file_name, written = result
+    messagebox.showinfo("Export Finished", f"{written} expenses exported to '{file_name}'.")
+
+
+def on_export_error(error):
+    """Hides the progress bar after an export was cancelled or failed."""
+    global report_job
+    report_job = None
+    report_frame.pack_forget()
+    if not isinstance(error, ExportCancelled):
+        messagebox.showerror("Error", f"Could not export the expenses: {error}")
+
+
 def on_category_select(event):
     """Changes the state of the Combobox to allow or prevent manual entry."""
     if category_combobox.get() == "Else":
@@ -408,91 +700,158 @@ def on_category_select(event):
         category_combobox.config(state="readonly")
 
 
+def on_first_window():
+    """Runs once the main window is on screen."""
+    if STARTUP_TIMING:
+        root.wait_visibility()
+        print(f"Time to first window: {time.perf_counter() - STARTED:.3f} s", flush=True)
+        # Nothing has been changed that needs saving
+        os._exit(0)
+    if WARM_UP:
+        root.after(WARM_UP_DELAY_MS, warm_up, *WARM_UP_MODULES)
+
+
+def on_close():
+    """Closes the expense store before the window closes."""
+    cancel_report()
+    for job in (ledger_job, import_job):
+        if job is not None:
+            job.cancel()
+    job_runner.shutdown()
+    save_expenses()
+    root.destroy()
+
+
 # --- GUI Setup ---
-root = tk.Tk()
-root.title("Expense Tracker")
-
-style = ttk.Style()
-style.theme_use("clam")
-style.configure("TFrame", background="#F0F0F0")
-style.configure("TButton", background="#007BFF", foreground="white", font=("Helvetica", 10, "bold"))
-style.map("TButton", background=[("active", "#0056b3")])
-style.configure("TLabel", background="#F0F0F0")
-
-input_frame = ttk.Frame(root, padding="10")
-input_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
-display_frame = ttk.Frame(root, padding="10")
-display_frame.grid(row=1, column=0, sticky=(tk.W, tk.E))
-
-# --- Input Widgets ---
-ttk.Label(input_frame, text="Expense Report Number:").grid(row=0, column=0, sticky=tk.W)
-report_number_entry = ttk.Entry(input_frame, width=20)
-report_number_entry.grid(row=0, column=1, columnspan=2, sticky=tk.W)
-
-ttk.Label(input_frame, text="Amount:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
-amount_entry = ttk.Entry(input_frame, width=15)
-amount_entry.grid(row=1, column=1, sticky=tk.W, pady=(5, 0))
-
-ttk.Label(input_frame, text="Currency:").grid(row=1, column=2, sticky=tk.W, padx=(10, 0), pady=(5, 0))
-currency_combobox = ttk.Combobox(input_frame, values=list(CURRENCY_RATES.keys()), width=7)
-currency_combobox.grid(row=1, column=3, sticky=tk.W, pady=(5, 0))
-currency_combobox.set('HUF')
-currency_combobox.config(state="readonly")
-
-ttk.Label(input_frame, text="Invoice Number:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
-invoice_entry = ttk.Entry(input_frame, width=20)
-invoice_entry.grid(row=2, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
-
-ttk.Label(input_frame, text="Category:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
-category_combobox = ttk.Combobox(input_frame, values=categories, width=17)
-category_combobox.config(state="readonly")
-category_combobox.grid(row=3, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
-category_combobox.bind("<<ComboboxSelected>>", on_category_select)
-
-ttk.Label(input_frame, text="Description:").grid(row=4, column=0, sticky=tk.W, pady=(5, 0))
-description_entry = ttk.Entry(input_frame, width=20)
-description_entry.grid(row=4, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
-
-ttk.Label(input_frame, text="User:").grid(row=5, column=0, sticky=tk.W, pady=(5, 0))
-user_combobox = ttk.Combobox(input_frame, values=users, width=17)
-user_combobox.grid(row=5, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
-
-ttk.Label(input_frame, text="Date (YYYY-MM-DD):").grid(row=6, column=0, sticky=tk.W, pady=(5, 0))
-date_entry = ttk.Entry(input_frame, width=20)
-date_entry.grid(row=6, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
-date_entry.insert(0, datetime.date.today().strftime('%Y-%m-%d'))
-
-add_button = ttk.Button(input_frame, text="Add Expense", command=add_expense)
-add_button.grid(row=7, column=0, sticky=tk.W, pady=10)
-
-ttk.Label(input_frame, text="Search:").grid(row=8, column=0, sticky=tk.W, pady=(10, 0))
-search_entry = ttk.Entry(input_frame, width=20)
-search_entry.grid(row=8, column=1, columnspan=2, sticky=tk.W, pady=(10, 0))
-search_entry.bind("<KeyRelease>", filter_expenses)
-
-# --- Display Widgets ---
-expense_listbox = tk.Listbox(display_frame, height=10, width=80)
-expense_listbox.pack(pady=10)
-expense_listbox.bind('<<ListboxSelect>>', on_list_select)
-
-action_button_frame = ttk.Frame(display_frame)
-action_button_frame.pack(pady=5)
-
-delete_button = ttk.Button(action_button_frame, text="Delete", command=delete_expense)
-modify_button = ttk.Button(action_button_frame, text="Modify", command=modify_expense)
-show_chart_button = ttk.Button(action_button_frame, text="Show Chart", command=show_expense_chart)
-save_pdf_button = ttk.Button(action_button_frame, text="Save & Print Report", command=save_and_print_report)
-
-delete_button.pack_forget()
-modify_button.pack_forget()
-show_chart_button.pack(side=tk.LEFT, padx=5)
-save_pdf_button.pack(side=tk.LEFT, padx=5)
-
-total_label = ttk.Label(display_frame, text="Total Spent: 0.00 HUF", font=("Helvetica", 12, "bold"))
-total_label.pack(pady=5)
-total_eur_label = ttk.Label(display_frame, text="Total in EUR: 0.00 EUR", font=("Helvetica", 10))
-total_eur_label.pack(pady=5)
-
-# --- Final Code Execution ---
-# load_expenses()
-root.mainloop()
\ No newline at end of file
+# Worker processes of the batch reports import this script again; only the app itself builds the window
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Expense Tracker")
+    search_scheduler = SearchScheduler(root, ledger.search_index, show_search_results)
+    job_runner = JobRunner(root)
+
+    style = ttk.Style()
+    style.theme_use("clam")
+    style.configure("TFrame", background="#F0F0F0")
+    style.configure("TButton", background="#007BFF", foreground="white", font=("Helvetica", 10, "bold"))
+    style.map("TButton", background=[("active", "#0056b3")])
+    style.configure("TLabel", background="#F0F0F0")
+
+    input_frame = ttk.Frame(root, padding="10")
+    input_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
+    display_frame = ttk.Frame(root, padding="10")
+    display_frame.grid(row=1, column=0, sticky=(tk.N, tk.S, tk.W, tk.E))
+    # Let the expense list grow with the window
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(1, weight=1)
+
+    # --- Input Widgets ---
+    ttk.Label(input_frame, text="Expense Report Number:").grid(row=0, column=0, sticky=tk.W)
+    report_number_entry = ttk.Entry(input_frame, width=20)
+    report_number_entry.grid(row=0, column=1, columnspan=2, sticky=tk.W)
+
+    ttk.Label(input_frame, text="Amount:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+    amount_entry = ttk.Entry(input_frame, width=15)
+    amount_entry.grid(row=1, column=1, sticky=tk.W, pady=(5, 0))
+
+    ttk.Label(input_frame, text="Currency:").grid(row=1, column=2, sticky=tk.W, padx=(10, 0), pady=(5, 0))
+    currency_combobox = ttk.Combobox(input_frame, values=list(CURRENCY_RATES.keys()), width=7)
+    currency_combobox.grid(row=1, column=3, sticky=tk.W, pady=(5, 0))
+    currency_combobox.set('HUF')
+    currency_combobox.config(state="readonly")
+
+    ttk.Label(input_frame, text="Invoice Number:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+    invoice_entry = ttk.Entry(input_frame, width=20)
+    invoice_entry.grid(row=2, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+
+    ttk.Label(input_frame, text="Category:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+    category_combobox = ttk.Combobox(input_frame, values=categories, width=17)
+    category_combobox.config(state="readonly")
+    category_combobox.grid(row=3, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+    category_combobox.bind("<<ComboboxSelected>>", on_category_select)
+
+    ttk.Label(input_frame, text="Description:").grid(row=4, column=0, sticky=tk.W, pady=(5, 0))
+    description_entry = ttk.Entry(input_frame, width=20)
+    description_entry.grid(row=4, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+
+    ttk.Label(input_frame, text="User:").grid(row=5, column=0, sticky=tk.W, pady=(5, 0))
+    user_combobox = ttk.Combobox(input_frame, values=users, width=17)
+    user_combobox.grid(row=5, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+
+    ttk.Label(input_frame, text="Date (YYYY-MM-DD):").grid(row=6, column=0, sticky=tk.W, pady=(5, 0))
+    date_entry = ttk.Entry(input_frame, width=20)
+    date_entry.grid(row=6, column=1, columnspan=2, sticky=tk.W, pady=(5, 0))
+    date_entry.insert(0, datetime.date.today().strftime('%Y-%m-%d'))
+
+    add_button = ttk.Button(input_frame, text="Add Expense", command=add_expense)
+    add_button.grid(row=7, column=0, sticky=tk.W, pady=10)
+    load_ledger_button = ttk.Button(input_frame, text="Load Ledger...", command=load_ledger)
+    load_ledger_button.grid(row=7, column=1, sticky=tk.W, pady=10)
+    import_csv_button = ttk.Button(input_frame, text="Import CSV...", command=import_statement)
+    import_csv_button.grid(row=7, column=2, columnspan=2, sticky=tk.W, pady=10)
+
+    ttk.Label(input_frame, text="Search:").grid(row=8, column=0, sticky=tk.W, pady=(10, 0))
+    search_entry = ttk.Entry(input_frame, width=20)
+    search_entry.grid(row=8, column=1, columnspan=2, sticky=tk.W, pady=(10, 0))
+    search_entry.bind("<KeyRelease>", filter_expenses)
+
+    # --- Display Widgets ---
+    # The list, with the category chart to its right once it is shown
+    list_frame = ttk.Frame(display_frame)
+    list_frame.pack(pady=10, fill=tk.BOTH, expand=True)
+    expense_list = VirtualExpenseList(list_frame, height=10, on_select=on_list_select)
+    expense_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    action_button_frame = ttk.Frame(display_frame)
+    action_button_frame.pack(pady=5)
+
+    undo_button = ttk.Button(action_button_frame, text="Undo", command=undo_change, state=tk.DISABLED)
+    redo_button = ttk.Button(action_button_frame, text="Redo", command=redo_change, state=tk.DISABLED)
+    delete_button = ttk.Button(action_button_frame, text="Delete", command=delete_expense)
+    modify_button = ttk.Button(action_button_frame, text="Modify", command=modify_expense)
+    show_chart_button = ttk.Button(action_button_frame, text="Show Chart", command=show_expense_chart)
+    show_spending_button = ttk.Button(action_button_frame, text="Spending Over Time", command=show_spending_chart)
+    save_pdf_button = ttk.Button(action_button_frame, text="Save & Print Report", command=save_and_print_report)
+    save_all_button = ttk.Button(action_button_frame, text="Save All Reports", command=save_all_reports)
+    export_button = ttk.Button(action_button_frame, text="Export...", command=export_ledger)
+    per_month_var = tk.BooleanVar(value=False)
+    per_month_check = ttk.Checkbutton(action_button_frame, text="Per month", variable=per_month_var)
+
+    undo_button.pack(side=tk.LEFT, padx=5)
+    redo_button.pack(side=tk.LEFT, padx=5)
+    delete_button.pack_forget()
+    modify_button.pack_forget()
+    show_chart_button.pack(side=tk.LEFT, padx=5)
+    show_spending_button.pack(side=tk.LEFT, padx=5)
+    save_pdf_button.pack(side=tk.LEFT, padx=5)
+    save_all_button.pack(side=tk.LEFT, padx=5)
+    per_month_check.pack(side=tk.LEFT, padx=5)
+    export_button.pack(side=tk.LEFT, padx=5)
+
+    # Progress of the report being generated; only shown while one is running
+    report_frame = ttk.Frame(display_frame)
+    report_status_label = ttk.Label(report_frame, text="")
+    report_status_label.pack(side=tk.LEFT, padx=5)
+    report_progressbar = ttk.Progressbar(report_frame, length=200, mode="determinate")
+    report_progressbar.pack(side=tk.LEFT, padx=5)
+    cancel_report_button = ttk.Button(report_frame, text="Cancel", command=cancel_report)
+    cancel_report_button.pack(side=tk.LEFT, padx=5)
+
+    # Progress of a ledger load or CSV import; only shown while one is running
+    load_status_label = ttk.Label(display_frame, text="")
+
+    total_label = ttk.Label(display_frame, text="Total Spent: 0.00 HUF", font=("Helvetica", 12, "bold"))
+    total_label.pack(pady=5)
+    total_eur_label = ttk.Label(display_frame, text="Total in EUR: 0.00 EUR", font=("Helvetica", 10))
+    total_eur_label.pack(pady=5)
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.bind_all("<Control-z>", undo_change)
+    root.bind_all("<Control-y>", redo_change)
+    root.bind_all("<Control-Shift-Z>", redo_change)
+
+    # --- Final Code Execution ---
+    # The store has to be opened before anything is added
+    root.after_idle(on_first_window)
+    load_expenses()
+    root.mainloop()
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+
+from currency import fixed_factor
+
+# Set EXPENSE_TRACKER_DEBUG=1 to compare the expense columns with a full recompute after every change
+DEBUG = os.environ.get("EXPENSE_TRACKER_DEBUG", "") not in ("", "0")
+
+
+class RunningTotals:
+    """Totals worked out from grouped sums, to check ExpenseColumns against its store.
+
+    total_huf is the whole ledger in HUF minor units, by_currency holds the
+    minor units spent in each original currency, and by_user / by_category
+    hold HUF totals. The matching *_counts dicts let keys disappear once their
+    last expense is gone. HUF values are exact Fractions left unrounded, so
+    totals from differently grouped sums compare equal.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        """Empties every total."""
+        self.total_huf = 0
+        self.count = 0
+        self.by_currency = {}
+        self.by_user = {}
+        self.by_category = {}
+        self.currency_counts = {}
+        self.user_counts = {}
+        self.category_counts = {}
+
+    def load(self, store):
+        """Starts over from the grouped totals of a store, or of anything else with group_totals()."""
+        self._reset()
+        for (user, category, currency), (amount, count) in store.group_totals().items():
+            amount_huf = amount * fixed_factor(currency)
+            self.total_huf += amount_huf
+            self.count += count
+            _bump(self.by_currency, self.currency_counts, currency, amount, count)
+            _bump(self.by_user, self.user_counts, user, amount_huf, count)
+            _bump(self.by_category, self.category_counts, category, amount_huf, count)
+
+    def differences(self, other):
+        """Describes where these totals differ from other."""
+        mismatches = []
+        if self.count != other.count:
+            mismatches.append(f"count {self.count} != {other.count}")
+        if self.total_huf != other.total_huf:
+            mismatches.append(f"total_huf {self.total_huf} != {other.total_huf}")
+        for name in ("by_currency", "by_user", "by_category"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            for key in mine.keys() | theirs.keys():
+                if key not in mine or key not in theirs or mine[key] != theirs[key]:
+                    mismatches.append(f"{name}[{key!r}] {mine.get(key)} != {theirs.get(key)}")
+        return mismatches
+
+
+def _bump(totals, counts, key, amount, count):
+    """Adds amount and count to one key, dropping the key when its count reaches zero."""
+    remaining = counts.get(key, 0) + count
+    if remaining:
+        counts[key] = remaining
+        totals[key] = totals.get(key, 0) + amount
+    else:
+        counts.pop(key, None)
+        totals.pop(key, None)
+
@@ -0,0 +1,176 @@
+import http.client
+import json
+import threading
+from urllib.parse import urlencode, urlsplit
+
+from expense_store import ROW_FIELDS, ConflictError
+
+# Where api_server listens by default
+API_URL = "http://127.0.0.1:8765"
+
+# Expenses fetched per request while iterating over a whole query
+PAGE_ROWS = 5000
+
+# Ids looked up per GET /expenses?ids= request
+IDS_PER_REQUEST = 500
+
+
+class ApiRequestError(IOError):
+    """A request to the expense service failed or was refused."""
+
+
+class HttpExpenseStore:
+    """Expense store backed by api_server over HTTP, so the GUI can run as its client.
+
+    It offers the store API the GUI and Ledger use. Writes are sent as
+    /operations and come back to the listeners through the service's change
+    log; poll() fetches the changes made by everyone else, and returns
+    "reset" when too many were missed and everything has to be reloaded.
+    One keep-alive connection is shared under self.lock.
+    """
+
+    def __init__(self, url=API_URL, timeout=30):
+        parts = urlsplit(url)
+        self.url = url
+        self.lock = threading.Lock()
+        # Keeps two polls from handing the same changes to the listeners
+        self.poll_lock = threading.Lock()
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        self.listeners = []
+        self.version = self._request("GET", "/changes", {"since": 0})["version"]
+
+    def _request(self, method, path, params=None, body=None):
+        """Sends one request and returns the decoded JSON answer."""
+        if params:
+            path += "?" + urlencode({name: value for name, value in params.items() if value is not None})
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        with self.lock:
+            for attempt in (1, 2):
+                try:
+                    self.conn.request(method, path, body=data, headers=headers)
+                    response = self.conn.getresponse()
+                    payload = json.loads(response.read() or b"null")
+                    break
+                except (http.client.HTTPException, OSError) as error:
+                    # A dropped connection is reopened once for reads; a write may have gone through
+                    self.conn.close()
+                    if attempt == 2 or method != "GET":
+                        raise ApiRequestError(f"Could not reach the expense service at {self.url}: {error}")
+        if response.status == 404 and method == "GET":
+            return None
+        if response.status >= 400:
+            message = payload.get("error") if isinstance(payload, dict) else payload
+            if response.status == 409:
+                raise ConflictError(message)
+            raise ApiRequestError(f"The expense service answered {response.status}: {message}")
+        return payload
+
+    def subscribe(self, listener):
+        """Registers listener(changes); see SQLiteExpenseStore.subscribe. Called from poll()."""
+        self.listeners.append(listener)
+
+    def poll(self):
+        """Hands the changes made since the last poll to the listeners.
+
+        Returns how many changes there were, or "reset" if the service no
+        longer has all of them and the caller has to reload.
+        """
+        with self.poll_lock:
+            answer = self._request("GET", "/changes", {"since": self.version})
+            self.version = answer["version"]
+            if answer.get("reset"):
+                return "reset"
+            changes = [(op, expense_id, old, new) for version, op, expense_id, old, new in answer["changes"]]
+            if changes:
+                for listener in self.listeners:
+                    listener(changes)
+            return len(changes)
+
+    def apply_many(self, operations, written=None):
+        """Applies (op, expense_id, record) operations in one commit; see SQLiteExpenseStore.apply_many."""
+        answer = self._request("POST", "/operations", body=[list(operation) for operation in operations])
+        if written is not None:
+            written.extend(tuple(change) for change in answer["changes"])
+        self.poll()
+        return answer["ids"]
+
+    def add(self, record):
+        """Adds an expense and returns its id."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Adds several expenses in one commit and returns their ids; the service hands out new ids."""
+        return self.apply_many([("add", None, record) for record in records])
+
+    def update(self, expense_id, record, expected=None):
+        """Replaces the fields of an existing expense; see SQLiteExpenseStore.apply_many() for expected."""
+        self.apply_many([("modify", expense_id, record, expected)])
+
+    def delete(self, expense_id, expected=None):
+        """Removes an expense; see SQLiteExpenseStore.apply_many() for expected."""
+        self.apply_many([("delete", expense_id, None, expected)])
+
+    def get(self, expense_id):
+        """Returns a single expense or None."""
+        return self._request("GET", f"/expenses/{int(expense_id)}")
+
+    def get_many(self, expense_ids):
+        """Returns the expenses with the given ids, in the same order, skipping missing ones."""
+        expense_ids = list(expense_ids)
+        found = []
+        for start in range(0, len(expense_ids), IDS_PER_REQUEST):
+            chunk = expense_ids[start:start + IDS_PER_REQUEST]
+            found.extend(self._request("GET", "/expenses", {"ids": ",".join(map(str, chunk))}))
+        return found
+
+    def query(self, limit=None, offset=0, **filters):
+        """Yields the expenses matching the filters in insertion order."""
+        if limit is not None:
+            yield from self._request("GET", "/expenses", dict(filters, limit=limit, offset=offset))
+            return
+        # A whole query is paged by id, which costs the service nothing per page
+        after = None
+        skip = offset
+        while True:
+            page = self._request("GET", "/expenses", dict(filters, after=after, limit=PAGE_ROWS))
+            for record in page:
+                if skip:
+                    skip -= 1
+                else:
+                    yield record
+            if len(page) < PAGE_ROWS:
+                return
+            after = page[-1]["id"]
+
+    def query_rows(self, **filters):
+        """Yields the expenses matching the filters as tuples of ROW_FIELDS, in insertion order."""
+        for record in self.query(**filters):
+            yield tuple(record[field] for field in ROW_FIELDS)
+
+    def count(self, **filters):
+        """Returns how many expenses match the filters."""
+        return self._request("GET", "/count", filters)["count"]
+
+    def search(self, text):
+        """Yields the expenses whose category, description, user, date or invoice contain text."""
+        yield from self.get_many(self.search_ids(text))
+
+    def search_ids(self, text):
+        """Returns the ids of the expenses that search() would yield."""
+        return self._request("GET", "/search", {"q": text})["ids"]
+
+    def totals_by(self, column, **filters):
+        """Returns the summed minor units grouped by column and currency, e.g. {("Food", "EUR"): 5000}."""
+        rows = self._request("GET", "/totals_by", dict(filters, column=column))
+        return {(key, currency): total for key, currency, total in rows}
+
+    def group_totals(self):
+        """Returns {(user, category, currency): (summed minor units, count)} over the whole ledger."""
+        return {(user, category, currency): (total, count)
+                for user, category, currency, total, count in self._request("GET", "/group_totals")}
+
+    def close(self):
+        """Closes the connection; the service keeps the data."""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,458 @@
+"""Local HTTP/JSON service that lets several people add and look up expenses at the same time.
+
+Every change goes through a single writer task: requests that arrive while
+a commit is running queue up and are written together in the next one, so
+a burst of adds costs one transaction instead of one each. Reads run on a
+thread pool, each thread with its own SQLite connection; with the
+database in WAL mode they see the last commit and never wait for the
+writer. What other processes, like the command line, write to the same
+database is picked up every POLL_SECONDS and shows in /changes too. The
+GUI can use the service through api_client.HttpExpenseStore.
+
+Endpoints (bodies and answers are JSON):
+    GET    /expenses?user=&category=&currency=&invoice=&date_from=&date_to=&after=&limit=&offset=
+    GET    /expenses?ids=1,2,3
+    GET    /expenses/<id>
+    POST   /expenses                     one expense or a list of them
+    PUT    /expenses/<id>
+    DELETE /expenses/<id>
+    POST   /operations                   [[op, id, expense, expected], ...], see store.apply_many();
+                                         answers the ids and the changes made
+    GET    /count?<filters>
+    GET    /search?q=
+    GET    /totals?by=user|category|currency&currency=HUF
+    GET    /totals_by?column=&<filters>  summed minor units per column value and currency
+    GET    /group_totals
+    POST   /duplicates                   {"expense": {...}, "exclude": id}
+    GET    /changes?since=<version>
+    POST   /reports                      {"user": "A", "number": "17"}
+
+Amounts of expenses are numbers of whole units, as in the ledger files;
+/totals answers in whole units too, while /totals_by and /group_totals
+hand out the stores' exact integer sums of minor units (see currency.py).
+
+Usage: python api_server.py [--host 127.0.0.1] [--port 8765] [--db expenses.db]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from currency import CURRENCY_RATES, from_minor
+from expense_store import DEFAULT_BACKEND, FIELDS, GROUP_COLUMNS, ConflictError, SQLiteExpenseStore
+from ledger import Ledger
+
+API_HOST = "127.0.0.1"
+API_PORT = 8765
+
+# Operations written in one group commit at most
+MAX_BATCH = 1000
+
+# Changes kept for clients catching up through /changes; older clients reload
+CHANGE_LOG_SIZE = 100000
+
+# Seconds between looks for what other processes wrote to the store
+POLL_SECONDS = 1.0
+
+# Threads serving reads, each with its own database connection
+READER_THREADS = 8
+
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024 * 1024
+
+# Expenses returned by GET /expenses when no limit is given, and at most
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+
+FILTERS = ("user", "category", "currency", "invoice", "date_from", "date_to")
+TEXT_FIELDS = ("currency", "category", "description", "user", "date", "invoice")
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    """An error answered with an HTTP status and a JSON {"error": message}."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def validate_expense(expense):
+    """Returns an expense from a request body, or raises ApiError(400)."""
+    if not isinstance(expense, dict):
+        raise ApiError(400, "An expense must be a JSON object")
+    unknown = set(expense) - set(FIELDS) - {"id"}
+    if unknown:
+        raise ApiError(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    record = {field: expense[field] for field in FIELDS if field in expense}
+    amount = record.get("amount", 0)
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        raise ApiError(400, "amount must be a number")
+    for field in TEXT_FIELDS:
+        if field in record and not isinstance(record[field], str):
+            raise ApiError(400, f"{field} must be a string")
+    if record.get("currency", "HUF") not in CURRENCY_RATES:
+        raise ApiError(400, f"Unknown currency {record['currency']!r}")
+    return record
+
+
+def validate_operation(operation):
+    """Returns an (op, id, record, expected) operation from a request body, or raises ApiError(400).
+
+    expected, the expense as the client read it, may be left out or null.
+    """
+    if not isinstance(operation, list) or len(operation) not in (3, 4):
+        raise ApiError(400, "An operation must be [op, id, expense] or [op, id, expense, expected]")
+    op, expense_id, expense = operation[:3]
+    expected = operation[3] if len(operation) == 4 else None
+    if op == "add":
+        # Ids are handed out by the store
+        return "add", None, validate_expense(expense), None
+    if not isinstance(expense_id, int):
+        raise ApiError(400, f"{op} needs an integer id")
+    if expected is not None:
+        expected = validate_expense(expected)
+    if op == "modify":
+        return "modify", expense_id, validate_expense(expense), expected
+    if op == "delete":
+        return "delete", expense_id, None, expected
+    raise ApiError(400, f"Unknown operation {op!r}")
+
+
+def query_filters(params):
+    """Returns the store filters given in a query string."""
+    filters = {name: params[name][0] for name in FILTERS if name in params}
+    if "after" in params:
+        filters["after"] = int_param(params, "after")
+    return filters
+
+
+def int_param(params, name, default=None):
+    """Returns an integer query parameter, or raises ApiError(400)."""
+    if name not in params:
+        return default
+    try:
+        return int(params[name][0])
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+
+
+class ExpenseServer:
+    """Serves a Ledger over HTTP with one writer task and a pool of readers."""
+
+    def __init__(self, ledger, host=API_HOST, port=API_PORT):
+        self.ledger = ledger
+        self.host = host
+        self.port = port
+        self.queue = None
+        self.readers = ThreadPoolExecutor(READER_THREADS)
+        self.writer_pool = ThreadPoolExecutor(1)
+        self.local = threading.local()
+        # Numbered store changes for /changes; written on the writer thread
+        self.changes_lock = threading.Lock()
+        self.version = 0
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)
+        ledger.store.subscribe(self._log_changes)
+
+    def _log_changes(self, changes):
+        with self.changes_lock:
+            for op, expense_id, old, new in changes:
+                self.version += 1
+                self.changes.append((self.version, op, expense_id, old, new))
+
+    def _poll(self):
+        """Takes over what other processes wrote; clients have to reload if the ledger was reloaded."""
+        if self.ledger.poll() == "reset":
+            with self.changes_lock:
+                # Every version a client holds is now older than the oldest change kept
+                self.version += 1
+                self.changes.clear()
+
+    def _reader_store(self):
+        """Returns the store reads should use on this thread: its own connection where possible."""
+        store = self.ledger.store
+        if not isinstance(store, SQLiteExpenseStore) or store.path == ":memory:":
+            return store
+        reader = getattr(self.local, "store", None)
+        if reader is None:
+            reader = self.local.store = SQLiteExpenseStore(store.path)
+        return reader
+
+    async def read(self, fn, *args):
+        """Runs fn(store, *args) on a reader thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, lambda: fn(self._reader_store(), *args))
+
+    async def write(self, operations, written=None):
+        """Queues operations for the writer task and returns their ids once committed.
+
+        written, if given, is extended with the changes of these operations; see store.apply_many().
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((operations, future))
+        ids, changes = await future
+        if written is not None:
+            written.extend(changes)
+        return ids
+
+    async def _write_loop(self):
+        """Writes everything queued since the last commit in one store.apply_many() call.
+
+        Requests with version-checked operations are committed on their own,
+        so a conflict only fails the request that caused it.
+        """
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            while not self.queue.empty() and size < MAX_BATCH:
+                batch.append(self.queue.get_nowait())
+                size += len(batch[-1][0])
+            grouped = [request for request in batch if not any(operation[3] for operation in request[0])]
+            checked = [[request] for request in batch if any(operation[3] for operation in request[0])]
+            for requests in ([grouped] if grouped else []) + checked:
+                await self._commit(requests)
+
+    async def _commit(self, requests):
+        """Applies the operations of several (operations, future) requests in one transaction."""
+        operations = [operation for operations, future in requests for operation in operations]
+        written = []
+        try:
+            ids = await asyncio.get_running_loop().run_in_executor(self.writer_pool, self.ledger.store.apply_many,
+                                                                   operations, written)
+        except Exception as error:
+            # The operations were one transaction; every request in it gets the error
+            for operations, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        position = 0
+        # One change per id that is not None, in the order of the operations
+        changes = iter(written)
+        for operations, future in requests:
+            request_ids = ids[position:position + len(operations)]
+            request_changes = [next(changes) for expense_id in request_ids if expense_id is not None]
+            if not future.done():
+                future.set_result((request_ids, request_changes))
+            position += len(operations)
+
+    async def _poll_loop(self):
+        """Passes on the changes other processes, like the command line, make to the store.
+
+        Polling runs on the writer thread, so it never overlaps a commit.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(POLL_SECONDS)
+            try:
+                await loop.run_in_executor(self.writer_pool, self._poll)
+            except (OSError, sqlite3.Error):
+                # The file may be locked for a moment; try again at the next poll
+                pass
+
+    async def serve(self):
+        """Runs the service until cancelled."""
+        self.queue = asyncio.Queue()
+        writer_task = asyncio.create_task(self._write_loop())
+        poll_task = asyncio.create_task(self._poll_loop())
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            poll_task.cancel()
+            self.readers.shutdown()
+            self.writer_pool.shutdown()
+
+    async def _handle(self, reader, writer):
+        """Answers the requests of one connection, keeping it open between them."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "Request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, payload = await self._dispatch(method, target, body)
+                except ApiError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except ConflictError as error:
+                    status, payload = 409, {"error": str(error)}
+                except (OSError, ValueError, sqlite3.Error) as error:
+                    status, payload = 500, {"error": str(error)}
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n")
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
+
+    async def _dispatch(self, method, target, body):
+        """Returns the (status, payload) of one request."""
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            raise ApiError(400, "The request body is not valid JSON")
+        route = parts[0] if parts else ""
+
+        if route == "expenses" and len(parts) == 2:
+            try:
+                expense_id = int(parts[1])
+            except ValueError:
+                raise ApiError(404, "No such expense")
+            if method == "GET":
+                expense = await self.read(lambda store: store.get(expense_id))
+            elif method == "PUT":
+                ids = await self.write([("modify", expense_id, validate_expense(data), None)])
+                expense = {"id": ids[0]} if ids[0] is not None else None
+            elif method == "DELETE":
+                ids = await self.write([("delete", expense_id, None, None)])
+                expense = {"id": ids[0]} if ids[0] is not None else None
+            else:
+                raise ApiError(405, f"{method} is not allowed here")
+            if expense is None:
+                raise ApiError(404, "No such expense")
+            return 200, expense
+        if route == "expenses" and method == "GET":
+            if "ids" in params:
+                try:
+                    ids = [int(text) for text in params["ids"][0].split(",") if text]
+                except ValueError:
+                    raise ApiError(400, "ids must be integers")
+                return 200, await self.read(lambda store: store.get_many(ids))
+            limit = min(int_param(params, "limit", DEFAULT_LIMIT), MAX_LIMIT)
+            offset = int_param(params, "offset", 0)
+            filters = query_filters(params)
+            return 200, await self.read(lambda store: list(store.query(limit, offset, **filters)))
+        if route == "expenses" and method == "POST":
+            expenses = data if isinstance(data, list) else [data]
+            ids = await self.write([("add", None, validate_expense(expense), None) for expense in expenses])
+            return 201, {"ids": ids}
+        if route == "operations" and method == "POST":
+            if not isinstance(data, list):
+                raise ApiError(400, "Expected a list of operations")
+            written = []
+            ids = await self.write([validate_operation(operation) for operation in data], written)
+            return 200, {"ids": ids, "changes": [list(change) for change in written]}
+        if route == "count" and method == "GET":
+            filters = query_filters(params)
+            return 200, {"count": await self.read(lambda store: store.count(**filters))}
+        if route == "search" and method == "GET":
+            query = params.get("q", [""])[0]
+            ids = await self.read(lambda store: self.ledger.search_index.search(query))
+            return 200, {"ids": ids}
+        if route == "totals" and method == "GET":
+            return 200, await self.read(lambda store: self._totals(params))
+        if route == "totals_by" and method == "GET":
+            column = params.get("column", [""])[0]
+            if column not in GROUP_COLUMNS:
+                raise ApiError(400, f"column must be one of {', '.join(GROUP_COLUMNS)}")
+            filters = query_filters(params)
+            totals = await self.read(lambda store: store.totals_by(column, **filters))
+            return 200, [[key, currency, total] for (key, currency), total in totals.items()]
+        if route == "group_totals" and method == "GET":
+            groups = await self.read(lambda store: store.group_totals())
+            return 200, [list(key) + [total, count] for key, (total, count) in groups.items()]
+        if route == "duplicates" and method == "POST":
+            if not isinstance(data, dict):
+                raise ApiError(400, 'Expected {"expense": {...}, "exclude": id}')
+            expense = validate_expense(data.get("expense"))
+            ids = await self.read(lambda store: self.ledger.duplicates_of(expense, data.get("exclude")))
+            return 200, {"ids": ids}
+        if route == "changes" and method == "GET":
+            return 200, self._changes_since(int_param(params, "since", 0))
+        if route == "reports" and method == "POST":
+            if not isinstance(data, dict) or not data.get("user") or not data.get("number"):
+                raise ApiError(400, 'Expected {"user": ..., "number": ...}')
+            user, number = str(data["user"]), str(data["number"])
+            if not await self.read(lambda store: store.count(user=user)):
+                raise ApiError(404, f"No expenses found for {user}")
+            file_name = f"expense_report_{number}.pdf"
+            await self.read(lambda store: self.ledger.report(file_name, number, user))
+            return 201, {"file": file_name}
+        raise ApiError(404, f"No endpoint {method} {url.path}")
+
+    def _totals(self, params):
+        """Returns the total, or the totals per user, category or currency, in the asked currency."""
+        target = params.get("currency", ["HUF"])[0]
+        if target not in CURRENCY_RATES:
+            raise ApiError(400, f"Unknown currency {target!r}")
+        column = params.get("by", [None])[0]
+        if column is None:
+            return {"total": from_minor(self.ledger.total(target), target), "currency": target}
+        if column not in ("user", "category", "currency"):
+            raise ApiError(400, "by must be user, category or currency")
+        totals = self.ledger.totals_by(column, target)
+        return {"totals": {name: from_minor(total, target) for name, total in totals.items()}, "currency": target}
+
+    def _changes_since(self, since):
+        """Returns the changes after version since, or a reset if they are no longer all kept."""
+        with self.changes_lock:
+            version = self.version
+            oldest = self.changes[0][0] - 1 if self.changes else version
+            if not oldest <= since <= version:
+                return {"version": version, "reset": True}
+            newest_first = itertools.islice(reversed(self.changes), version - since)
+            changes = [list(change) for change in newest_first][::-1]
+        return {"version": version, "changes": changes}
+
+
+def main(argv=None):
+    """Opens the ledger and serves it until interrupted."""
+    parser = argparse.ArgumentParser(description="Serve the expense ledger over HTTP/JSON.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--backend", choices=("sqlite", "journal"), default=DEFAULT_BACKEND)
+    parser.add_argument("--db", dest="path", help="database (or journal snapshot) file")
+    args = parser.parse_args(argv)
+
+    ledger = Ledger()
+    try:
+        ledger.load_rates()
+    except (IOError, ValueError) as error:
+        print(f"Could not read the exchange rate file, using the fixed rates: {error}")
+    ledger.open(args.backend, args.path)
+    print(f"Serving expenses on http://{args.host}:{args.port}/")
+    try:
+        asyncio.run(ExpenseServer(ledger, args.host, args.port).serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
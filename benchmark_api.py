@@ -0,0 +1,88 @@
+"""Measures how many requests per second api_server answers with many clients at once.
+
+The service runs in this process on a fresh database in a temporary
+directory. Each client holds one keep-alive connection and sends its
+requests one after the other, as the GUI does; the adds of all clients are
+written by the single writer task in group commits.
+
+Usage: python benchmark_api.py [clients] [requests per client]   (default 50 and 200)
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from api_server import ExpenseServer
+from expense_store import SQLiteExpenseStore
+from ledger import Ledger
+
+BENCHMARK_PORT = 8799
+
+EXPENSE = {"amount": 1200.0, "currency": "HUF", "category": "Food", "description": "Lunch",
+           "user": "A", "date": "2025-01-02", "invoice": "1"}
+
+
+async def request(reader, writer, method, path, body=None):
+    """Sends one request over an open connection and returns the decoded answer."""
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+                 + data)
+    length = 0
+    await reader.readline()
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return json.loads(await reader.readexactly(length))
+
+
+async def client(number, requests, method, make_path, make_body):
+    """Sends requests one after the other over one connection."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", BENCHMARK_PORT)
+    for index in range(requests):
+        await request(reader, writer, method, make_path(number, index), make_body(number, index))
+    writer.close()
+
+
+async def measure(clients, requests, method, make_path, make_body=lambda number, index: None):
+    """Returns the requests per second of clients sending requests each at the same time."""
+    started = time.perf_counter()
+    await asyncio.gather(*(client(number, requests, method, make_path, make_body) for number in range(clients)))
+    return clients * requests / (time.perf_counter() - started)
+
+
+async def run(clients, requests):
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = Ledger()
+        ledger.attach(SQLiteExpenseStore(os.path.join(directory, "expenses.db")))
+        server = ExpenseServer(ledger, port=BENCHMARK_PORT)
+        serving = asyncio.create_task(server.serve())
+        await asyncio.sleep(0.2)
+        try:
+            adds = await measure(clients, requests, "POST", lambda number, index: "/expenses",
+                                 lambda number, index: dict(EXPENSE, invoice=f"{number}-{index}"))
+            print(f"POST /expenses:      {adds:8.0f} requests/s ({ledger.store.count()} expenses)")
+            gets = await measure(clients, requests, "GET",
+                                 lambda number, index: f"/expenses/{number * requests + index + 1}")
+            print(f"GET /expenses/<id>:  {gets:8.0f} requests/s")
+            totals = await measure(clients, requests, "GET", lambda number, index: "/totals?by=user")
+            print(f"GET /totals?by=user: {totals:8.0f} requests/s")
+        finally:
+            serving.cancel()
+            ledger.close()
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{clients} clients, {requests} requests each")
+    asyncio.run(run(clients, requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compares the memory and aggregation time of ExpenseColumns with a list of expense dicts.
+
+Usage: python benchmark_columns.py [rows]   (default 1,000,000)
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+from columnar import ExpenseColumns, np
+from currency import CURRENCY_RATES, convert_to_huf, to_minor
+from ledger import CATEGORIES, USERS
+
+
+def make_expenses(count):
+    """Returns count random expense dicts shaped like the store's records."""
+    rng = random.Random(42)
+    currencies = list(CURRENCY_RATES)
+    return [{
+        "id": expense_id,
+        "amount": round(rng.uniform(1, 500), 2),
+        "currency": rng.choice(currencies),
+        "category": rng.choice(CATEGORIES),
+        "description": f"expense {expense_id}",
+        "user": rng.choice(USERS),
+        "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "invoice": str(expense_id),
+    } for expense_id in range(1, count + 1)]
+
+
+def dict_aggregates(expenses):
+    """The per-row way: total, per-category and per-user HUF minor unit totals in one Python loop."""
+    total_huf = 0
+    by_category = {}
+    by_user = {}
+    for exp in expenses:
+        amount_huf = convert_to_huf(to_minor(exp["amount"], exp["currency"]), exp["currency"])
+        total_huf += amount_huf
+        by_category[exp["category"]] = by_category.get(exp["category"], 0) + amount_huf
+        by_user[exp["user"]] = by_user.get(exp["user"], 0) + amount_huf
+    return total_huf, by_category, by_user
+
+
+def column_aggregates(columns):
+    """The same three aggregates as bincount reductions over the columns."""
+    # Drop the totals the columns keep, so every run computes them
+    columns.set_rates(columns.rates)
+    return columns.total(), columns.totals_in("category"), columns.totals_in("user")
+
+
+def timed(fn, *args, repeat=3):
+    """Returns the result of fn(*args) and its best time in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{count:,} rows, columns backed by {'NumPy' if np is not None else 'the array module'}")
+
+    tracemalloc.start()
+    expenses = make_expenses(count)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    columns = ExpenseColumns()
+    started = time.perf_counter()
+    columns.load(expenses)
+    load_seconds = time.perf_counter() - started
+    column_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    dict_result, dict_seconds = timed(dict_aggregates, expenses)
+    column_result, column_seconds = timed(column_aggregates, columns)
+    # Both round each row once, so the integer totals agree exactly
+    assert dict_result == column_result
+
+    print(f"list of dicts: {dict_bytes / 2**20:8.1f} MiB, aggregates in {dict_seconds * 1000:8.1f} ms")
+    print(f"columns:       {column_bytes / 2**20:8.1f} MiB, aggregates in {column_seconds * 1000:8.1f} ms"
+          f"  ({columns.nbytes() / 2**20:.1f} MiB of arrays, loaded in {load_seconds:.1f} s)")
+
+    # Every row converted on its own, as the PDF rows need it
+    _, row_seconds = timed(lambda: [convert_to_huf(to_minor(exp["amount"], exp["currency"]), exp["currency"])
+                                    for exp in expenses])
+    _, batch_seconds = timed(columns.amounts_in, "EUR")
+    print(f"per-row conversion: {row_seconds * 1000:8.1f} ms, batch conversion: {batch_seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Measures the memory each expense takes in memory, as a dict and as an expense.Expense.
+
+The expenses are decoded from JSON lines, as when a ledger is loaded, with
+a realistic spread of values: ten users, the seven categories, a few
+currencies and a year of dates repeat; descriptions and invoices are
+unique. tracemalloc counts the bytes still held once all rows are built.
+
+Usage: python benchmark_memory.py [rows]   (default 1000000)
+"""
+import datetime
+import json
+import sys
+import tracemalloc
+
+from expense import Expense
+from expense_store import normalize_record
+from ledger import CATEGORIES, USERS
+
+CURRENCIES = ("HUF", "EUR", "USD", "GBP")
+
+FIRST_DAY = datetime.date(2025, 1, 1).toordinal()
+
+
+def json_lines(count):
+    """Yields count expenses as JSON lines, built one at a time so they are not counted."""
+    for index in range(count):
+        yield json.dumps({
+            "id": index + 1,
+            "amount": float(index % 9000) + 0.5,
+            "currency": CURRENCIES[index % len(CURRENCIES)],
+            "category": CATEGORIES[index % len(CATEGORIES)],
+            "description": f"Expense number {index}",
+            "user": USERS[index % len(USERS)],
+            "date": datetime.date.fromordinal(FIRST_DAY + index % 365).isoformat(),
+            "invoice": f"INV-{index:07d}",
+        })
+
+
+def as_dict(line):
+    """Decodes a line into the dict the in-memory store used to keep."""
+    record = json.loads(line)
+    expense_id = record["id"]
+    record = normalize_record(record)
+    record["id"] = expense_id
+    return record
+
+
+def as_expense(line):
+    return Expense.from_dict(json.loads(line))
+
+
+def bytes_per_row(build, count):
+    """Returns the bytes held per row by a list of count rows made by build(line)."""
+    tracemalloc.start()
+    rows = [build(line) for line in json_lines(count)]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+    return held / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print(f"{count} expenses")
+    before = bytes_per_row(as_dict, count)
+    print(f"dict:    {before:6.0f} bytes per expense, {before * count / 2 ** 20:7.0f} MiB in all")
+    after = bytes_per_row(as_expense, count)
+    print(f"Expense: {after:6.0f} bytes per expense, {after * count / 2 ** 20:7.0f} MiB in all "
+          f"({1 - after / before:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
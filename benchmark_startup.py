@@ -0,0 +1,61 @@
+"""Measures how long the expense tracker takes to show its window, with and without lazy imports.
+
+Each run starts the GUI in a fresh interpreter with EXPENSE_TRACKER_STARTUP_TIMING=1,
+so it exits as soon as the window is visible. The "eager" runs import matplotlib.pyplot
+and the reportlab-based reports module first, as the app did before they were deferred.
+The import cost of those modules on its own is measured too, which needs no display.
+
+Usage: python benchmark_startup.py [runs]   (default 5)
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+GUI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GUI denemeler.py")
+
+# Modules that used to be imported when the app started
+DEFERRED_MODULES = ("matplotlib.pyplot", "reports")
+
+EAGER_PRELUDE = "import " + ", ".join(DEFERRED_MODULES) + "; "
+
+
+def timed_run(code, env=None):
+    """Runs python -c code in a fresh interpreter and returns its wall time in seconds, or None if it failed."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(GUI_SCRIPT), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - started
+    return elapsed if result.returncode == 0 else None
+
+
+def median_run(code, runs, env=None):
+    """Returns the median wall time of several runs, or None if any failed."""
+    times = [timed_run(code, env) for _ in range(runs)]
+    return None if None in times else statistics.median(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    bare = median_run("pass", runs)
+    deferred = median_run(EAGER_PRELUDE, runs)
+    if deferred is None:
+        print("Could not import " + ", ".join(DEFERRED_MODULES))
+    else:
+        print(f"Importing {', '.join(DEFERRED_MODULES)}: {(deferred - bare) * 1000:.0f} ms")
+
+    env = dict(os.environ, EXPENSE_TRACKER_STARTUP_TIMING="1", EXPENSE_TRACKER_WARM_UP="0")
+    run_gui = f"import runpy; runpy.run_path({GUI_SCRIPT!r}, run_name='__main__')"
+    lazy = median_run(run_gui, runs, env)
+    eager = median_run(EAGER_PRELUDE + run_gui, runs, env)
+    if lazy is None or eager is None:
+        print("Could not open the window; the time to first window needs a display")
+        return
+    print(f"Time to first window, eager imports: {eager * 1000:.0f} ms")
+    print(f"Time to first window, lazy imports:  {lazy * 1000:.0f} ms ({(eager - lazy) * 1000:.0f} ms faster)")
+
+
+if __name__ == "__main__":
+    main()
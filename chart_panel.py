@@ -0,0 +1,145 @@
+import datetime
+import math
+import tkinter as tk
+from tkinter import ttk
+
+from matplotlib import colormaps
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+
+from currency import from_minor
+from timeseries import lttb, resample
+
+# Layout of the pie, matching the defaults of Axes.pie(): label and percentage
+# positions as fractions of the radius, and the angle of the first wedge
+LABEL_DISTANCE = 1.1
+PCT_DISTANCE = 0.6
+START_ANGLE = 90
+
+# Choices of the spending-over-time chart: label -> period or column
+PERIOD_CHOICES = {"Daily": "day", "Weekly": "week", "Monthly": "month"}
+GROUP_CHOICES = {"User": "user", "Category": "category", "Currency": "currency"}
+
+# Points drawn per series when the plot width cannot be measured yet
+DEFAULT_POINTS = 500
+
+
+class CategoryPieChart(ttk.Frame):
+    """Pie chart of the expenses per category that lives in the main window.
+
+    The figure and its Tk canvas are made once. set_totals() turns the
+    existing wedges and moves their labels to the new shares; the pie is only
+    drawn from scratch when categories appear or disappear. Redraws go
+    through draw_idle(), so several changes in a row cost a single redraw
+    once Tk is idle.
+    """
+
+    def __init__(self, master, size=4, **kwargs):
+        super().__init__(master, **kwargs)
+        self.figure = Figure(figsize=(size, size))
+        self.axes = self.figure.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.labels = None
+        self.values = None
+        self.wedges = []
+        self.texts = []
+        self.autotexts = []
+
+    def set_totals(self, totals):
+        """Shows the given {category: total} shares."""
+        labels = list(totals)
+        values = [totals[label] for label in labels]
+        if labels == self.labels and values == self.values:
+            return
+        if labels == self.labels and sum(values) > 0:
+            self._move_wedges(values)
+        else:
+            self._draw_pie(labels, values)
+        self.labels = labels
+        self.values = values
+        self.canvas.draw_idle()
+
+    def _draw_pie(self, labels, values):
+        """Draws the pie anew, for a different set of categories."""
+        self.axes.clear()
+        self.axes.set_title("Expense Breakdown by Category")
+        if labels and sum(values) > 0:
+            self.wedges, self.texts, self.autotexts = self.axes.pie(
+                values, labels=labels, autopct='%1.1f%%', startangle=START_ANGLE,
+                colors=colormaps["Paired"].colors, labeldistance=LABEL_DISTANCE, pctdistance=PCT_DISTANCE)
+        else:
+            self.wedges, self.texts, self.autotexts = [], [], []
+            self.axes.text(0.5, 0.5, "No expenses", ha="center", va="center", transform=self.axes.transAxes)
+            self.axes.set_axis_off()
+
+    def _move_wedges(self, values):
+        """Gives the existing wedges new angles and their texts new places, as pie() would."""
+        total = sum(values)
+        theta1 = START_ANGLE
+        for wedge, label, autotext, value in zip(self.wedges, self.texts, self.autotexts, values):
+            share = value / total
+            theta2 = theta1 + 360 * share
+            wedge.set_theta1(theta1)
+            wedge.set_theta2(theta2)
+            middle = math.radians((theta1 + theta2) / 2)
+            x, y = math.cos(middle), math.sin(middle)
+            label.set_position((LABEL_DISTANCE * x, LABEL_DISTANCE * y))
+            label.set_horizontalalignment("left" if x > 0 else "right")
+            autotext.set_position((PCT_DISTANCE * x, PCT_DISTANCE * y))
+            autotext.set_text(f"{100 * share:.1f}%")
+            theta1 = theta2
+
+
+class SpendingChart(ttk.Frame):
+    """Line chart of the spending over time per user, category or currency.
+
+    daily_totals(column) supplies the pre-bucketed daily totals (see
+    ExpenseColumns.daily_totals); they are summed into the chosen period and
+    every series is downsampled with LTTB to at most one point per pixel of
+    the plot, so long histories draw as fast as short ones.
+    """
+
+    def __init__(self, master, daily_totals, size=(6, 4), **kwargs):
+        super().__init__(master, **kwargs)
+        self.daily_totals = daily_totals
+
+        controls = ttk.Frame(self)
+        controls.pack(fill=tk.X)
+        self.period_combobox = ttk.Combobox(controls, values=list(PERIOD_CHOICES), width=9, state="readonly")
+        self.period_combobox.set("Monthly")
+        self.period_combobox.pack(side=tk.LEFT, padx=5)
+        self.group_combobox = ttk.Combobox(controls, values=list(GROUP_CHOICES), width=9, state="readonly")
+        self.group_combobox.set("User")
+        self.group_combobox.pack(side=tk.LEFT, padx=5)
+        self.period_combobox.bind("<<ComboboxSelected>>", lambda event: self.refresh())
+        self.group_combobox.bind("<<ComboboxSelected>>", lambda event: self.refresh())
+
+        self.figure = Figure(figsize=size)
+        self.axes = self.figure.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        # A wider plot has room for more points
+        self.canvas.mpl_connect("resize_event", lambda event: self.refresh())
+
+    def plot_width(self):
+        """Returns the width of the plot area in pixels."""
+        width = int(self.axes.get_window_extent().width)
+        return width if width > 2 else DEFAULT_POINTS
+
+    def refresh(self):
+        """Re-reads the totals and redraws the chart when Tk is idle."""
+        period = PERIOD_CHOICES[self.period_combobox.get()]
+        column = GROUP_CHOICES[self.group_combobox.get()]
+        points = self.plot_width()
+
+        self.axes.clear()
+        for name, (days, totals) in sorted(self.daily_totals(column).items()):
+            starts, sums = resample(days, totals, period)
+            starts, sums = lttb(starts, [from_minor(total, "HUF") for total in sums], points)
+            self.axes.plot([datetime.date.fromordinal(start) for start in starts], sums, label=name)
+        self.axes.set_title(f"Spending per {period} (HUF)")
+        if self.axes.lines:
+            self.axes.legend(loc="upper left", fontsize="small")
+        self.figure.autofmt_xdate()
+        self.canvas.draw_idle()
@@ -0,0 +1,403 @@
+import threading
+from array import array
+
+from aggregates import DEBUG, RunningTotals
+from currency import divide_rounded, to_minor
+from exchange_rates import NO_DATE, RateTable, date_ordinal
+
+try:
+    import numpy as np
+except ImportError:
+    # The stdlib arrays below hold the same data, only the reductions run in Python
+    np = None
+
+# (array typecode, NumPy dtype) of each column
+COLUMN_TYPES = {
+    "id": ("q", "int64"),
+    "amount": ("q", "int64"),
+    "date": ("i", "int32"),
+    "currency": ("i", "int32"),
+    "category": ("i", "int32"),
+    "user": ("i", "int32"),
+}
+
+# Text columns stored as codes into a Dictionary of their distinct values
+ENCODED_COLUMNS = ("currency", "category", "user")
+
+# Rows the columns start with; they double whenever they fill up
+INITIAL_CAPACITY = 1024
+
+# float64 adds integers without rounding while every partial sum stays below this
+FLOAT_EXACT = 2 ** 53
+
+def _new_column(name, size):
+    """Returns a zero-filled column of the given number of rows."""
+    typecode, dtype = COLUMN_TYPES[name]
+    if np is not None:
+        return np.zeros(size, dtype=dtype)
+    return array(typecode, bytes(size * array(typecode).itemsize))
+
+
+def _bincount(codes, weights, length):
+    """Exact integer numpy.bincount: result[code] is the sum of the weights of the rows with that code.
+
+    With NumPy the float64 bincount is used when no sum can reach 2**53 and
+    an int64 np.add.at otherwise; either way the sums are Python ints.
+    """
+    if np is not None:
+        weights = np.asarray(weights, dtype="int64")
+        if not len(weights) or float(np.abs(weights).sum(dtype="float64")) < FLOAT_EXACT:
+            return np.bincount(codes, weights=weights, minlength=length).astype("int64").tolist()
+        sums = np.zeros(length, dtype="int64")
+        np.add.at(sums, codes, weights)
+        return sums.tolist()
+    sums = [0] * length
+    for code, weight in zip(codes, weights):
+        sums[code] += weight
+    return sums
+
+
+def _counts(codes, length):
+    """Returns how many rows have each code."""
+    if np is not None:
+        return np.bincount(codes, minlength=length).tolist()
+    counts = [0] * length
+    for code in codes:
+        counts[code] += 1
+    return counts
+
+
+class Dictionary:
+    """Two-way mapping between the distinct values of a text column and small integer codes."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """Returns the code of value, giving it the next free code if it is new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ExpenseColumns:
+    """Column-wise copy of the ledger's numbers for fast aggregation.
+
+    Each field is one typed array: amounts as int64 minor units of their own
+    currency (cents, fillér), dates as int32 ordinals and currency, category
+    and user as int32 codes into a Dictionary. A row costs 32 bytes of arrays
+    plus its entry in the id to row dict, instead of a dict of seven Python
+    objects, and totals are computed with one bincount over the arrays
+    (NumPy when it is installed, the array module otherwise). Amounts are
+    converted with the RateTable in self.rates at the rate of their date and
+    rounded to a minor unit once per row; every total is the exact integer
+    sum of those rows, so the GUI, the API and the reports agree to the unit.
+    The totals asked for, overall and per user or category in each target
+    currency, are then kept up to date by converting just the changed rows.
+
+    Rows are not kept in store order: a deleted row is filled with the last
+    one. self.lock keeps store changes and reductions apart, since changes
+    may arrive from worker threads.
+    """
+
+    def __init__(self, rates=None):
+        self.lock = threading.Lock()
+        self.store = None
+        self.rates = rates if rates is not None else RateTable()
+        self.dictionaries = {name: Dictionary() for name in ENCODED_COLUMNS}
+        self._reset()
+
+    def _reset(self, capacity=INITIAL_CAPACITY):
+        """Empties every column."""
+        self.size = 0
+        self.rows = {}
+        self.columns = {name: _new_column(name, capacity) for name in COLUMN_TYPES}
+        # target -> total() result, which apply() keeps up to date
+        self.total_cache = {}
+        # (column, target) -> ({value: total}, {value: rows}) of totals_in(), which apply() keeps up to date
+        self.totals_cache = {}
+        # (column, target) -> daily_totals() result, until the next change
+        self.daily_cache = {}
+
+    def __len__(self):
+        return self.size
+
+    def attach(self, store):
+        """Loads every expense of store and keeps the columns in sync with its changes."""
+        self.store = store
+        self.load(store.query())
+        store.subscribe(self.apply)
+
+    def load(self, records):
+        """Starts over with the given records."""
+        values = {name: [] for name in COLUMN_TYPES}
+        # Many expenses share a date, so each distinct date is parsed once
+        ordinals = {}
+        with self.lock:
+            encoders = {name: self.dictionaries[name].encode for name in ENCODED_COLUMNS}
+            for record in records:
+                values["id"].append(record["id"])
+                values["amount"].append(to_minor(record["amount"], record["currency"]))
+                date = record["date"]
+                ordinal = ordinals.get(date)
+                if ordinal is None:
+                    ordinal = ordinals[date] = date_ordinal(date)
+                values["date"].append(ordinal)
+                for name, encode in encoders.items():
+                    values[name].append(encode(record[name]))
+
+            size = len(values["id"])
+            self._reset(max(INITIAL_CAPACITY, size))
+            for name, column in self.columns.items():
+                column[:size] = array(COLUMN_TYPES[name][0], values[name])
+            self.rows = {expense_id: row for row, expense_id in enumerate(values["id"])}
+            self.size = size
+
+    def set_rates(self, rates):
+        """Converts at the rates of a RateTable from now on."""
+        with self.lock:
+            self.rates = rates
+            self.total_cache = {}
+            self.totals_cache = {}
+            self.daily_cache = {}
+
+    def apply(self, changes):
+        """Updates the columns from a list of store changes; suitable for store.subscribe()."""
+        with self.lock:
+            self.daily_cache = {}
+            for op, expense_id, old, new in changes:
+                row = self.rows.get(expense_id)
+                if row is not None:
+                    self._count(row, -1)
+                if new is None:
+                    self._remove(expense_id)
+                elif row is not None:
+                    self._set(row, expense_id, new)
+                else:
+                    self._append(expense_id, new)
+                if new is not None:
+                    self._count(self.rows[expense_id], 1)
+        if DEBUG:
+            self.check_store()
+
+    def _append(self, expense_id, record):
+        if self.size == len(self.columns["id"]):
+            self._grow(max(INITIAL_CAPACITY, 2 * self.size))
+        self.rows[expense_id] = self.size
+        self._set(self.size, expense_id, record)
+        self.size += 1
+
+    def _set(self, row, expense_id, record):
+        columns = self.columns
+        columns["id"][row] = expense_id
+        columns["amount"][row] = to_minor(record["amount"], record["currency"])
+        columns["date"][row] = date_ordinal(record["date"])
+        for name in ENCODED_COLUMNS:
+            columns[name][row] = self.dictionaries[name].encode(record[name])
+
+    def _remove(self, expense_id):
+        row = self.rows.pop(expense_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            # Move the last row into the hole so the live rows stay contiguous
+            for column in self.columns.values():
+                column[row] = column[last]
+            self.rows[int(self.columns["id"][row])] = row
+        self.size = last
+
+    def _count(self, row, sign):
+        """Adds (sign 1) or takes away (sign -1) a row in the kept totals."""
+        if not self.total_cache and not self.totals_cache:
+            return
+        currency = self.dictionaries["currency"].values[self.columns["currency"][row]]
+        amount = int(self.columns["amount"][row])
+        ordinal = int(self.columns["date"][row])
+        converted = {}
+        for target in set(self.total_cache) | {target for column, target in self.totals_cache}:
+            numerator, denominator = self.rates.factor(currency, ordinal, target)
+            converted[target] = sign * divide_rounded(amount * numerator, denominator)
+        for target in self.total_cache:
+            self.total_cache[target] += converted[target]
+        for (column, target), (sums, counts) in self.totals_cache.items():
+            value = self.dictionaries[column].values[self.columns[column][row]]
+            remaining = counts.get(value, 0) + sign
+            if remaining:
+                counts[value] = remaining
+                sums[value] = sums.get(value, 0) + converted[target]
+            else:
+                # The value's last row is gone
+                del counts[value]
+                del sums[value]
+
+    def _grow(self, capacity):
+        """Makes room for capacity rows."""
+        for name, column in self.columns.items():
+            grown = _new_column(name, capacity)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+
+    def _view(self, name):
+        """Returns the live rows of a column without copying them."""
+        column = self.columns[name]
+        if np is not None:
+            return column[:self.size]
+        return memoryview(column)[:self.size]
+
+    def nbytes(self):
+        """Returns the memory taken by the column arrays."""
+        return sum(len(column) * column.itemsize for column in self.columns.values())
+
+    def totals_by_currency(self):
+        """Returns the summed minor units in each original currency, e.g. {"EUR": 5000} for 50 EUR."""
+        return {currency: amount for (currency,), (amount, count) in self._grouped(()).items()}
+
+    def amounts_in(self, target="HUF"):
+        """Returns every row in target minor units at the rate of its date, in row order."""
+        with self.lock:
+            return self._amounts_in(target)
+
+    def _amounts_in(self, target):
+        return self.rates.convert_codes(self._view("amount"), self._view("currency"), self._view("date"),
+                                        self.dictionaries["currency"].values, target)
+
+    def total(self, target="HUF"):
+        """Returns the whole ledger in target minor units (HUF fillér by default)."""
+        with self.lock:
+            total = self.total_cache.get(target)
+            if total is None:
+                total = self.total_cache[target] = self._total(target)
+            return total
+
+    def _total(self, target):
+        amounts = self._amounts_in(target)
+        return int(amounts.sum()) if np is not None else sum(amounts)
+
+    def totals_in(self, column, target="HUF"):
+        """Returns the total per user or category in target minor units, e.g. {"Food": 1900000}."""
+        with self.lock:
+            key = (column, target)
+            totals = self.totals_cache.get(key)
+            if totals is None:
+                totals = self.totals_cache[key] = self._totals_in(column, target)
+            return dict(totals[0])
+
+    def _totals_in(self, column, target):
+        """Returns ({value: total in target minor units}, {value: rows}) over the values in use."""
+        values = self.dictionaries[column].values
+        amounts = self._amounts_in(target)
+        codes = self._view(column)
+        sums = _bincount(codes, amounts, len(values))
+        counts = _counts(codes, len(values))
+        return ({value: sums[code] for code, value in enumerate(values) if counts[code]},
+                {value: counts[code] for code, value in enumerate(values) if counts[code]})
+
+    def daily_totals(self, column, target="HUF"):
+        """Returns the spending per day of every user, category or currency.
+
+        The result maps each value of column to (day ordinals, totals in
+        target minor units), sorted by day and holding only the days with expenses.
+        Undated expenses are left out. It is kept until the columns change,
+        so charts can re-bucket it into weeks or months without a new scan.
+        """
+        with self.lock:
+            key = (column, target)
+            cached = self.daily_cache.get(key)
+            if cached is not None:
+                return cached
+            values = self.dictionaries[column].values
+            amounts = self._amounts_in(target)
+            codes = self._view(column)
+            dates = self._view("date")
+            series = {}
+            if np is not None:
+                dated = np.flatnonzero(dates != NO_DATE)
+                if len(dated):
+                    days = dates[dated].astype("int64")
+                    first = int(days.min())
+                    span = int(days.max()) - first + 1
+                    keys = codes[dated].astype("int64") * span + (days - first)
+                    sums = np.asarray(_bincount(keys, amounts[dated], len(values) * span), dtype=object)
+                    found = np.flatnonzero(np.bincount(keys, minlength=len(values) * span))
+                    for code in np.unique(found // span).tolist():
+                        keys_of_value = found[(found // span) == code]
+                        series[values[code]] = ((keys_of_value - code * span + first).tolist(),
+                                                sums[keys_of_value].tolist())
+            else:
+                sums = {}
+                for code, date, amount in zip(codes, dates, amounts):
+                    if date != NO_DATE:
+                        sums[code, date] = sums.get((code, date), 0) + amount
+                for (code, date), amount in sorted(sums.items()):
+                    days, totals = series.setdefault(values[code], ([], []))
+                    days.append(date)
+                    totals.append(amount)
+            self.daily_cache[key] = series
+            return series
+
+    def group_totals(self):
+        """Returns {(user, category, currency): (summed minor units, count)} like the stores do."""
+        return self._grouped(("user", "category"))
+
+    def _grouped(self, names):
+        """Sums the amounts per combination of the named columns and the currency.
+
+        The codes of the columns are combined into one key per row, so a single
+        bincount does the grouping. Returns {(value, ..., currency): (minor units, count)}.
+        """
+        names = tuple(names) + ("currency",)
+        with self.lock:
+            sizes = [len(self.dictionaries[name]) for name in names]
+            length = 1
+            for size in sizes:
+                length *= size
+            if np is not None:
+                keys = np.zeros(self.size, dtype="int64")
+                for name, size in zip(names, sizes):
+                    keys = keys * size + self._view(name)
+            else:
+                keys = []
+                for codes in zip(*[self._view(name) for name in names]):
+                    key = 0
+                    for code, size in zip(codes, sizes):
+                        key = key * size + code
+                    keys.append(key)
+            sums = _bincount(keys, self._view("amount"), length)
+            counts = _counts(keys, length)
+
+            grouped = {}
+            for key, count in enumerate(counts):
+                if not count:
+                    continue
+                values = []
+                remainder = key
+                for name, size in zip(reversed(names), reversed(sizes)):
+                    remainder, code = divmod(remainder, size)
+                    values.append(self.dictionaries[name].values[code])
+                grouped[tuple(reversed(values))] = (sums[key], int(count))
+            return grouped
+
+    def check_store(self):
+        """Raises AssertionError if the columns differ from the attached store or the kept totals from the columns."""
+        mine, expected = RunningTotals(), RunningTotals()
+        mine.load(self)
+        expected.load(self.store)
+        mismatches = mine.differences(expected)
+        with self.lock:
+            for target, total in self.total_cache.items():
+                fresh = self._total(target)
+                if total != fresh:
+                    mismatches.append(f"total in {target} {total} != {fresh}")
+            for (column, target), totals in self.totals_cache.items():
+                fresh = self._totals_in(column, target)
+                if totals != fresh:
+                    mismatches.append(f"totals by {column} in {target} {totals[0]} != {fresh[0]}")
+        if mismatches:
+            raise AssertionError("Expense columns out of sync: " + "; ".join(mismatches))
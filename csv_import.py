@@ -0,0 +1,176 @@
+import csv
+import datetime
+
+from currency import CURRENCY_RATES
+
+# Fields of an expense that can be read from a CSV column
+IMPORT_FIELDS = ("amount", "currency", "category", "description", "user", "date", "invoice")
+
+# Header names that guess_mapping() recognizes for each field, lower-case
+FIELD_ALIASES = {
+    "amount": ("amount", "value", "sum", "összeg", "osszeg"),
+    "currency": ("currency", "ccy", "pénznem", "penznem"),
+    "category": ("category", "kategória", "kategoria"),
+    "description": ("description", "details", "narrative", "merchant", "payee", "közlemény", "kozlemeny"),
+    "user": ("user", "card holder", "cardholder", "name"),
+    "date": ("date", "booking date", "transaction date", "value date", "dátum", "datum"),
+    "invoice": ("invoice", "reference", "transaction id", "id", "azonosító", "azonosito"),
+}
+
+# Common date formats of bank and card statements, offered by the import dialog
+DATE_FORMATS = ("%Y-%m-%d", "%Y.%m.%d.", "%Y.%m.%d", "%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y")
+
+# Rows parsed and validated at a time
+PARSE_BATCH_ROWS = 10000
+
+
+class ImportCancelled(Exception):
+    """Raised inside an import when it was cancelled."""
+
+
+def read_header(path):
+    """Returns the column names of a CSV file and the dialect sniffed from its start."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(64 * 1024)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        header = next(csv.reader(f, dialect), [])
+    return [name.strip() for name in header], dialect
+
+
+def guess_mapping(header):
+    """Returns {field: column name} for the fields whose column can be recognized by name."""
+    mapping = {}
+    names = {name.lower(): name for name in header}
+    for field in IMPORT_FIELDS:
+        for alias in FIELD_ALIASES[field]:
+            if alias in names and names[alias] not in mapping.values():
+                mapping[field] = names[alias]
+                break
+    return mapping
+
+
+def parse_amounts(texts, decimal=".", negate=False):
+    """Parses a batch of amount texts; returns the amounts, with None for unreadable ones.
+
+    Spaces and the thousands separator (whichever of "," and "." is not the
+    decimal one) are dropped, so "1 234,50" reads as 1234.5 with decimal=",".
+    Card statements list spending as negative amounts; negate flips the sign.
+    """
+    thousands = "." if decimal == "," else ","
+    table = str.maketrans({thousands: None, " ": None, "\u00a0": None, decimal: "."})
+    sign = -1.0 if negate else 1.0
+    amounts = []
+    for text in texts:
+        try:
+            amounts.append(sign * float(text.translate(table)))
+        except ValueError:
+            amounts.append(None)
+    return amounts
+
+
+def parse_dates(texts, date_format="%Y-%m-%d", cache=None):
+    """Parses a batch of date texts into YYYY-MM-DD, with None for unreadable ones.
+
+    Statements repeat the same few dates over and over, so every distinct
+    text is parsed once and looked up in cache afterwards.
+    """
+    cache = {} if cache is None else cache
+    dates = []
+    for text in texts:
+        date = cache.get(text, False)
+        if date is False:
+            try:
+                date = datetime.datetime.strptime(text.strip(), date_format).date().isoformat()
+            except ValueError:
+                date = None
+            cache[text] = date
+        dates.append(date)
+    return dates
+
+
+def import_csv(path, mapping, defaults=None, categories=None, date_format="%Y-%m-%d", decimal=".",
+               negate=False, progress=None, is_cancelled=None):
+    """Reads and validates the expenses of a bank or card statement CSV.
+
+    mapping gives the column name of each field that is read from the file;
+    defaults gives the value of the fields that are not mapped or left empty
+    (e.g. the user whose card the statement is for). Amounts must parse,
+    dates must match date_format, the currency must be one of CURRENCY_RATES
+    and, if categories is given, the category one of them. Nothing is stored
+    here: returns (records, errors) where errors is a list of (line, message)
+    for the rows that were left out, so the caller can add all the records
+    in a single store.add_many() call.
+
+    progress(rows_read, 0) is called after every batch; is_cancelled() is
+    checked between batches and raises ImportCancelled when true.
+    """
+    defaults = dict(defaults or {})
+    # Like normalize_record(), amounts without a currency are in HUF
+    defaults.setdefault("currency", "HUF")
+    allowed_categories = None if categories is None else set(categories)
+    header, dialect = read_header(path)
+    positions = {name: index for index, name in enumerate(header)}
+    missing = [name for name in mapping.values() if name not in positions]
+    if missing:
+        raise ValueError(f"{path} has no column named {', '.join(map(repr, missing))}")
+    if "amount" not in mapping:
+        raise ValueError("The amount column must be mapped")
+    columns = {field: positions[name] for field, name in mapping.items()}
+
+    records = []
+    errors = []
+    date_cache = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f, dialect)
+        next(reader, None)
+        while True:
+            batch = []
+            for row in reader:
+                if any(cell.strip() for cell in row):
+                    batch.append((reader.line_num, row))
+                if len(batch) == PARSE_BATCH_ROWS:
+                    break
+            if not batch:
+                break
+            if is_cancelled is not None and is_cancelled():
+                raise ImportCancelled()
+            _validate_batch(batch, columns, defaults, allowed_categories, date_format, decimal, negate,
+                            date_cache, records, errors)
+            if progress is not None:
+                progress(len(records) + len(errors), 0)
+    return records, errors
+
+
+def _validate_batch(batch, columns, defaults, allowed_categories, date_format, decimal, negate,
+                    date_cache, records, errors):
+    """Parses one batch of (line, row) pairs into records, or errors for the rows that fail."""
+    values = {}
+    for field in IMPORT_FIELDS:
+        index = columns.get(field)
+        default = str(defaults.get(field, ""))
+        if index is None:
+            values[field] = [default] * len(batch)
+        else:
+            values[field] = [(row[index].strip() if index < len(row) else "") or default for line, row in batch]
+    amounts = parse_amounts(values["amount"], decimal, negate)
+    dates = parse_dates(values["date"], date_format, date_cache) if "date" in columns else values["date"]
+
+    for i, (line, row) in enumerate(batch):
+        record = {field: values[field][i] for field in IMPORT_FIELDS}
+        record["amount"] = amounts[i]
+        record["date"] = dates[i]
+        if record["amount"] is None:
+            errors.append((line, f"invalid amount {values['amount'][i]!r}"))
+        elif record["date"] is None:
+            errors.append((line, f"date {values['date'][i]!r} does not match {date_format}"))
+        elif record["currency"] not in CURRENCY_RATES:
+            errors.append((line, f"unknown currency {record['currency']!r}"))
+        elif allowed_categories is not None and record["category"] not in allowed_categories:
+            errors.append((line, f"unknown category {record['category']!r}"))
+        else:
+            # Leave empty fields to the store's defaults
+            records.append({field: value for field, value in record.items() if value != ""})
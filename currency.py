@@ -0,0 +1,151 @@
+from fractions import Fraction
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    # The batch conversions fall back to plain Python loops
+    np = None
+
+# Rate used to show HUF totals in EUR
+HUF_TO_EUR_RATE = 0.002562
+
+# Currency rates relative to 1 HUF (Hungarian Forint)
+CURRENCY_RATES = {
+    "HUF": 1.0,
+    "EUR": 380.0,
+    "USD": 350.0,
+    "HKD": 45.0,
+    "IDR": 0.022
+}
+
+# Decimal places of each currency's minor unit; amounts are kept as integer counts of it
+MINOR_UNIT_EXPONENTS = {
+    "HUF": 2,
+    "EUR": 2,
+    "USD": 2,
+    "HKD": 2,
+    "IDR": 0
+}
+
+# Exponent of currencies missing from MINOR_UNIT_EXPONENTS
+DEFAULT_EXPONENT = 2
+
+# Products below this fit a signed 64-bit integer, so NumPy can convert without overflow
+INT64_SAFE = 2 ** 62
+
+
+def minor_scale(currency):
+    """Returns how many minor units make one unit of currency, e.g. 100 for EUR."""
+    return 10 ** MINOR_UNIT_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+
+def to_minor(amount, currency):
+    """Returns an amount in whole units (12.34 EUR) as an integer of minor units (1234)."""
+    return round(float(amount) * minor_scale(currency))
+
+
+def from_minor(units, currency):
+    """Returns minor units as a number of whole units, for files, the API and charts."""
+    return units / minor_scale(currency)
+
+
+def format_minor(units, currency):
+    """Formats minor units exactly, with the currency's decimals: 123456 HUF gives "1234.56"."""
+    exponent = MINOR_UNIT_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+    whole, fraction = divmod(abs(int(units)), 10 ** exponent)
+    sign = "-" if units < 0 else ""
+    return f"{sign}{whole}.{fraction:0{exponent}d}" if exponent else f"{sign}{whole}"
+
+
+def exact_rate(rate):
+    """Returns a rate as the fraction its decimal digits spell out, so 0.022 is exactly 11/500."""
+    if isinstance(rate, float):
+        rate = repr(rate)
+    return Fraction(rate)
+
+
+def conversion_factor(rate, target_rate, currency, target):
+    """Returns the exact factor from minor units of currency to minor units of target.
+
+    rate and target_rate are the HUF values of one unit of each currency.
+    """
+    return exact_rate(rate) / exact_rate(target_rate) * Fraction(minor_scale(target), minor_scale(currency))
+
+
+@lru_cache(maxsize=None)
+def fixed_factor(currency, target="HUF"):
+    """Returns the factor from currency to target at the fixed rates; missing currencies count as HUF."""
+    return conversion_factor(CURRENCY_RATES.get(currency, 1.0), CURRENCY_RATES[target], currency, target)
+
+
+def fixed_factors(currencies, target="HUF"):
+    """Returns the fixed factor from each of the given currencies to target, in order."""
+    return [fixed_factor(currency, target) for currency in currencies]
+
+
+def divide_rounded(numerator, denominator):
+    """Divides integers, rounding half to even, exactly for integers of any size."""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def convert_to_huf(units, currency):
+    """Converts minor units of currency to HUF minor units at the fixed rate, rounded once."""
+    factor = fixed_factor(currency)
+    return divide_rounded(units * factor.numerator, factor.denominator)
+
+
+def huf_to_eur(units_huf):
+    """Converts HUF minor units to EUR minor units at the display rate, rounded once."""
+    factor = exact_rate(HUF_TO_EUR_RATE) * Fraction(minor_scale("EUR"), minor_scale("HUF"))
+    return divide_rounded(units_huf * factor.numerator, factor.denominator)
+
+
+def apply_factors(amounts, codes, factors):
+    """Returns round(amounts[i] * factors[codes[i]]) for every row, half to even.
+
+    The arithmetic is exact: NumPy int64 when no product can overflow, Python
+    integers otherwise. Returns an int64 NumPy array, or a list when NumPy is
+    not installed.
+    """
+    pairs = [(factor.numerator, factor.denominator) for factor in factors]
+    if np is None:
+        return [divide_rounded(amount * pairs[code][0], pairs[code][1]) for amount, code in zip(amounts, codes)]
+    amounts = np.asarray(amounts, dtype="int64")
+    codes = np.asarray(codes, dtype="intp")
+    if not len(amounts):
+        return np.zeros(0, dtype="int64")
+    largest = int(np.abs(amounts).max())
+    if all(largest * abs(numerator) < INT64_SAFE and denominator < INT64_SAFE for numerator, denominator in pairs):
+        products = amounts * np.asarray([numerator for numerator, denominator in pairs], dtype="int64")[codes]
+        denominators = np.asarray([denominator for numerator, denominator in pairs], dtype="int64")[codes]
+        quotients, remainders = np.divmod(products, denominators)
+        twice = 2 * remainders
+        quotients += (twice > denominators) | ((twice == denominators) & (quotients % 2 == 1))
+        return quotients
+    return np.array([divide_rounded(amount * pairs[code][0], pairs[code][1])
+                     for amount, code in zip(amounts.tolist(), codes.tolist())], dtype="int64")
+
+
+def convert_codes(amounts, codes, currencies, target="HUF"):
+    """Converts dictionary-encoded minor units to target minor units in one vectorized pass.
+
+    amounts and codes are equally long arrays; codes[i] is the index in
+    currencies of the currency of amounts[i]. Every row is rounded once, so
+    a total is the exact integer sum of the rows it covers.
+    """
+    return apply_factors(amounts, codes, fixed_factors(currencies, target))
+
+
+def convert_many(amounts, currencies, target="HUF"):
+    """Converts minor units given in currencies (a code per amount, e.g. "EUR") to target."""
+    if np is not None:
+        names, codes = np.unique(np.asarray(currencies, dtype=str), return_inverse=True)
+        return convert_codes(amounts, codes, names.tolist(), target)
+    names = sorted(set(currencies))
+    index = {name: code for code, name in enumerate(names)}
+    return convert_codes(amounts, [index[currency] for currency in currencies], names, target)
@@ -0,0 +1,159 @@
+import threading
+from contextlib import contextmanager
+
+from currency import to_minor
+
+# Invoice numbers that mean "no invoice" and never make two expenses duplicates
+NO_INVOICE = ("", "N/A")
+
+
+def invoice_key(record):
+    """Returns the (user, invoice) key of an expense, or None if it has no invoice number."""
+    invoice = record.get("invoice", "").strip()
+    if invoice.upper() in NO_INVOICE:
+        return None
+    return (record.get("user", "Unknown").strip(), invoice.upper())
+
+
+def fingerprint(record):
+    """Returns the normalized (amount, currency, date, description) of an expense.
+
+    Amounts are compared in minor units of their currency and descriptions compared without case or
+    repeated spaces, so the same purchase typed in twice, or found in two
+    overlapping statements, gets the same fingerprint.
+    """
+    currency = record.get("currency", "HUF").strip().upper()
+    return (to_minor(record.get("amount", 0), currency), currency,
+            record.get("date", "N/A").strip(), " ".join(record.get("description", "").lower().split()))
+
+
+def _add(invoices, fingerprints, expense_id, record):
+    key = invoice_key(record)
+    if key is not None:
+        invoices.setdefault(key, set()).add(expense_id)
+    fingerprints.setdefault(fingerprint(record), set()).add(expense_id)
+
+
+class DuplicateIndex:
+    """Hash indexes from (user, invoice) and from content fingerprints to expense ids.
+
+    find() tells in constant time which stored expenses a new one repeats,
+    instead of scanning the ledger. Like TrigramIndex, a resident index is
+    built from the store on first use and then kept in step with every add,
+    modify and delete through store.subscribe(); that pays off in a
+    long-running program like the GUI. Otherwise each check indexes only
+    what store.duplicate_candidates() finds for the records at hand.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.store = None
+        self.resident = True
+        self.built = False
+        self.invoices = {}
+        self.fingerprints = {}
+
+    def attach(self, store, resident=True):
+        """Checks against store; a resident index is kept in sync with it and built on first use.
+
+        resident=False needs a store with duplicate_candidates(), such as
+        expense_store.SQLiteExpenseStore.
+        """
+        self.store = store
+        self.resident = resident
+        if resident:
+            store.subscribe(self.apply)
+
+    def invalidate(self):
+        """Makes the next check build the index again, after the store changed without telling it."""
+        with self.lock:
+            self.built = False
+            self.invoices = {}
+            self.fingerprints = {}
+
+    def _build(self, records):
+        self.invoices = {}
+        self.fingerprints = {}
+        for record in records:
+            _add(self.invoices, self.fingerprints, record["id"], record)
+        self.built = True
+
+    def apply(self, changes):
+        """Updates the index from a list of store changes; suitable for store.subscribe()."""
+        with self.lock:
+            if not self.built:
+                return
+            for op, expense_id, old, new in changes:
+                if old is not None:
+                    self._remove(expense_id, old)
+                if new is not None:
+                    _add(self.invoices, self.fingerprints, expense_id, new)
+
+    def _remove(self, expense_id, record):
+        for index, key in ((self.invoices, invoice_key(record)), (self.fingerprints, fingerprint(record))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(expense_id)
+                if not ids:
+                    del index[key]
+
+    @contextmanager
+    def _indexes(self, records):
+        """Yields the (invoices, fingerprints) indexes to check records against."""
+        if not self.resident:
+            invoices = {}
+            fingerprints = {}
+            for candidate in self.store.duplicate_candidates(records):
+                _add(invoices, fingerprints, candidate["id"], candidate)
+            yield invoices, fingerprints
+            return
+        with self.lock:
+            if not self.built:
+                self._build(self.store.query())
+            yield self.invoices, self.fingerprints
+
+    def find(self, record, exclude=None):
+        """Returns the sorted ids of the stored expenses with record's invoice or content.
+
+        exclude is left out of the result, so an expense being modified does
+        not count as a duplicate of itself.
+        """
+        with self._indexes([record]) as (invoices, fingerprints):
+            found = set(invoices.get(invoice_key(record), ()))
+            found |= fingerprints.get(fingerprint(record), set())
+        found.discard(exclude)
+        return sorted(found)
+
+    def partition(self, records):
+        """Splits records about to be imported into (new, duplicates).
+
+        A record with an invoice number is a duplicate if a stored expense,
+        or one earlier in records, has the same user and invoice; statement
+        lines can legitimately repeat an amount on the same day, so content
+        only decides for records without an invoice number. duplicates is a
+        list of (record, id of the stored expense or None).
+        """
+        with self._indexes(records) as (invoices, fingerprints):
+            seen_invoices = set()
+            seen_fingerprints = set()
+            new = []
+            duplicates = []
+            for record in records:
+                key = invoice_key(record)
+                content = fingerprint(record)
+                if key is not None:
+                    existing = invoices.get(key)
+                    repeated = key in seen_invoices
+                else:
+                    existing = fingerprints.get(content)
+                    repeated = content in seen_fingerprints
+                if existing:
+                    duplicates.append((record, min(existing)))
+                elif repeated:
+                    duplicates.append((record, None))
+                else:
+                    new.append(record)
+                    if key is not None:
+                        seen_invoices.add(key)
+                    seen_fingerprints.add(content)
+        return new, duplicates
@@ -0,0 +1,166 @@
+import bisect
+import csv
+import datetime
+import json
+import os
+
+from currency import CURRENCY_RATES, apply_factors, conversion_factor, convert_codes, divide_rounded, exact_rate
+
+try:
+    import numpy as np
+except ImportError:
+    # Batched lookups fall back to the memoized bisect of single ones
+    np = None
+
+# Historical rates, as a CSV with a date,currency,rate header or a JSON list of such objects
+RATES_FILE = "exchange_rates.csv"
+
+# Date ordinal of expenses without a valid YYYY-MM-DD date (old entries have "N/A")
+NO_DATE = 0
+
+
+def date_ordinal(text):
+    """Returns the proleptic Gregorian ordinal of a YYYY-MM-DD date, or NO_DATE."""
+    try:
+        return datetime.date.fromisoformat(text).toordinal()
+    except (TypeError, ValueError):
+        return NO_DATE
+
+
+class RateTable:
+    """Exchange rates to HUF that change over time, looked up as of an expense's date.
+
+    Every entry (date, currency, rate) holds from its date until the next
+    entry of the same currency. Dates before a currency's first entry get
+    that first rate, undated expenses get the latest one, and currencies
+    without any entry keep their rate from CURRENCY_RATES. An empty table
+    therefore converts exactly like convert_to_huf. Rates are kept as exact
+    fractions of their decimal text and amounts are integer minor units.
+    """
+
+    def __init__(self, entries=()):
+        history = {}
+        for date, currency, rate in entries:
+            history.setdefault(currency, []).append((date_ordinal(date), exact_rate(rate)))
+        self.dates = {}
+        self.rates = {}
+        for currency, points in history.items():
+            points.sort()
+            self.dates[currency] = [ordinal for ordinal, rate in points]
+            self.rates[currency] = [rate for ordinal, rate in points]
+        # (currency, date ordinal) -> rate of single lookups
+        self.cache = {}
+        # (currency, date ordinal, target) -> (numerator, denominator) of single conversions
+        self.factors = {}
+
+    @classmethod
+    def load(cls, path=RATES_FILE):
+        """Reads a CSV or JSON rate file; a missing file gives an empty table.
+
+        Raises ValueError if an entry lacks a date, currency or numeric rate.
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, newline="", encoding="utf-8") as f:
+            if path.lower().endswith(".json"):
+                rows = json.load(f)
+            else:
+                rows = list(csv.DictReader(f))
+        try:
+            entries = [(row["date"], row["currency"], exact_rate(str(row["rate"]).strip())) for row in rows]
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError(f"Invalid exchange rate entry in {path}: {error}") from error
+        return cls(entries)
+
+    def rate(self, currency, ordinal):
+        """Returns the HUF value of one unit of currency on the given date ordinal, as a Fraction."""
+        key = (currency, ordinal)
+        rate = self.cache.get(key)
+        if rate is None:
+            rate = self.cache[key] = self._lookup(currency, ordinal)
+        return rate
+
+    def _lookup(self, currency, ordinal):
+        dates = self.dates.get(currency)
+        if not dates:
+            return exact_rate(CURRENCY_RATES.get(currency, 1.0))
+        rates = self.rates[currency]
+        if ordinal == NO_DATE:
+            return rates[-1]
+        return rates[max(bisect.bisect_right(dates, ordinal) - 1, 0)]
+
+    def factor(self, currency, ordinal, target="HUF"):
+        """Returns the (numerator, denominator) turning minor units of currency into target's on a date."""
+        key = (currency, ordinal, target)
+        factor = self.factors.get(key)
+        if factor is None:
+            exact = conversion_factor(self.rate(currency, ordinal), self.rate(target, ordinal), currency, target)
+            factor = self.factors[key] = (exact.numerator, exact.denominator)
+        return factor
+
+    def _positions(self, currency, ordinals):
+        """Returns the index in the currency's rate list that holds on each of the given date ordinals.
+
+        Currencies without history have a single rate, at index 0.
+        """
+        dates = self.dates.get(currency)
+        if not dates:
+            return np.zeros(len(ordinals), dtype="intp")
+        positions = np.maximum(np.searchsorted(np.asarray(dates), ordinals, side="right") - 1, 0)
+        return np.where(ordinals == NO_DATE, len(dates) - 1, positions)
+
+    def _rate_at(self, currency, position):
+        dates = self.dates.get(currency)
+        return self.rates[currency][position] if dates else exact_rate(CURRENCY_RATES.get(currency, 1.0))
+
+    def convert_codes(self, amounts, codes, ordinals, currencies, target="HUF"):
+        """Converts dictionary-encoded minor units to target minor units at the rates of their dates.
+
+        Like currency.convert_codes, with ordinals giving the date of every
+        amount. Each row is rounded once. With NumPy the rows are grouped by
+        their (currency, source rate, target rate) triple, so only as many
+        exact factors are worked out as there are rate periods in use.
+        """
+        if not self.dates:
+            # Fixed rates: one factor per currency
+            return convert_codes(amounts, codes, currencies, target)
+        if np is None:
+            factor = self.factor
+            converted = []
+            for amount, code, ordinal in zip(amounts, codes, ordinals):
+                numerator, denominator = factor(currencies[code], ordinal, target)
+                converted.append(amount * numerator if denominator == 1
+                                 else divide_rounded(amount * numerator, denominator))
+            return converted
+
+        codes = np.asarray(codes, dtype="intp")
+        ordinals = np.asarray(ordinals)
+        target_positions = self._positions(target, ordinals)
+        source_positions = np.zeros(len(codes), dtype="intp")
+        for code, currency in enumerate(currencies):
+            rows = np.flatnonzero(codes == code)
+            if len(rows):
+                source_positions[rows] = self._positions(currency, ordinals[rows])
+        # One integer per (currency, source rate, target rate) triple
+        sources = int(source_positions.max()) + 1 if len(codes) else 1
+        targets = len(self.dates.get(target, ())) or 1
+        keys = (codes.astype("int64") * sources + source_positions) * targets + target_positions
+        found, factor_codes = np.unique(keys, return_inverse=True)
+        factors = []
+        for key in found.tolist():
+            rest, position = divmod(key, targets)
+            code, source = divmod(rest, sources)
+            factors.append(conversion_factor(self._rate_at(currencies[code], source), self._rate_at(target, position),
+                                             currencies[code], target))
+        return apply_factors(amounts, factor_codes.reshape(-1), factors)
+
+    def convert_many(self, amounts, currencies, dates, target="HUF"):
+        """Converts minor units given in currencies (e.g. "EUR") on dates (YYYY-MM-DD) to target."""
+        names = sorted(set(currencies))
+        index = {name: code for code, name in enumerate(names)}
+        ordinals = {}
+        for date in dates:
+            if date not in ordinals:
+                ordinals[date] = date_ordinal(date)
+        return self.convert_codes(amounts, [index[currency] for currency in currencies],
+                                  [ordinals[date] for date in dates], names, target)
@@ -0,0 +1,98 @@
+import sys
+
+from currency import from_minor, to_minor
+
+# Fields of an expense record, in the order they are stored
+FIELDS = ("amount", "currency", "category", "description", "user", "date", "invoice")
+
+# Values of the tuples yielded by store.query_rows() and Expense.as_row()
+ROW_FIELDS = ("id",) + FIELDS
+
+# Fields whose few distinct values repeat on every row; each value is kept in memory once
+INTERNED_FIELDS = ("currency", "category", "user", "date")
+
+
+class Expense:
+    """One expense held in memory: slots instead of a dict, with the repeating strings interned.
+
+    A dict with seven string keys costs several times the memory of these
+    slots, and the ledger may keep a million of them. Expenses come in as
+    dicts and go out as dicts (files, the database, the API, listeners);
+    from_dict() and to_dict() convert at that boundary and nowhere else.
+    The id is the stable integer the store handed out, or None before that.
+    The amount is held as an integer of the currency's minor unit, so sums
+    are exact; the dicts and rows carry it in whole units.
+    """
+
+    __slots__ = ("id", "amount_minor") + FIELDS[1:]
+
+    def __init__(self, expense_id, amount_minor, currency, category, description, user, date, invoice):
+        self.id = expense_id
+        self.amount_minor = amount_minor
+        self.currency = sys.intern(currency)
+        self.category = sys.intern(category)
+        self.description = description
+        self.user = sys.intern(user)
+        self.date = sys.intern(date)
+        self.invoice = invoice
+
+    @classmethod
+    def from_dict(cls, record, expense_id=None):
+        """Builds an expense from a ledger dict, filling fields old entries lack with defaults."""
+        currency = record.get("currency", "HUF")
+        return cls(record.get("id") if expense_id is None else expense_id,
+                   to_minor(record.get("amount", 0), currency),
+                   currency,
+                   record.get("category", "Unknown"),
+                   record.get("description", ""),
+                   record.get("user", "Unknown"),
+                   record.get("date", "N/A"),
+                   record.get("invoice", "N/A"))
+
+    @property
+    def amount(self):
+        """The amount in whole units of its currency, e.g. 12.34 for 1234 cents."""
+        return from_minor(self.amount_minor, self.currency)
+
+    def to_dict(self):
+        """Returns the expense as a ledger dict; without "id" if it has none yet."""
+        record = {"id": self.id} if self.id is not None else {}
+        record.update(amount=self.amount, currency=self.currency, category=self.category,
+                      description=self.description, user=self.user, date=self.date, invoice=self.invoice)
+        return record
+
+    def as_row(self):
+        """Returns the values of ROW_FIELDS as a tuple."""
+        return (self.id, self.amount, self.currency, self.category, self.description, self.user, self.date,
+                self.invoice)
+
+    def _key(self):
+        return (self.id, self.amount_minor, self.currency, self.category, self.description, self.user, self.date,
+                self.invoice)
+
+    def matches(self, user=None, category=None, currency=None, invoice=None, date_from=None, date_to=None,
+                after=None):
+        """Tells whether the expense passes the given store.query() filters; after keeps ids above it."""
+        if after is not None and self.id <= after:
+            return False
+        if user is not None and self.user != user:
+            return False
+        if category is not None and self.category != category:
+            return False
+        if currency is not None and self.currency != currency:
+            return False
+        if invoice is not None and self.invoice != invoice:
+            return False
+        if date_from is not None and self.date < date_from:
+            return False
+        if date_to is not None and self.date > date_to:
+            return False
+        return True
+
+    def __eq__(self, other):
+        if not isinstance(other, Expense):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __repr__(self):
+        return f"Expense({', '.join(map(repr, self.as_row()))})"
@@ -0,0 +1,212 @@
+"""Command line interface to the expense ledger, for scripts and scheduled jobs.
+
+It works on the same store as the GUI through ledger.Ledger and never
+imports tkinter or matplotlib, so it starts fast.
+
+Examples:
+    python expense_cli.py add 1200 --currency HUF --category Food --description Lunch --user A --invoice 42
+    python expense_cli.py import statement.csv --map amount=Amount --map date="Booking date" --user A \\
+        --category Else --date-format %Y.%m.%d. --decimal , --negate
+    python expense_cli.py query --user A --from 2025-01-01 --to 2025-03-31
+    python expense_cli.py total --by category --currency EUR
+    python expense_cli.py report --user A --number 17
+    python expense_cli.py export ledger.csv.gz --category Food
+"""
+import argparse
+import csv
+import datetime
+import sys
+
+from csv_import import DATE_FORMATS, IMPORT_FIELDS, guess_mapping, read_header
+from currency import CURRENCY_RATES, format_minor
+from exchange_rates import RATES_FILE
+from expense_store import DEFAULT_BACKEND, ROW_FIELDS, matches
+from ledger import CATEGORIES, Ledger
+
+# Files that "import" reads as JSON or JSON Lines ledgers rather than statement CSVs
+JSON_ENDINGS = (".json", ".jsonl")
+
+# Errors shown per import before the rest are only counted
+SHOWN_ERRORS = 20
+
+
+def iso_date(text):
+    """argparse type for YYYY-MM-DD dates."""
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a YYYY-MM-DD date")
+
+
+def add_filter_arguments(parser):
+    """Adds the store.query() filters as options."""
+    parser.add_argument("--user")
+    parser.add_argument("--category")
+    parser.add_argument("--currency", dest="currency_filter", metavar="CURRENCY")
+    parser.add_argument("--invoice")
+    parser.add_argument("--from", dest="date_from", type=iso_date, metavar="YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", type=iso_date, metavar="YYYY-MM-DD")
+
+
+def filters_of(args):
+    """Returns the store.query() filters given on the command line."""
+    filters = {"user": args.user, "category": args.category, "currency": args.currency_filter,
+               "invoice": args.invoice, "date_from": args.date_from, "date_to": args.date_to}
+    return {name: value for name, value in filters.items() if value is not None}
+
+
+def command_add(ledger, args):
+    """Adds one expense, refusing a duplicate unless allowed."""
+    expense = {
+        "amount": args.amount,
+        "currency": args.currency,
+        "category": args.category,
+        "description": args.description,
+        "user": args.user,
+        "date": args.date,
+        "invoice": args.invoice,
+    }
+    found = ledger.duplicates_of(expense)
+    if found and not args.allow_duplicate:
+        sys.exit(f"Not added: looks like expense {', '.join(map(str, found))} (use --allow-duplicate to add it)")
+    print(ledger.add(expense))
+
+
+def command_import(ledger, args):
+    """Imports a statement CSV in one transaction, or streams in a JSON ledger."""
+    if args.file.lower().endswith(JSON_ENDINGS):
+        print(f"{ledger.load_json(args.file)} expenses added")
+        return
+    mapping = guess_mapping(read_header(args.file)[0])
+    for pair in args.map:
+        field, _, column = pair.partition("=")
+        if field not in IMPORT_FIELDS or not column:
+            sys.exit(f"--map takes FIELD=COLUMN with FIELD one of {', '.join(IMPORT_FIELDS)}")
+        mapping[field] = column
+    defaults = {field: value for field, value in (("user", args.user), ("category", args.category)) if value}
+    added, errors, duplicates = ledger.import_csv(args.file, mapping=mapping, defaults=defaults,
+                                                  categories=CATEGORIES, date_format=args.date_format,
+                                                  decimal=args.decimal, negate=args.negate)
+    print(f"{added} expenses imported, {duplicates} duplicates skipped, {len(errors)} rows rejected")
+    for line, error in errors[:SHOWN_ERRORS]:
+        print(f"line {line}: {error}", file=sys.stderr)
+    if len(errors) > SHOWN_ERRORS:
+        print(f"...and {len(errors) - SHOWN_ERRORS} more", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+def command_query(ledger, args):
+    """Prints the matching expenses as CSV, streamed from the store."""
+    writer = csv.writer(sys.stdout, delimiter="\t" if args.tsv else ",", lineterminator="\n")
+    writer.writerow(ROW_FIELDS)
+    filters = filters_of(args)
+    if args.search:
+        rows = (tuple(record[field] for field in ROW_FIELDS) for record in ledger.store.search(args.search)
+                if matches(record, **filters))
+    else:
+        rows = ledger.store.query_rows(**filters)
+    writer.writerows(rows)
+
+
+def command_total(ledger, args):
+    """Prints the total, or the totals per user, category or currency."""
+    if args.by:
+        for name, total in sorted(ledger.totals_by(args.by, args.currency).items()):
+            print(f"{name}\t{format_minor(total, args.currency)}")
+    else:
+        print(format_minor(ledger.total(args.currency), args.currency))
+
+
+def command_report(ledger, args):
+    """Writes the PDF report of one user, or of every user."""
+    if args.all:
+        files, seconds = ledger.all_reports(args.number, args.per_month)
+        print(f"{len(files)} reports written in {seconds:.1f} s")
+    elif args.user:
+        if not ledger.store.count(user=args.user):
+            sys.exit(f"No expenses found for {args.user}")
+        print(ledger.report(f"expense_report_{args.number}.pdf", args.number, args.user))
+    else:
+        sys.exit("report needs --user or --all")
+
+
+def command_export(ledger, args):
+    """Streams the matching expenses to a file."""
+    print(f"{ledger.export(args.file, **filters_of(args))} expenses exported to {args.file}")
+
+
+def build_parser():
+    """Returns the argument parser with a subcommand per task."""
+    parser = argparse.ArgumentParser(description="Expense tracker without the window.")
+    parser.add_argument("--backend", choices=("sqlite", "journal", "http"), default=DEFAULT_BACKEND)
+    parser.add_argument("--db", dest="path", help="database (or journal snapshot) file, or the service URL")
+    parser.add_argument("--rates", default=RATES_FILE, help="historical exchange rate file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add one expense")
+    add.add_argument("amount", type=float)
+    add.add_argument("--currency", choices=list(CURRENCY_RATES), default="HUF")
+    add.add_argument("--category", required=True)
+    add.add_argument("--description", required=True)
+    add.add_argument("--user", required=True)
+    add.add_argument("--date", type=iso_date, default=datetime.date.today().isoformat())
+    add.add_argument("--invoice", required=True)
+    add.add_argument("--allow-duplicate", action="store_true", help="add even if the invoice is already recorded")
+    add.set_defaults(handler=command_add, totals=False)
+
+    import_ = commands.add_parser("import", help="import a statement CSV, or a JSON / JSON Lines ledger")
+    import_.add_argument("file")
+    import_.add_argument("--map", action="append", default=[], metavar="FIELD=COLUMN",
+                         help="column of a field, if not recognized from the header")
+    import_.add_argument("--user", help="user of rows without one")
+    import_.add_argument("--category", choices=CATEGORIES, help="category of rows without one")
+    import_.add_argument("--date-format", default=DATE_FORMATS[0], help="strptime format of the dates")
+    import_.add_argument("--decimal", choices=(".", ","), default=".", help="decimal separator of the amounts")
+    import_.add_argument("--negate", action="store_true", help="spending is listed as negative amounts")
+    import_.set_defaults(handler=command_import, totals=False)
+
+    query = commands.add_parser("query", help="print matching expenses as CSV")
+    add_filter_arguments(query)
+    query.add_argument("--search", help="text to look for in category, description, user, date or invoice")
+    query.add_argument("--tsv", action="store_true", help="separate the columns with tabs")
+    query.set_defaults(handler=command_query, totals=False)
+
+    total = commands.add_parser("total", help="print the total, or totals per user, category or currency")
+    total.add_argument("--by", choices=("user", "category", "currency"))
+    total.add_argument("--currency", choices=list(CURRENCY_RATES), default="HUF", help="currency of the totals")
+    total.set_defaults(handler=command_total, totals=True)
+
+    report = commands.add_parser("report", help="write PDF expense reports")
+    report.add_argument("--number", required=True, help="expense report number")
+    report.add_argument("--user")
+    report.add_argument("--all", action="store_true", help="one report per user")
+    report.add_argument("--per-month", action="store_true", help="with --all, one report per user and month")
+    report.set_defaults(handler=command_report, totals=True)
+
+    export = commands.add_parser("export", help="export expenses to .csv or .jsonl, optionally .gz or .xz")
+    export.add_argument("file")
+    add_filter_arguments(export)
+    export.set_defaults(handler=command_export, totals=False)
+    return parser
+
+
+def main(argv=None):
+    """Runs one subcommand against the ledger and closes it."""
+    args = build_parser().parse_args(argv)
+    ledger = Ledger()
+    try:
+        ledger.load_rates(args.rates)
+    except (IOError, ValueError) as error:
+        print(f"Could not read the exchange rate file, using the fixed rates: {error}", file=sys.stderr)
+    ledger.open(args.backend, args.path, totals=args.totals)
+    try:
+        args.handler(ledger, args)
+    except (IOError, ValueError, csv.Error) as error:
+        sys.exit(f"Error: {error}")
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
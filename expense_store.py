@@ -0,0 +1,800 @@
+import os
+import sqlite3
+import threading
+
+from currency import DEFAULT_EXPONENT, MINOR_UNIT_EXPONENTS, from_minor, minor_scale, to_minor
+from duplicates import fingerprint, invoice_key
+from expense import FIELDS, ROW_FIELDS, Expense
+from file_lock import FileLock, replace_file
+from journal import ExpenseJournal
+from json_stream import batched
+
+DATABASE_FILE = "expenses.db"
+
+# How long a write waits for another process's transaction to finish, in seconds
+BUSY_TIMEOUT = 30.0
+
+# Which storage backend open_store() uses by default: "sqlite", "journal" or "http" (api_server)
+DEFAULT_BACKEND = "sqlite"
+
+# Amounts are stored as integer minor units of their currency (see currency.to_minor). AUTOINCREMENT keeps
+# the id of a deleted expense from being handed out again, as undo and version checks rely on ids
+TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    amount_minor INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL,
+    "user" TEXT NOT NULL,
+    date TEXT NOT NULL,
+    invoice TEXT NOT NULL
+);
+"""
+
+# Columns of the expenses table after the id
+STORED_COLUMNS = ("amount_minor",) + FIELDS[1:]
+
+# Every process's changes are logged by triggers with the expense as it was before (NULLs for an add),
+# so poll() can pass on just what others changed
+CHANGE_LOG_SQL = """
+CREATE TABLE IF NOT EXISTS expense_changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    expense_id INTEGER NOT NULL,
+    {old_columns}
+);
+CREATE TRIGGER IF NOT EXISTS expenses_added AFTER INSERT ON expenses BEGIN
+    INSERT INTO expense_changes (expense_id) VALUES (new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_modified AFTER UPDATE ON expenses BEGIN
+    INSERT INTO expense_changes (expense_id, {old_names}) VALUES (old.id, {old_values});
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_deleted AFTER DELETE ON expenses BEGIN
+    INSERT INTO expense_changes (expense_id, {old_names}) VALUES (old.id, {old_values});
+END;
+""".format(old_columns=",\n    ".join(f'"old_{column}"' for column in STORED_COLUMNS),
+           old_names=", ".join(f'"old_{column}"' for column in STORED_COLUMNS),
+           old_values=", ".join(f'old."{column}"' for column in STORED_COLUMNS))
+
+# Log entries kept; a process that falls further behind reloads everything
+CHANGE_LOG_ROWS = 100000
+
+SCHEMA = TABLE_SQL.format(table="expenses") + """
+CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses ("user", date);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date);
+CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses (category);
+CREATE INDEX IF NOT EXISTS idx_expenses_currency ON expenses (currency);
+CREATE INDEX IF NOT EXISTS idx_expenses_invoice ON expenses (invoice);
+CREATE INDEX IF NOT EXISTS idx_expenses_invoice_key ON expenses (TRIM("user"), UPPER(TRIM(invoice)));
+CREATE INDEX IF NOT EXISTS idx_expenses_date_amount ON expenses (date, amount_minor);
+""" + CHANGE_LOG_SQL
+
+# The amount in whole units, worked out from the minor units like currency.from_minor
+AMOUNT_SQL = ("amount_minor * 1.0 / CASE currency "
+              + " ".join(f"WHEN '{currency}' THEN {minor_scale(currency)}" for currency in MINOR_UNIT_EXPONENTS)
+              + f" ELSE {10 ** DEFAULT_EXPONENT} END")
+
+# Columns that read an expense as a record dict or ROW_FIELDS tuple
+RECORD_COLUMNS = ", ".join(f"{AMOUNT_SQL} AS amount" if field == "amount" else f'"{field}"'
+                           for field in ROW_FIELDS)
+
+# Rows read from the database at a time while a query is being iterated
+PAGE_ROWS = 500
+
+# Text fields matched by search()
+SEARCH_FIELDS = ("category", "description", "user", "date", "invoice")
+
+# Columns that can be grouped on or filtered for equality
+GROUP_COLUMNS = ("currency", "category", "user", "date", "invoice")
+
+
+def normalize_record(record):
+    """Returns a copy of record with every field present, filling old entries with defaults."""
+    return dict(zip(FIELDS, Expense.from_dict(record).as_row()[1:]))
+
+
+class ConflictError(ValueError):
+    """An expense was changed by someone else since it was read, in a way that cannot be merged."""
+
+
+def rebase_edit(expense_id, op, record, expected, current):
+    """Returns what an operation made against the expected version should write over the current one.
+
+    A modify keeps the fields the caller did not touch at their current
+    value, so edits of different fields made at the same time both survive;
+    a field changed differently on both sides raises ConflictError. A delete
+    of an expense changed since it was read raises ConflictError too.
+    """
+    expected = normalize_record(expected)
+    current = normalize_record(current)
+    if op == "delete":
+        if current != expected:
+            raise ConflictError(f"Expense {expense_id} was changed by someone else and was not deleted")
+        return None
+    record = normalize_record(record)
+    merged = {}
+    for field in FIELDS:
+        if record[field] == expected[field]:
+            merged[field] = current[field]
+        elif current[field] in (expected[field], record[field]):
+            merged[field] = record[field]
+        else:
+            raise ConflictError(f"Expense {expense_id} was changed by someone else: its {field} "
+                                f"is now {current[field]!r}")
+    return merged
+
+
+def _logged_record(row):
+    """Returns the record a change log row holds as it was before the change, or None for an add."""
+    if row["old_currency"] is None:
+        return None
+    record = {field: row[f"old_{field}"] for field in FIELDS[1:]}
+    record["amount"] = from_minor(row["old_amount_minor"], record["currency"])
+    return record
+
+
+def _values(record):
+    """Returns the column values of a normalized record, the amount in minor units."""
+    return [to_minor(record["amount"], record["currency"])] + [record[field] for field in FIELDS[1:]]
+
+
+def matches(record, **filters):
+    """Tells whether a record dict passes the given query filters; see Expense.matches."""
+    return Expense.from_dict(record).matches(**filters)
+
+
+# Case-insensitive substring match over the searchable text fields
+SEARCH_SQL = ("SELECT {columns} FROM expenses WHERE category LIKE :p ESCAPE '\\' "
+              "OR description LIKE :p ESCAPE '\\' OR \"user\" LIKE :p ESCAPE '\\' "
+              "OR date LIKE :p ESCAPE '\\' OR invoice LIKE :p ESCAPE '\\' ORDER BY id")
+
+
+def like_pattern(text):
+    """Returns a LIKE pattern matching text anywhere, with wildcards in text escaped."""
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class SQLiteExpenseStore:
+    """Keeps expenses in an SQLite database with indexes on user, date, category, currency and invoice.
+
+    The store may be used from several threads; every use of the connection
+    goes through self.lock, and iterating a query only holds it while the next
+    page of rows is read.
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        # Other processes may write to the same file; a write waits up to BUSY_TIMEOUT for theirs
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # A committed expense must survive a power cut too, not only a crash of the program
+            self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        if self._migrate():
+            # The triggers went with the old table
+            self.conn.executescript(SCHEMA)
+        self.listeners = []
+        self.data_version = self._execute("PRAGMA data_version")[0][0]
+        # Last change log entry passed on to the listeners or made by this store
+        self.seen_version = self._execute("SELECT COALESCE(MAX(version), 0) FROM expense_changes")[0][0]
+        # Set when a write found the log pruned past seen_version; the next poll() reports a reset
+        self.behind = False
+
+    def _outdated(self):
+        """Tells whether the expenses table predates minor unit amounts or never-reused ids."""
+        table_sql = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'expenses'")
+        return "amount_minor" not in self._columns() or "AUTOINCREMENT" not in table_sql.fetchone()[0].upper()
+
+    def _columns(self):
+        return [row[1] for row in self.conn.execute("PRAGMA table_info(expenses)")]
+
+    def _migrate(self):
+        """Rewrites a database of an older layout, holding the write lock meanwhile.
+
+        Amounts become minor units and the ids AUTOINCREMENT, which carries
+        on after the highest id in use. Returns True if it rewrote the table.
+        """
+        with self.lock:
+            if not self._outdated():
+                return False
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if not self._outdated():
+                # Another process got here first
+                return False
+            self.conn.create_function("to_minor", 2, to_minor)
+            amount = "amount_minor" if "amount_minor" in self._columns() else "to_minor(amount, currency)"
+            self.conn.execute(TABLE_SQL.format(table="expenses_minor"))
+            self.conn.execute(f"INSERT INTO expenses_minor SELECT id, {amount}, currency, category, "
+                              'description, "user", date, invoice FROM expenses')
+            self.conn.execute("DROP TABLE expenses")
+            self.conn.execute("ALTER TABLE expenses_minor RENAME TO expenses")
+            for statement in SCHEMA.split(";"):
+                if statement.strip().startswith("CREATE INDEX"):
+                    self.conn.execute(statement)
+        return True
+
+    def _execute(self, sql, params=()):
+        """Runs a statement and returns all of its rows."""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _rows(self, sql, params=()):
+        """Yields the rows of a statement as dicts, reading them a page at a time."""
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            rows = cursor.fetchmany(PAGE_ROWS)
+        while rows:
+            for row in rows:
+                yield dict(row)
+            with self.lock:
+                rows = cursor.fetchmany(PAGE_ROWS)
+
+    def subscribe(self, listener):
+        """Registers listener(changes) to be called after every committed change.
+
+        changes is a list of (op, expense_id, old, new) tuples where op is "add",
+        "modify" or "delete" and old/new are the records before and after (None
+        when there is no such record). One call covers one add_many() batch.
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, changes):
+        for listener in self.listeners:
+            listener(changes)
+
+    def add(self, record):
+        """Adds an expense and returns its id."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Adds several expenses in one transaction and returns their ids.
+
+        Records that already carry an "id" keep it; the others get a new one.
+        """
+        return self.apply_many([("add", record.get("id"), record) for record in records])
+
+    def update(self, expense_id, record, expected=None):
+        """Replaces the fields of an existing expense; see apply_many() for expected."""
+        self.apply_many([("modify", expense_id, record, expected)])
+
+    def delete(self, expense_id, expected=None):
+        """Removes an expense; see apply_many() for expected."""
+        self.apply_many([("delete", expense_id, None, expected)])
+
+    def apply_many(self, operations, written=None):
+        """Applies several (op, expense_id, record) operations in one transaction.
+
+        op is "add" (expense_id None to get a new id), "modify" or "delete"
+        (record None). Returns the id of every operation, or None for a
+        modify or delete of a missing expense, which is skipped. If one
+        operation fails, none of them is applied. Listeners get a single call.
+
+        A modify or delete may carry a fourth item, the expense as the caller
+        read it; if it was changed since, the edit is merged into the current
+        version or a ConflictError is raised (see rebase_edit()).
+
+        written, if given, is a list extended with the (op, expense_id, old,
+        new) changes of these operations alone, one per id returned, without
+        the changes of other processes the listeners get first.
+        """
+        ids = []
+        with self.lock, self.conn:
+            # Take the write lock up front, so no other process changes what is read below
+            self.conn.execute("BEGIN IMMEDIATE")
+            # What other processes committed first reaches the listeners ahead of these changes
+            changes = self._logged_changes()
+            if changes == "reset":
+                self.behind = True
+                changes = []
+            caught_up = len(changes)
+            for op, expense_id, record, *expected in operations:
+                if op == "add":
+                    record = normalize_record(record)
+                    cursor = self.conn.execute(
+                        'INSERT INTO expenses (id, amount_minor, currency, category, description, "user", date, '
+                        "invoice) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [expense_id] + _values(record))
+                    expense_id = record["id"] = cursor.lastrowid
+                    changes.append(("add", expense_id, None, record))
+                    ids.append(expense_id)
+                    continue
+                old = self.get(expense_id)
+                if old is None:
+                    ids.append(None)
+                    continue
+                if expected and expected[0] is not None:
+                    record = rebase_edit(expense_id, op, record, expected[0], old)
+                if op == "modify":
+                    record = normalize_record(record)
+                    self.conn.execute(
+                        'UPDATE expenses SET amount_minor = ?, currency = ?, category = ?, description = ?, '
+                        '"user" = ?, date = ?, invoice = ? WHERE id = ?',
+                        _values(record) + [expense_id])
+                    record["id"] = expense_id
+                    changes.append(("modify", expense_id, old, record))
+                elif op == "delete":
+                    self.conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+                    changes.append(("delete", expense_id, old, None))
+                else:
+                    raise ValueError(f"Unknown operation {op!r}")
+                ids.append(expense_id)
+            self.seen_version = self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM expense_changes").fetchone()[0]
+            self.conn.execute("DELETE FROM expense_changes WHERE version <= ?", (self.seen_version - CHANGE_LOG_ROWS,))
+        if written is not None:
+            written.extend(changes[caught_up:])
+        if changes:
+            self._notify(changes)
+        return ids
+
+    def poll(self):
+        """Hands the changes other processes made since the last look to the listeners; returns how many.
+
+        Only the changed expenses are read, from the change log. Returns
+        "reset" if this store fell so far behind that the log no longer
+        holds everything, and everything kept in step has to be reloaded.
+        """
+        if self.behind:
+            self.behind = False
+            return "reset"
+        data_version = self._execute("PRAGMA data_version")[0][0]
+        if data_version == self.data_version:
+            return 0
+        self.data_version = data_version
+        with self.lock, self.conn:
+            # One read transaction, so the log and the expenses agree
+            self.conn.execute("BEGIN")
+            changes = self._logged_changes()
+        if changes == "reset":
+            return changes
+        if changes:
+            self._notify(changes)
+        return len(changes)
+
+    def _logged_changes(self):
+        """Returns the changes logged after self.seen_version as listener changes, or "reset" if some are gone.
+
+        Called inside a transaction. Each expense changed several times
+        gives one change, from its oldest logged version to its current one.
+        """
+        first = self.conn.execute("SELECT MIN(version) FROM expense_changes").fetchone()[0]
+        if first is not None and first > self.seen_version + 1:
+            self.seen_version = self.conn.execute("SELECT MAX(version) FROM expense_changes").fetchone()[0]
+            return "reset"
+        olds = {}
+        cursor = self.conn.execute("SELECT * FROM expense_changes WHERE version > ? ORDER BY version",
+                                   (self.seen_version,))
+        for row in cursor:
+            self.seen_version = row["version"]
+            if row["expense_id"] not in olds:
+                olds[row["expense_id"]] = _logged_record(row)
+        if not olds:
+            return []
+        news = {record["id"]: record for record in self.get_many(olds)}
+        changes = []
+        for expense_id, old in olds.items():
+            new = news.get(expense_id)
+            if old is None and new is None:
+                continue
+            if old is not None:
+                old["id"] = expense_id
+            op = "add" if old is None else "delete" if new is None else "modify"
+            changes.append((op, expense_id, old, new))
+        return changes
+
+    def get(self, expense_id):
+        """Returns a single expense or None."""
+        rows = self._execute(f"SELECT {RECORD_COLUMNS} FROM expenses WHERE id = ?", (expense_id,))
+        return dict(rows[0]) if rows else None
+
+    def get_many(self, expense_ids):
+        """Returns the expenses with the given ids, in the same order, skipping missing ones."""
+        expense_ids = list(expense_ids)
+        found = {}
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(expense_ids), 500):
+            chunk = expense_ids[start:start + 500]
+            sql = f"SELECT {RECORD_COLUMNS} FROM expenses WHERE id IN ({', '.join('?' * len(chunk))})"
+            for row in self._execute(sql, chunk):
+                found[row["id"]] = dict(row)
+        return [found[expense_id] for expense_id in expense_ids if expense_id in found]
+
+    def _where(self, user=None, category=None, currency=None, invoice=None, date_from=None, date_to=None,
+               after=None):
+        """Builds the WHERE clause and parameters for the given filters."""
+        clauses = []
+        params = []
+        for column, value in (("user", user), ("category", category), ("currency", currency),
+                              ("invoice", invoice)):
+            if value is not None:
+                clauses.append(f'"{column}" = ?')
+                params.append(value)
+        if date_from is not None:
+            clauses.append("date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("date <= ?")
+            params.append(date_to)
+        if after is not None:
+            # Lets a reader page through the ledger by id instead of an ever larger OFFSET
+            clauses.append("id > ?")
+            params.append(after)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit=None, offset=0, **filters):
+        """Yields the expenses matching the filters in insertion order."""
+        where, params = self._where(**filters)
+        sql = f"SELECT {RECORD_COLUMNS} FROM expenses{where} ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return self._rows(sql, params)
+
+    def query_rows(self, **filters):
+        """Yields the expenses matching the filters as tuples of ROW_FIELDS, in insertion order.
+
+        Meant for bulk readers like exports, which need no dict per expense.
+        """
+        where, params = self._where(**filters)
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(f"SELECT {RECORD_COLUMNS} FROM expenses{where} ORDER BY id", params)
+            rows = cursor.fetchmany(PAGE_ROWS)
+        while rows:
+            yield from rows
+            with self.lock:
+                rows = cursor.fetchmany(PAGE_ROWS)
+
+    def count(self, **filters):
+        """Returns how many expenses match the filters."""
+        where, params = self._where(**filters)
+        return self._execute("SELECT COUNT(*) FROM expenses" + where, params)[0][0]
+
+    def duplicate_candidates(self, records):
+        """Returns the stored expenses with the (user, invoice) or the date and amount of one of records.
+
+        These include every expense duplicates.DuplicateIndex would match
+        against records, found through two indexes rather than by reading
+        the ledger; invoice numbers compare without ASCII case only.
+        """
+        found = {}
+        # Two parameters per term; stay below SQLite's limit on the number of query parameters
+        for chunk in batched(records, 200):
+            terms = []
+            params = []
+            for record in chunk:
+                key = invoice_key(record)
+                if key is not None:
+                    terms.append('(TRIM("user") = ? AND UPPER(TRIM(invoice)) = ?)')
+                    params += key
+                content = fingerprint(record)
+                terms.append("(date = ? AND amount_minor = ?)")
+                params += [content[2], content[0]]
+            for row in self._execute(f"SELECT {RECORD_COLUMNS} FROM expenses WHERE {' OR '.join(terms)}", params):
+                found[row["id"]] = dict(row)
+        return list(found.values())
+
+    def search(self, text):
+        """Yields the expenses whose category, description, user, date or invoice contain text."""
+        return self._rows(SEARCH_SQL.format(columns=RECORD_COLUMNS), {"p": like_pattern(text)})
+
+    def search_ids(self, text):
+        """Returns the ids of the expenses that search() would yield."""
+        return [row[0] for row in self._execute(SEARCH_SQL.format(columns="id"), {"p": like_pattern(text)})]
+
+    def totals_by(self, column, **filters):
+        """Returns the summed minor units grouped by column and currency, e.g. {("Food", "EUR"): 5000}."""
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Cannot group expenses by {column!r}")
+        where, params = self._where(**filters)
+        sql = (f'SELECT "{column}", currency, SUM(amount_minor) FROM expenses{where} '
+               f'GROUP BY "{column}", currency')
+        return {(key, currency): total for key, currency, total in self._execute(sql, params)}
+
+    def group_totals(self):
+        """Returns {(user, category, currency): (summed minor units, count)} over the whole ledger."""
+        sql = ('SELECT "user", category, currency, SUM(amount_minor), COUNT(*) FROM expenses '
+               'GROUP BY "user", category, currency')
+        return {(user, category, currency): (total, count)
+                for user, category, currency, total, count in self._execute(sql)}
+
+    def close(self):
+        """Closes the database connection."""
+        with self.lock:
+            self.conn.close()
+
+
+class JournalExpenseStore:
+    """Keeps expenses in memory as Expense objects and persists them through an ExpenseJournal.
+
+    Changes are made under self.lock; readers iterate over a snapshot of the
+    records so they can run on other threads while the ledger is modified.
+    Other processes may share the journal: every change is made under the
+    journal's file lock, after catching up with theirs. Dicts only appear
+    where expenses enter or leave the store.
+    """
+
+    def __init__(self, journal=None):
+        self.lock = threading.RLock()
+        self.journal = journal or ExpenseJournal()
+        self.listeners = []
+        with self.journal.lock:
+            self.records = self._read()
+            self._compact_if_needed()
+
+    def _read(self):
+        """Returns every expense in the journal's files, keyed by id, streaming the snapshot."""
+        return {record["id"]: Expense.from_dict(record) for record in self.journal.iter_records()}
+
+    def _catch_up(self):
+        """Takes over what other processes journaled and returns it as listener changes.
+
+        Called with both locks held. After another process compacted, the
+        whole ledger is read again and compared with the one in memory.
+        """
+        changed = self.journal.read_new()
+        if changed is None:
+            old_records = self.records
+            self.records = self._read()
+            changed = {expense_id: None for expense_id in old_records}
+            changed.update(self.records)
+        else:
+            old_records = {expense_id: self.records.get(expense_id) for expense_id in changed}
+            for expense_id, record in changed.items():
+                if record is None:
+                    self.records.pop(expense_id, None)
+                else:
+                    self.records[expense_id] = Expense.from_dict(record, expense_id)
+        changes = []
+        for expense_id in changed:
+            old = old_records.get(expense_id)
+            new = self.records.get(expense_id)
+            if old == new:
+                continue
+            if old is None:
+                changes.append(("add", expense_id, None, new.to_dict()))
+            elif new is None:
+                changes.append(("delete", expense_id, old.to_dict(), None))
+            else:
+                changes.append(("modify", expense_id, old.to_dict(), new.to_dict()))
+        return changes
+
+    def poll(self):
+        """Hands the changes other processes made since the last look to the listeners; returns how many."""
+        with self.lock, self.journal.lock:
+            changes = self._catch_up()
+        if changes:
+            self._notify(changes)
+        return len(changes)
+
+    def subscribe(self, listener):
+        """Registers listener(changes) to be called after every change; see SQLiteExpenseStore.subscribe."""
+        self.listeners.append(listener)
+
+    def _notify(self, changes):
+        for listener in self.listeners:
+            listener(changes)
+
+    def _snapshot(self):
+        """Returns the current expenses as a list that later changes will not affect."""
+        with self.lock:
+            return list(self.records.values())
+
+    def _compact_if_needed(self):
+        """Folds the journal into a new snapshot once it has grown large enough."""
+        if self.journal.needs_compaction(len(self.records)):
+            self.journal.compact(expense.to_dict() for expense in self.records.values())
+
+    def add(self, record):
+        """Adds an expense and returns its id."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Adds several expenses and returns their ids.
+
+        Records that already carry an "id" keep it; the others get a new one.
+        """
+        return self.apply_many([("add", record.get("id"), record) for record in records])
+
+    def update(self, expense_id, record, expected=None):
+        """Replaces the fields of an existing expense; see apply_many() for expected."""
+        self.apply_many([("modify", expense_id, record, expected)])
+
+    def delete(self, expense_id, expected=None):
+        """Removes an expense; see apply_many() for expected."""
+        self.apply_many([("delete", expense_id, None, expected)])
+
+    def apply_many(self, operations, written=None):
+        """Applies several (op, expense_id, record) operations; see SQLiteExpenseStore.apply_many.
+
+        Every operation is checked and rebased before the first one is
+        applied, so a ConflictError or ValueError leaves the ledger as it
+        was. The changes other processes made first reach the listeners in
+        the same call, even when an operation is refused.
+        """
+        ids = []
+        with self.lock, self.journal.lock:
+            changes = self._catch_up()
+            caught_up = len(changes)
+            try:
+                planned = self._plan(operations, ids)
+                for op, expense_id, old, expense in planned:
+                    if expense is None:
+                        del self.records[expense_id]
+                        self.journal.append("delete", expense_id)
+                        changes.append(("delete", expense_id, old, None))
+                        continue
+                    self.records[expense_id] = expense
+                    record = expense.to_dict()
+                    self.journal.append(op, expense_id, record)
+                    changes.append((op, expense_id, old, record))
+                if planned:
+                    self.journal.sync()
+                    self._compact_if_needed()
+                if written is not None:
+                    written.extend(changes[caught_up:])
+            finally:
+                if changes:
+                    self._notify(changes)
+        return ids
+
+    def _plan(self, operations, ids):
+        """Works out what every operation writes without changing anything; appends their ids to ids.
+
+        Returns (op, expense_id, old record, new Expense or None) per write,
+        in order; later operations see the effect of earlier ones.
+        """
+        planned = []
+        # Expenses as the earlier operations leave them; None once deleted
+        pending = {}
+        for op, expense_id, record, *expected in operations:
+            if op == "add":
+                expense_id = self.journal.allocate_id() if expense_id is None else expense_id
+                expense = Expense.from_dict(record, expense_id)
+                old = pending.get(expense_id, self.records.get(expense_id))
+                planned.append(("add", expense_id, old.to_dict() if old is not None else None, expense))
+                pending[expense_id] = expense
+                ids.append(expense_id)
+                continue
+            if op not in ("modify", "delete"):
+                raise ValueError(f"Unknown operation {op!r}")
+            old = pending.get(expense_id, self.records.get(expense_id))
+            if old is None:
+                ids.append(None)
+                continue
+            old = old.to_dict()
+            if expected and expected[0] is not None:
+                record = rebase_edit(expense_id, op, record, expected[0], old)
+            expense = Expense.from_dict(record, expense_id) if op == "modify" else None
+            planned.append((op, expense_id, old, expense))
+            pending[expense_id] = expense
+            ids.append(expense_id)
+        return planned
+
+    def get(self, expense_id):
+        """Returns a single expense or None."""
+        expense = self.records.get(expense_id)
+        return expense.to_dict() if expense is not None else None
+
+    def get_many(self, expense_ids):
+        """Returns the expenses with the given ids, in the same order, skipping missing ones."""
+        with self.lock:
+            found = [self.records.get(expense_id) for expense_id in expense_ids]
+        return [expense.to_dict() for expense in found if expense is not None]
+
+    def query(self, limit=None, offset=0, **filters):
+        """Yields the expenses matching the filters in insertion order."""
+        found = (expense for expense in self._snapshot() if expense.matches(**filters))
+        for index, expense in enumerate(found):
+            if index < offset:
+                continue
+            if limit is not None and index >= offset + limit:
+                break
+            yield expense.to_dict()
+
+    def query_rows(self, **filters):
+        """Yields the expenses matching the filters as tuples of ROW_FIELDS, in insertion order."""
+        for expense in self._snapshot():
+            if expense.matches(**filters):
+                yield expense.as_row()
+
+    def count(self, **filters):
+        """Returns how many expenses match the filters."""
+        if not filters:
+            return len(self.records)
+        return sum(1 for expense in self._snapshot() if expense.matches(**filters))
+
+    def _search(self, text):
+        text = text.lower()
+        for expense in self._snapshot():
+            if any(text in getattr(expense, field).lower() for field in SEARCH_FIELDS):
+                yield expense
+
+    def search(self, text):
+        """Yields the expenses whose category, description, user, date or invoice contain text."""
+        for expense in self._search(text):
+            yield expense.to_dict()
+
+    def search_ids(self, text):
+        """Returns the ids of the expenses that search() would yield."""
+        return [expense.id for expense in self._search(text)]
+
+    def totals_by(self, column, **filters):
+        """Returns the summed minor units grouped by column and currency, e.g. {("Food", "EUR"): 5000}."""
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Cannot group expenses by {column!r}")
+        totals = {}
+        for expense in self._snapshot():
+            if expense.matches(**filters):
+                key = (getattr(expense, column), expense.currency)
+                totals[key] = totals.get(key, 0) + expense.amount_minor
+        return totals
+
+    def group_totals(self):
+        """Returns {(user, category, currency): (summed minor units, count)} over the whole ledger."""
+        groups = {}
+        for expense in self._snapshot():
+            key = (expense.user, expense.category, expense.currency)
+            total, count = groups.get(key, (0, 0))
+            groups[key] = (total + expense.amount_minor, count + 1)
+        return groups
+
+    def close(self):
+        """Writes a final snapshot if the journal holds anything."""
+        with self.lock, self.journal.lock:
+            if self.journal.pending:
+                # Leave nothing of the other processes out of the snapshot
+                self._catch_up()
+                self.journal.compact(expense.to_dict() for expense in self.records.values())
+            self.journal.close()
+
+
+def open_store(backend=DEFAULT_BACKEND, path=None):
+    """Opens the expense store for the given backend.
+
+    For the journal backend path names the snapshot, and its journal is
+    kept next to it with the .journal extension. The first time the SQLite
+    database is created, the ledger kept in expenses.json and its journal
+    is streamed into it a batch at a time.
+    """
+    if backend == "journal":
+        if path is None:
+            return JournalExpenseStore(ExpenseJournal())
+        journal_path = os.path.splitext(path)[0] + ".journal"
+        if journal_path == path:
+            journal_path = path + ".journal"
+        return JournalExpenseStore(ExpenseJournal(snapshot_path=path, journal_path=journal_path))
+    if backend == "http":
+        # path is the URL of a running api_server
+        from api_client import HttpExpenseStore
+
+        return HttpExpenseStore() if path is None else HttpExpenseStore(path)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown storage backend {backend!r}")
+    path = DATABASE_FILE if path is None else path
+    if os.path.exists(path) or path == ":memory:":
+        return SQLiteExpenseStore(path)
+    # First run on SQLite: bring over the ledger kept in expenses.json and its journal.
+    # Every batch commits on its own, so the database is built under another name
+    # and only renamed once complete; an interrupted migration starts over.
+    # Processes starting at the same time take turns, and all but the first find it done.
+    journal = ExpenseJournal()
+    with FileLock(path + ".lock"), journal.lock:
+        if os.path.exists(path):
+            return SQLiteExpenseStore(path)
+        building = path + ".new"
+        for leftover in (building, building + "-wal", building + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        store = SQLiteExpenseStore(building)
+        try:
+            for batch in batched(journal.iter_records()):
+                store.add_many(batch)
+        finally:
+            store.close()
+        replace_file(building, path)
+    return SQLiteExpenseStore(path)
@@ -0,0 +1,105 @@
+import csv
+import gzip
+import json
+import lzma
+import math
+import os
+from json.encoder import encode_basestring
+
+from expense_store import ROW_FIELDS
+from json_stream import batched
+
+# Columns of an export, in order
+EXPORT_FIELDS = ROW_FIELDS
+
+# One JSON Lines record; filled in directly rather than through a dict per expense
+JSON_LINE = ('{"id": %d, "amount": %s, "currency": %s, "category": %s, "description": %s, '
+             '"user": %s, "date": %s, "invoice": %s}')
+
+# File name endings of the export formats and compressions
+FORMATS = {".csv": "csv", ".jsonl": "jsonl"}
+COMPRESSIONS = {".gz": "gzip", ".xz": "lzma"}
+
+# Records written at a time
+EXPORT_CHUNK_ROWS = 5000
+
+# Compression levels trading a little size for much less CPU time than the maximum
+GZIP_LEVEL = 6
+LZMA_PRESET = 1
+
+
+class ExportCancelled(Exception):
+    """Raised when an export was cancelled; the partial file has been removed."""
+
+
+def export_format(path):
+    """Returns the (format, compression) a file name asks for, e.g. ("csv", "gzip") for "a.csv.gz"."""
+    name = path.lower()
+    compression = None
+    for ending, kind in COMPRESSIONS.items():
+        if name.endswith(ending):
+            compression = kind
+            name = name[:-len(ending)]
+    for ending, kind in FORMATS.items():
+        if name.endswith(ending):
+            return kind, compression
+    raise ValueError(f"Cannot tell the export format of {path}; use .csv or .jsonl, optionally with .gz or .xz")
+
+
+def open_output(path, compression=None):
+    """Opens a text file for writing, compressing it with gzip or lzma if asked to."""
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=GZIP_LEVEL)
+    if compression == "lzma":
+        return lzma.open(path, "wt", encoding="utf-8", newline="", preset=LZMA_PRESET)
+    if compression is not None:
+        raise ValueError(f"Unknown compression {compression!r}")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def json_lines(rows):
+    """Returns the JSON Lines text of a list of ROW_FIELDS tuples."""
+    quote = encode_basestring
+    return "".join(
+        JSON_LINE % (expense_id, repr(amount) if math.isfinite(amount) else json.dumps(amount), quote(currency),
+                     quote(category), quote(description), quote(user), quote(date), quote(invoice)) + "\n"
+        for expense_id, amount, currency, category, description, user, date, invoice in rows)
+
+
+def export_expenses(store, path, fmt=None, compression=None, progress=None, is_cancelled=None, **filters):
+    """Writes the expenses matching filters (see store.query) to a CSV or JSON Lines file.
+
+    The format and compression follow the file name unless given. Records
+    are streamed from the store and written a chunk at a time, so only one
+    chunk is ever in memory. progress(rows_written, total) is called after
+    every chunk and is_cancelled() checked before it; an export cancelled
+    before its last chunk removes the partial file and raises
+    ExportCancelled, while one cancelled later is complete and kept.
+    Returns the number of rows written.
+    """
+    if fmt is None:
+        fmt, compression = export_format(path)
+    if fmt not in FORMATS.values():
+        raise ValueError(f"Unknown export format {fmt!r}")
+    total = store.count(**filters) if progress is not None else 0
+    written = 0
+    cancelled = False
+    with open_output(path, compression) as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_FIELDS)
+        for chunk in batched(store.query_rows(**filters), EXPORT_CHUNK_ROWS):
+            if is_cancelled is not None and is_cancelled():
+                cancelled = True
+                break
+            if fmt == "csv":
+                writer.writerows(chunk)
+            else:
+                f.write(json_lines(chunk))
+            written += len(chunk)
+            if progress is not None:
+                progress(written, total)
+    if cancelled:
+        os.remove(path)
+        raise ExportCancelled()
+    return written
@@ -0,0 +1,84 @@
+import datetime
+import tkinter as tk
+from tkinter import ttk, filedialog
+
+# File types offered when choosing where to export; the ending picks the format
+EXPORT_FILE_TYPES = [
+    ("CSV", "*.csv"),
+    ("CSV, gzip", "*.csv.gz"),
+    ("CSV, xz", "*.csv.xz"),
+    ("JSON Lines", "*.jsonl"),
+    ("JSON Lines, gzip", "*.jsonl.gz"),
+    ("JSON Lines, xz", "*.jsonl.xz"),
+]
+
+# Choice of a filter that lets everything through
+ALL = "(all)"
+
+
+class ExportDialog(tk.Toplevel):
+    """Asks which expenses to export and where to.
+
+    The user, category and date range narrow the export down; left at
+    "(all)" or empty they do not filter. Pressing Export asks for the file
+    name, closes the dialog and calls on_export(file_name, filters) with the
+    filters in the keyword form of store.query().
+    """
+
+    def __init__(self, master, users, categories, on_export, **kwargs):
+        super().__init__(master, **kwargs)
+        self.title("Export Expenses")
+        self.transient(master)
+        self.on_export = on_export
+
+        frame = ttk.Frame(self, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text="User:").grid(row=0, column=0, sticky=tk.W, pady=2)
+        self.user_combobox = ttk.Combobox(frame, values=[ALL] + list(users), width=20)
+        self.user_combobox.set(ALL)
+        self.user_combobox.grid(row=0, column=1, sticky=tk.W, pady=2)
+        ttk.Label(frame, text="Category:").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.category_combobox = ttk.Combobox(frame, values=[ALL] + list(categories), width=20)
+        self.category_combobox.set(ALL)
+        self.category_combobox.grid(row=1, column=1, sticky=tk.W, pady=2)
+        ttk.Label(frame, text="From (YYYY-MM-DD):").grid(row=2, column=0, sticky=tk.W, pady=2)
+        self.date_from_entry = ttk.Entry(frame, width=22)
+        self.date_from_entry.grid(row=2, column=1, sticky=tk.W, pady=2)
+        ttk.Label(frame, text="To (YYYY-MM-DD):").grid(row=3, column=0, sticky=tk.W, pady=2)
+        self.date_to_entry = ttk.Entry(frame, width=22)
+        self.date_to_entry.grid(row=3, column=1, sticky=tk.W, pady=2)
+
+        self.error_label = ttk.Label(frame, text="", foreground="red")
+        self.error_label.grid(row=4, column=0, columnspan=2, sticky=tk.W)
+        buttons = ttk.Frame(frame)
+        buttons.grid(row=5, column=0, columnspan=2, pady=(10, 0))
+        ttk.Button(buttons, text="Export", command=self.submit).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Cancel", command=self.destroy).pack(side=tk.LEFT, padx=5)
+        self.grab_set()
+
+    def filters(self):
+        """Returns the chosen filters; raises ValueError for a date that is not YYYY-MM-DD."""
+        filters = {}
+        for name, value in (("user", self.user_combobox.get()), ("category", self.category_combobox.get())):
+            if value and value != ALL:
+                filters[name] = value
+        for name, entry in (("date_from", self.date_from_entry), ("date_to", self.date_to_entry)):
+            value = entry.get().strip()
+            if value:
+                datetime.date.fromisoformat(value)
+                filters[name] = value
+        return filters
+
+    def submit(self):
+        """Asks for the file name and hands it and the filters to on_export()."""
+        try:
+            filters = self.filters()
+        except ValueError:
+            self.error_label.config(text="Please enter dates as YYYY-MM-DD.")
+            return
+        file_name = filedialog.asksaveasfilename(parent=self, title="Export Expenses", filetypes=EXPORT_FILE_TYPES,
+                                                 defaultextension=".csv")
+        if not file_name:
+            return
+        self.destroy()
+        self.on_export(file_name, filters)
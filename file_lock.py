@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: lock the first byte of the lock file instead
+    fcntl = None
+    import msvcrt
+
+# How long to wait for another process to release a ledger lock, in seconds
+LOCK_TIMEOUT = 30.0
+
+# Pause between attempts to take a lock held by another process, in seconds
+LOCK_POLL_SECONDS = 0.01
+
+
+class LockTimeout(IOError):
+    """Another process held the ledger lock for longer than the timeout."""
+
+
+class FileLock:
+    """Advisory lock on a file, shared by every process working on the same ledger.
+
+    It is taken with fcntl.flock() where available and msvcrt.locking() on
+    Windows. Within a process it is re-entrant and also keeps threads apart,
+    so it can be nested inside a store's own lock. Use it as a context manager.
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+    def _try_lock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self.fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def acquire(self):
+        """Waits until the lock is ours; raises LockTimeout if another process keeps it too long."""
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                deadline = time.monotonic() + self.timeout
+                while not self._try_lock():
+                    if time.monotonic() > deadline:
+                        raise LockTimeout(f"{self.path} is locked by another process")
+                    time.sleep(LOCK_POLL_SECONDS)
+            except BaseException:
+                if self.fd is not None:
+                    os.close(self.fd)
+                    self.fd = None
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        """Gives the lock up once the outermost holder is done with it."""
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+            os.close(self.fd)
+            self.fd = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def fsync_directory(path):
+    """Makes a rename in the directory of path survive a power failure; Windows needs no such step."""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_file(tmp_path, path):
+    """Moves the fully written tmp_path over path, so a crash leaves either the old or the new file."""
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(path)
@@ -0,0 +1,95 @@
+import tkinter as tk
+from tkinter import ttk
+
+from csv_import import DATE_FORMATS, IMPORT_FIELDS
+
+# Choice of a field that is not read from any column
+NOT_MAPPED = "(not mapped)"
+
+# Labels of the decimal separator choices
+DECIMAL_CHOICES = {"1234.56": ".", "1234,56": ","}
+
+
+class CsvImportDialog(tk.Toplevel):
+    """Lets the user map the columns of a statement CSV to expense fields.
+
+    Every field gets a combobox of the file's column names, pre-set from
+    csv_import.guess_mapping(); user and category also get a default used for
+    rows that have none, since statements rarely carry them. Pressing Import
+    closes the dialog and calls on_import(settings) with the keyword
+    arguments of csv_import.import_csv() other than path.
+    """
+
+    def __init__(self, master, header, mapping, users, categories, on_import, **kwargs):
+        super().__init__(master, **kwargs)
+        self.title("Import CSV")
+        self.transient(master)
+        self.categories = categories
+        self.on_import = on_import
+
+        frame = ttk.Frame(self, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        choices = [NOT_MAPPED] + list(header)
+        self.column_comboboxes = {}
+        for row, field in enumerate(IMPORT_FIELDS):
+            ttk.Label(frame, text=f"{field.capitalize()} column:").grid(row=row, column=0, sticky=tk.W, pady=2)
+            combobox = ttk.Combobox(frame, values=choices, width=20, state="readonly")
+            combobox.set(mapping.get(field, NOT_MAPPED))
+            combobox.grid(row=row, column=1, sticky=tk.W, pady=2)
+            self.column_comboboxes[field] = combobox
+
+        row = len(IMPORT_FIELDS)
+        ttk.Label(frame, text="Default user:").grid(row=row, column=0, sticky=tk.W, pady=(10, 2))
+        self.user_combobox = ttk.Combobox(frame, values=users, width=20)
+        self.user_combobox.grid(row=row, column=1, sticky=tk.W, pady=(10, 2))
+        ttk.Label(frame, text="Default category:").grid(row=row + 1, column=0, sticky=tk.W, pady=2)
+        self.category_combobox = ttk.Combobox(frame, values=categories, width=20, state="readonly")
+        self.category_combobox.grid(row=row + 1, column=1, sticky=tk.W, pady=2)
+        ttk.Label(frame, text="Date format:").grid(row=row + 2, column=0, sticky=tk.W, pady=2)
+        self.date_format_combobox = ttk.Combobox(frame, values=DATE_FORMATS, width=20)
+        self.date_format_combobox.set(DATE_FORMATS[0])
+        self.date_format_combobox.grid(row=row + 2, column=1, sticky=tk.W, pady=2)
+        ttk.Label(frame, text="Amounts look like:").grid(row=row + 3, column=0, sticky=tk.W, pady=2)
+        self.decimal_combobox = ttk.Combobox(frame, values=list(DECIMAL_CHOICES), width=20, state="readonly")
+        self.decimal_combobox.set(next(iter(DECIMAL_CHOICES)))
+        self.decimal_combobox.grid(row=row + 3, column=1, sticky=tk.W, pady=2)
+        self.negate_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Spending is listed as negative amounts",
+                        variable=self.negate_var).grid(row=row + 4, column=0, columnspan=2, sticky=tk.W, pady=2)
+
+        self.error_label = ttk.Label(frame, text="", foreground="red")
+        self.error_label.grid(row=row + 5, column=0, columnspan=2, sticky=tk.W)
+        buttons = ttk.Frame(frame)
+        buttons.grid(row=row + 6, column=0, columnspan=2, pady=(10, 0))
+        ttk.Button(buttons, text="Import", command=self.submit).pack(side=tk.LEFT, padx=5)
+        ttk.Button(buttons, text="Cancel", command=self.destroy).pack(side=tk.LEFT, padx=5)
+        self.grab_set()
+
+    def submit(self):
+        """Checks the choices and hands them to on_import()."""
+        mapping = {field: combobox.get() for field, combobox in self.column_comboboxes.items()
+                   if combobox.get() != NOT_MAPPED}
+        if "amount" not in mapping:
+            self.error_label.config(text="Please choose the amount column.")
+            return
+        if len(set(mapping.values())) < len(mapping):
+            self.error_label.config(text="Every column can only be used for one field.")
+            return
+        if "category" not in mapping and not self.category_combobox.get():
+            self.error_label.config(text="Please choose a category column or a default category.")
+            return
+        defaults = {}
+        if self.user_combobox.get():
+            defaults["user"] = self.user_combobox.get()
+        if self.category_combobox.get():
+            defaults["category"] = self.category_combobox.get()
+        settings = {
+            "mapping": mapping,
+            "defaults": defaults,
+            "categories": self.categories,
+            "date_format": self.date_format_combobox.get(),
+            "decimal": DECIMAL_CHOICES[self.decimal_combobox.get()],
+            "negate": self.negate_var.get(),
+        }
+        self.destroy()
+        self.on_import(settings)
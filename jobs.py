@@ -0,0 +1,86 @@
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Milliseconds between checks of running jobs from the Tk thread
+POLL_MS = 50
+
+
+class Job:
+    """A function running on the job pool, with progress reporting and cancellation.
+
+    The function receives the job as its first argument and may call
+    job.report_progress(done, total) and check job.is_cancelled() from the
+    worker thread.
+    """
+
+    def __init__(self):
+        self.cancel_event = threading.Event()
+        self.progress = (0, 0)
+        self.future = None
+
+    def report_progress(self, done, total):
+        """Records how far the job has got; shown on the Tk thread at the next poll."""
+        self.progress = (done, total)
+
+    def cancel(self):
+        """Asks the job to stop at its next check."""
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        """Tells whether cancel() has been called."""
+        return self.cancel_event.is_set()
+
+
+class JobRunner:
+    """Runs jobs on a thread pool and reports back on the Tk thread through widget.after()."""
+
+    def __init__(self, widget, max_workers=2):
+        self.widget = widget
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, fn, *args, on_progress=None, on_done=None, on_error=None):
+        """Starts fn(job, *args) in the background and returns the job.
+
+        on_progress(done, total) is called when the progress changes,
+        on_done(result) when fn returns and on_error(error) when it raises;
+        all three run on the Tk thread.
+        """
+        job = Job()
+        job.future = self.executor.submit(fn, job, *args)
+        self.widget.after(POLL_MS, self._poll, job, None, on_progress, on_done, on_error)
+        return job
+
+    def _poll(self, job, shown_progress, on_progress, on_done, on_error):
+        """Forwards progress and the outcome of a job to its callbacks."""
+        if on_progress is not None and job.progress != shown_progress:
+            shown_progress = job.progress
+            on_progress(*shown_progress)
+        if not job.future.done():
+            self.widget.after(POLL_MS, self._poll, job, shown_progress, on_progress, on_done, on_error)
+            return
+        error = job.future.exception()
+        if error is None:
+            if on_done is not None:
+                on_done(job.future.result())
+        elif on_error is not None:
+            on_error(error)
+
+    def shutdown(self):
+        """Stops accepting jobs without waiting for the running ones."""
+        self.executor.shutdown(wait=False)
+
+
+def warm_up(*module_names):
+    """Imports modules on a daemon thread so that their first real use does not wait for the import."""
+    def run():
+        for name in module_names:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                # Reported where the module is actually needed
+                pass
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
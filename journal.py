@@ -0,0 +1,210 @@
+import json
+import os
+
+from file_lock import FileLock, replace_file
+from json_stream import iter_json_records
+
+# Files used for the ledger: a full snapshot plus an append-only journal of changes
+SNAPSHOT_FILE = "expenses.json"
+JOURNAL_FILE = "expenses.journal"
+
+# The journal is folded into a new snapshot once it holds this many operations
+# (or as many operations as there are expenses, whichever is larger), so replay
+# never costs more than a couple of passes over the ledger.
+COMPACT_THRESHOLD = 1000
+
+
+def is_snapshot_header(record):
+    """Tells whether a snapshot element is the header compact() writes first, {"next_id": ...}, not an expense."""
+    return isinstance(record, dict) and "next_id" in record and "id" not in record
+
+
+class ExpenseJournal:
+    """Persists expenses as a JSON snapshot followed by a journal of add/modify/delete operations.
+
+    Several processes may share the files. Whoever reads or writes them holds
+    self.lock, an advisory lock on snapshot_path + ".lock"; before changing
+    anything a process catches up with what the others appended (read_new()).
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_FILE, journal_path=JOURNAL_FILE,
+                 compact_threshold=COMPACT_THRESHOLD):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self.lock = FileLock(snapshot_path + ".lock")
+        self.pending = 0
+        self.next_id = 1
+        # Bytes of the journal already read or written by this process
+        self.offset = 0
+        # Identity of the snapshot that was read; another one means someone compacted
+        self.stamp = None
+        self._file = None
+
+    def _snapshot_stamp(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """Reads the snapshot, replays the journal and returns the expenses keyed by id."""
+        return {record["id"]: record for record in self.iter_records()}
+
+    def iter_records(self):
+        """Yields the expenses of the snapshot with the journal applied, streaming the snapshot.
+
+        The journal is read first and kept as the latest version of every
+        expense it touches, so the snapshot itself never has to be in memory
+        as a whole.
+        """
+        self.close()
+        self.stamp = self._snapshot_stamp()
+        # Latest journal version of each changed expense; None once deleted
+        changed = {}
+        self.pending = self._replay(changed)
+
+        # Old snapshots have no ids; they are numbered after the highest existing one,
+        # in file order, so the ids stay the same on every load until the next
+        # compaction writes them out.
+        without_id = []
+        max_id = 0
+        if os.path.exists(self.snapshot_path):
+            for exp in iter_json_records(self.snapshot_path):
+                if is_snapshot_header(exp):
+                    # Ids up to here may belong to deleted expenses and are never handed out again
+                    max_id = max(max_id, exp["next_id"] - 1)
+                    continue
+                if "id" not in exp:
+                    without_id.append(exp)
+                    continue
+                max_id = max(max_id, exp["id"])
+                if exp["id"] in changed:
+                    exp = changed.pop(exp["id"])
+                    if exp is None:
+                        continue
+                yield exp
+
+        next_id = max_id + 1
+        for exp in without_id:
+            exp["id"] = next_id
+            next_id += 1
+            if exp["id"] in changed:
+                exp = changed.pop(exp["id"])
+                if exp is None:
+                    continue
+            yield exp
+
+        # Expenses added through the journal only
+        for expense_id, exp in changed.items():
+            max_id = max(max_id, expense_id)
+            if exp is not None:
+                yield exp
+        self.next_id = max(max_id, next_id - 1) + 1
+
+    def read_new(self):
+        """Returns what other processes journaled since this one last looked, or None to reload everything.
+
+        The result maps each changed id to its latest record, or None once
+        deleted. None as a whole means the snapshot was replaced by a
+        compaction, so the journal offset no longer applies.
+        """
+        if self._snapshot_stamp() != self.stamp:
+            return None
+        changed = {}
+        self.pending += self._replay(changed, self.offset)
+        if changed:
+            self.next_id = max(self.next_id, max(changed) + 1)
+        return changed
+
+    def _replay(self, changed, start=0):
+        """Records every journal operation from byte start on in changed and returns how many were read."""
+        applied = 0
+        good_offset = start
+        torn = False
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(start)
+                for line in f:
+                    try:
+                        entry = json.loads(line) if line.endswith(b"\n") else None
+                    except ValueError:
+                        entry = None
+                    if entry is None:
+                        torn = True
+                        break
+                    changed[entry["id"]] = entry.get("record") if entry["op"] != "delete" else None
+                    applied += 1
+                    good_offset += len(line)
+        except FileNotFoundError:
+            self.offset = 0
+            return 0
+        self.offset = good_offset
+
+        # A crash in the middle of an append leaves a partial last line behind;
+        # cut it off so the next append starts on a clean line.
+        if torn:
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_offset)
+        return applied
+
+    def append(self, op, expense_id, record=None):
+        """Appends a single operation to the journal."""
+        entry = {"op": op, "id": expense_id}
+        if record is not None:
+            entry["record"] = record
+        if self._file is None:
+            self._file = open(self.journal_path, "ab")
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._file.flush()
+        self.offset += len(line)
+        self.pending += 1
+        if op == "add" and expense_id >= self.next_id:
+            self.next_id = expense_id + 1
+
+    def sync(self):
+        """Forces the appended operations to disk, once per batch of changes."""
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def allocate_id(self):
+        """Returns a fresh expense id."""
+        expense_id = self.next_id
+        self.next_id += 1
+        return expense_id
+
+    def needs_compaction(self, record_count):
+        """Tells whether the journal has grown enough to be folded into the snapshot."""
+        return self.pending >= max(self.compact_threshold, record_count)
+
+    def compact(self, expenses):
+        """Writes a fresh snapshot of expenses and empties the journal; the caller holds self.lock.
+
+        The snapshot starts with a header holding self.next_id, so the ids of
+        expenses deleted before the compaction are not handed out again.
+        """
+        self.close()
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("[\n" + json.dumps({"next_id": self.next_id}))
+            # One expense at a time, so the ledger never has to exist as dicts all at once
+            for expense in expenses:
+                f.write(",\n" + json.dumps(expense, indent=4))
+            f.write("\n]\n")
+        replace_file(tmp_path, self.snapshot_path)
+        # Replaying the old journal on top of the new snapshot is harmless, so a
+        # crash between these two steps loses nothing.
+        with open(self.journal_path, "wb") as f:
+            os.fsync(f.fileno())
+        self.stamp = self._snapshot_stamp()
+        self.offset = 0
+        self.pending = 0
+
+    def close(self):
+        """Closes the journal file if it is open."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
@@ -0,0 +1,87 @@
+import json
+
+# Characters read from the file at a time while parsing a JSON array
+READ_CHUNK = 1 << 16
+
+# Records handed to the store per add_many() call when loading a ledger
+LOAD_BATCH_ROWS = 5000
+
+JSON_WHITESPACE = " \t\n\r"
+
+
+def iter_json_records(path, chunk_size=READ_CHUNK):
+    """Yields the records of a JSON array file or a JSON Lines file one at a time.
+
+    Files starting with "[" are parsed as one JSON array, a chunk at a time,
+    so neither the text nor the list of the whole file is ever held in
+    memory; anything else is read as one JSON value per line. Raises
+    ValueError on malformed JSON.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        while buffer and not buffer.strip(JSON_WHITESPACE):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+        start = len(buffer) - len(buffer.lstrip(JSON_WHITESPACE))
+        if buffer[start:start + 1] != "[":
+            f.seek(0)
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as error:
+                        raise ValueError(f"{path}, line {number}: {error}") from error
+            return
+        yield from _iter_array(f, buffer, start + 1, chunk_size)
+
+
+def _iter_array(f, buffer, pos, chunk_size):
+    """Yields the elements of the JSON array whose text continues at buffer[pos:] and in f."""
+    decoder = json.JSONDecoder()
+    at_end = False
+    # "first" right after "[", "element" after a ",", "separator" after an element
+    expecting = "first"
+    while True:
+        while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+            pos += 1
+        if pos < len(buffer) and buffer[pos] in ",]":
+            if expecting == "element" or (buffer[pos] == "," and expecting == "first"):
+                raise ValueError(f"Malformed JSON array in {f.name}: unexpected {buffer[pos]!r}")
+            if buffer[pos] == "]":
+                return
+            expecting = "element"
+            pos += 1
+            continue
+        if expecting == "separator" and pos < len(buffer):
+            raise ValueError(f"Malformed JSON array in {f.name}: missing ',' between elements")
+
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            record, end = None, None
+        # A value running up to the end of the buffer may continue in the next chunk
+        if end is None or (end == len(buffer) and not at_end):
+            if at_end:
+                raise ValueError(f"Malformed or truncated JSON array in {f.name}")
+            chunk = f.read(chunk_size)
+            at_end = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+        pos = end
+        expecting = "separator"
+
+
+def batched(records, size=LOAD_BATCH_ROWS):
+    """Yields lists of up to size records."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,186 @@
+import os
+
+from columnar import ExpenseColumns
+from csv_import import import_csv
+from duplicates import DuplicateIndex
+from exchange_rates import RATES_FILE, RateTable
+from expense import Expense
+from expense_store import DEFAULT_BACKEND, SQLiteExpenseStore, open_store
+from export import export_expenses
+from journal import is_snapshot_header
+from json_stream import batched, iter_json_records
+from search_index import TrigramIndex
+from undo import UndoHistory
+
+# Users and categories offered by the GUI and accepted by the CLI
+USERS = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J"]
+CATEGORIES = ["Food", "Transportation", "Tips", "Gift", "SIM Card", "Office Equipment", "Else"]
+
+
+class Ledger:
+    """The expense data shared by the GUI and the command line: a store and what is kept in step with it.
+
+    The columns hold the totals, the trigram index serves searches and the
+    duplicate index catches repeated invoices; all three follow the store
+    through store.subscribe(). Changes made through the Ledger are recorded
+    in self.history, one undo step per call. Nothing here touches Tk or matplotlib, and
+    reportlab is only imported when a report is built, so scripts using a
+    Ledger start fast.
+
+    resident=True keeps the whole duplicate index in memory, which suits a
+    long-running program checking every edit; otherwise an SQLite store
+    looks up the possible duplicates of each add or import in its indexes.
+    """
+
+    def __init__(self, resident=False):
+        self.resident = resident
+        self.store = None
+        self.columns = ExpenseColumns()
+        self.search_index = TrigramIndex()
+        self.duplicate_index = DuplicateIndex()
+        self.history = UndoHistory()
+
+    def open(self, backend=DEFAULT_BACKEND, path=None, totals=True):
+        """Opens the expense store, bringing over the old expenses.json ledger on first run."""
+        self.attach(open_store(backend, path), totals)
+
+    def attach(self, store, totals=True):
+        """Starts working on an opened store.
+
+        Loading the columns reads the whole ledger; totals=False skips that
+        for work that needs no totals, such as adding or exporting.
+        """
+        self.store = store
+        if totals:
+            self.columns.attach(store)
+        self.search_index.attach(store)
+        self.duplicate_index.attach(store, self.resident or not isinstance(store, SQLiteExpenseStore))
+        self.history.attach(store)
+
+    def load_rates(self, path=RATES_FILE):
+        """Converts at the historical rates of path from now on; raises IOError or ValueError if unreadable."""
+        self.columns.set_rates(RateTable.load(path))
+
+    def poll(self):
+        """Takes over the changes other processes made to the store.
+
+        Returns how many there were, or "reset" if everything had to be reloaded.
+        """
+        changes = self.store.poll()
+        if changes == "reset":
+            self.reload()
+        return changes
+
+    def reload(self):
+        """Reads everything again after the store changed without telling the listeners."""
+        if self.columns.store is not None:
+            self.columns.load(self.store.query())
+        self.search_index.invalidate()
+        self.duplicate_index.invalidate()
+
+    def close(self):
+        """Flushes and closes the expense store."""
+        self.store.close()
+
+    def duplicates_of(self, record, exclude=None):
+        """Returns the ids of the stored expenses with record's invoice or content (see DuplicateIndex.find)."""
+        return self.duplicate_index.find(record, exclude)
+
+    def add(self, record):
+        """Adds an expense and returns its id."""
+        return self.history.apply_many([("add", None, record)], "Add expense")[0]
+
+    def update(self, expense_id, record, expected=None):
+        """Replaces the fields of an existing expense, merging with changes made since expected was read.
+
+        Raises expense_store.ConflictError if someone else changed the same field.
+        """
+        self.history.apply_many([("modify", expense_id, record, expected)], "Modify expense")
+
+    def delete(self, expense_id, expected=None):
+        """Removes an expense; raises expense_store.ConflictError if it changed since expected was read."""
+        self.history.apply_many([("delete", expense_id, None, expected)], "Delete expense")
+
+    def delete_many(self, expense_ids):
+        """Removes several expenses in one transaction, undone as one step; returns how many there were."""
+        ids = self.history.apply_many([("delete", expense_id, None) for expense_id in expense_ids],
+                                      f"Delete {len(expense_ids)} expenses")
+        return sum(expense_id is not None for expense_id in ids)
+
+    def undo(self):
+        """Reverses the last change made through the Ledger; returns its label, or None if there is none.
+
+        Raises expense_store.ConflictError if someone else changed the same field since.
+        """
+        return self.history.undo()
+
+    def redo(self):
+        """Makes the last undone change again; returns its label, or None if there is none."""
+        return self.history.redo()
+
+    def total(self, target="HUF"):
+        """Returns the total of every expense in target minor units; see currency.format_minor."""
+        return self.columns.total(target)
+
+    def totals_by(self, column, target="HUF"):
+        """Returns {value of column: total in target minor units}, e.g. per user."""
+        return self.columns.totals_in(column, target)
+
+    def load_json(self, path, progress=None, is_cancelled=None):
+        """Adds the expenses of a JSON or JSON Lines ledger a batch at a time; returns how many were added.
+
+        The file's ids belong to another ledger, so the store hands out new
+        ones, and the header of a journal snapshot is skipped. progress(added, 0) is called after every batch; once
+        is_cancelled() returns True no further batch is added. The batches
+        added are undone as one step.
+        """
+        added = 0
+        with self.history.step(f"Load {os.path.basename(path)}"):
+            records = (record for record in iter_json_records(path) if not is_snapshot_header(record))
+            for batch in batched(records):
+                if is_cancelled is not None and is_cancelled():
+                    break
+                if not all(isinstance(record, dict) for record in batch):
+                    raise ValueError(f"{path} holds something other than expense objects")
+                self.history.apply_many([("add", None, {key: value for key, value in record.items() if key != "id"})
+                                         for record in batch])
+                added += len(batch)
+                if progress is not None:
+                    progress(added, 0)
+        return added
+
+    def import_csv(self, path, progress=None, is_cancelled=None, **settings):
+        """Imports a statement CSV (see csv_import.import_csv) in a single store transaction.
+
+        Rows repeating a recorded invoice are skipped. Returns (added,
+        errors, duplicates) with errors as (line, message) pairs and
+        duplicates the number of skipped rows.
+        """
+        records, errors = import_csv(path, progress=progress, is_cancelled=is_cancelled, **settings)
+        records, duplicates = self.duplicate_index.partition(records)
+        self.history.apply_many([("add", None, record) for record in records], f"Import {os.path.basename(path)}")
+        return len(records), errors, len(duplicates)
+
+    def export(self, path, progress=None, is_cancelled=None, **filters):
+        """Streams the expenses matching filters to a CSV or JSON Lines file; see export.export_expenses."""
+        return export_expenses(self.store, path, progress=progress, is_cancelled=is_cancelled, **filters)
+
+    def report(self, file_name, report_number, user, progress=None, is_cancelled=None):
+        """Writes the PDF report of one user's expenses, streamed from the store."""
+        from reports import build_report
+
+        # Without loaded columns the report sums its rows itself
+        total_huf = self.columns.totals_in("user").get(user, 0) if self.columns.store is not None else None
+        expenses = (Expense.from_dict(record) for record in self.store.query(user=user))
+        return build_report(file_name, report_number, user, expenses, total_huf,
+                            progress, is_cancelled, expense_count=self.store.count(user=user),
+                            rates=self.columns.rates)
+
+    def all_reports(self, report_number, by_month=False, progress=None, is_cancelled=None):
+        """Writes the reports of every user, optionally one per month; returns (files, seconds)."""
+        from reports import build_all_reports
+
+        # Every expense is held until the reports are grouped; slotted objects keep that small
+        expenses = [Expense.from_dict(record) for record in self.store.query()]
+        return build_all_reports(expenses, report_number, by_month,
+                                 progress=progress, is_cancelled=is_cancelled, rates=self.columns.rates)
@@ -0,0 +1,346 @@
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Flowable
+
+from currency import format_minor, huf_to_eur
+from exchange_rates import RateTable
+
+TABLE_HEADER = ['Invoice #', 'Date', 'Amount (HUF)', 'Original Amount', 'Currency', 'Category', 'Description']
+
+# Fixed column widths so the tables of one report line up (they add up to the letter page width)
+TABLE_COLUMN_WIDTHS = [60, 62, 70, 70, 50, 70, 86]
+
+# Flowables the story builds ahead of the one being laid out
+STORY_LOOKAHEAD = 3
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('BOX', (0, 0), (-1, -1), 1, colors.black),
+    # Last row holds the page subtotal
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+])
+
+SIGNATURE_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('BOX', (0, 0), (0, -1), 1, colors.black),
+    ('BOX', (1, 0), (1, -1), 1, colors.black),
+    ('LEFTPADDING', (0, 0), (1, -1), 10),
+    ('RIGHTPADDING', (0, 0), (1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (1, -1), 10),
+])
+
+_row_heights = None
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report build once its job has been cancelled."""
+
+
+class ExpenseTable(Table):
+    """Table of expense rows under a header row and above a subtotal row.
+
+    Its class tells the progress hook which flowables hold expenses. When the
+    table is split over a page break only the last part keeps the subtotal.
+    """
+
+    has_subtotal = True
+
+    def split(self, availWidth, availHeight):
+        parts = super().split(availWidth, availHeight)
+        for part in parts[:-1]:
+            part.has_subtotal = False
+        return parts
+
+    def expense_count(self):
+        """Returns the number of expense rows in the table."""
+        return len(self._cellvalues) - 1 - self.has_subtotal
+
+
+def expense_row(exp, amount_huf):
+    """Returns the report table row for an expense whose amount is amount_huf HUF minor units."""
+    return [
+        exp.invoice,
+        exp.date,
+        format_minor(amount_huf, "HUF"),
+        format_minor(exp.amount_minor, exp.currency),
+        exp.currency,
+        exp.category,
+        exp.description
+    ]
+
+
+def amounts_huf(expenses, rates):
+    """Converts the amounts of a list of expenses to HUF minor units in one batch, at the rates of their dates."""
+    return rates.convert_many([exp.amount_minor for exp in expenses], [exp.currency for exp in expenses],
+                              [exp.date for exp in expenses])
+
+
+def table_row_heights():
+    """Returns the heights of the header row, an expense row and the subtotal row."""
+    global _row_heights
+    if _row_heights is None:
+        sample = ["0"] * len(TABLE_HEADER)
+        table = Table([TABLE_HEADER, sample, sample], colWidths=TABLE_COLUMN_WIDTHS)
+        table.setStyle(TABLE_STYLE)
+        table.wrap(sum(TABLE_COLUMN_WIDTHS), 10000)
+        _row_heights = tuple(table._rowHeights)
+    return _row_heights
+
+
+class ReportRows:
+    """Hands out the rows of a report in page-sized batches from a single pass over the expenses."""
+
+    def __init__(self, expenses, rates):
+        self.expenses = iter(expenses)
+        self.rates = rates
+        self.exhausted = False
+        self.total_huf = 0
+
+    def take(self, count):
+        """Returns up to count table rows and their exact subtotal in HUF minor units."""
+        batch = list(islice(self.expenses, count))
+        if len(batch) < count:
+            self.exhausted = True
+        batch_huf = amounts_huf(batch, self.rates)
+        rows = [expense_row(exp, amount_huf) for exp, amount_huf in zip(batch, batch_huf)]
+        subtotal = int(sum(batch_huf))
+        self.total_huf += subtotal
+        return rows, subtotal
+
+
+class PageTable(Flowable):
+    """Expense table that takes as many rows as fit in the space left on the page.
+
+    The rows are only read from the ReportRows when the table is laid out, so
+    no more than a page of them exists at any time.
+    """
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+        self.table = None
+        self.row_count = 0
+
+    def wrap(self, availWidth, availHeight):
+        if self.table is None:
+            header_height, row_height, subtotal_height = table_row_heights()
+            fitting = int((availHeight - header_height - subtotal_height) // row_height)
+            if fitting < 1:
+                # Not even one row fits; report too tall so the table moves to the next page
+                return availWidth, availHeight + 1
+            rows, subtotal = self.rows.take(fitting)
+            self.row_count = len(rows)
+            self.table = False
+            if rows:
+                subtotal_row = ["Subtotal", "", format_minor(subtotal, "HUF"), "", "", "", ""]
+                self.table = ExpenseTable([TABLE_HEADER] + rows + [subtotal_row],
+                                          colWidths=TABLE_COLUMN_WIDTHS, repeatRows=1)
+                self.table.setStyle(TABLE_STYLE)
+        if not self.table:
+            return 0, 0
+        self.width, self.height = self.table.wrap(availWidth, availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        # Only rows taller than expected (e.g. multi-line descriptions) get here
+        return self.table.split(availWidth, availHeight) if self.table else []
+
+    def draw(self):
+        if self.table:
+            self.table.drawOn(self.canv, 0, 0)
+
+
+class LazyStory(list):
+    """Story list that pulls flowables from an iterator as the document build consumes them."""
+
+    def __init__(self, flowables, lookahead=STORY_LOOKAHEAD):
+        super().__init__()
+        self.pending = iter(flowables)
+        self.lookahead = lookahead
+
+    def __len__(self):
+        # The build loop checks len() before taking every flowable, so topping up here is enough
+        while self.pending is not None and super().__len__() < self.lookahead:
+            try:
+                self.append(next(self.pending))
+            except StopIteration:
+                self.pending = None
+        return super().__len__()
+
+
+class ProgressDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate that reports the expense rows it lays out and can be stopped midway."""
+
+    def __init__(self, filename, total_rows, progress=None, is_cancelled=None, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.total_rows = total_rows
+        self.done_rows = 0
+        self.progress = progress
+        self.is_cancelled = is_cancelled
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, PageTable):
+            self.done_rows += flowable.row_count
+        elif isinstance(flowable, ExpenseTable):
+            # Part of a PageTable that had to be split over a page break
+            self.done_rows += flowable.expense_count()
+        else:
+            return
+        if self.progress is not None:
+            self.progress(self.done_rows, self.total_rows)
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise ReportCancelled()
+
+
+def report_story(report_number, user, expenses, total_huf, rates):
+    """Yields the flowables of a report, reading the expenses only as the pages are laid out."""
+    styles = getSampleStyleSheet()
+    title_style = styles['Title']
+    body_style = styles['Normal']
+    body_style.spaceAfter = 12
+
+    # Title with report number
+    title_text = f"Expense Report #{report_number}"
+    yield Paragraph(title_text, title_style)
+    yield Spacer(1, 12)
+
+    # User and Date
+    yield Paragraph(f"<b>User:</b> {user}", body_style)
+    yield Paragraph(f"<b>Date:</b> {datetime.date.today()}", body_style)
+    yield Spacer(1, 12)
+
+    # Table of expenses, one page-sized table after another with a subtotal on each
+    rows = ReportRows(expenses, rates)
+    while not rows.exhausted:
+        yield PageTable(rows)
+    yield Spacer(1, 12)
+
+    # Total; the loop above only ends once every row has been laid out and added up
+    if total_huf is None:
+        total_huf = rows.total_huf
+    total_eur = huf_to_eur(total_huf)
+    yield Paragraph(f"<b>Total Expenses for {user}:</b> {format_minor(total_huf, 'HUF')} HUF", body_style)
+    yield Paragraph(f"<b>Total in EUR:</b> {format_minor(total_eur, 'EUR')} EUR", body_style)
+    yield Spacer(1, 24)
+
+    # Signature lines
+    signature_data = [
+        [f'Employee Name: {user}', 'Approval Name: _______________'],
+        ['Signature: __________________', 'Signature: __________________']
+    ]
+    signature_table = Table(signature_data, colWidths=[2.5 * 100, 2.5 * 100])
+    signature_table.setStyle(SIGNATURE_TABLE_STYLE)
+    yield signature_table
+
+
+def build_report(file_name, report_number, user, expenses, total_huf=None, progress=None, is_cancelled=None,
+                 expense_count=None, rates=None):
+    """Writes the PDF expense report of one user.
+
+    expenses may be any iterable of expense.Expense objects, e.g. a
+    converted store query; it is read once, a page at a time, so only the
+    finished (compressed) page streams grow with the number of rows.
+    Amounts are converted with the RateTable rates (fixed rates if None) as
+    of each expense's date, and total_huf (HUF minor units) defaults to the
+    exact sum of the rows.
+    progress(done, total) is called with the number of expense rows laid
+    out so far (total is expense_count, or len(expenses)); once
+    is_cancelled() returns True the build stops, the partial file is
+    removed and ReportCancelled is raised.
+    """
+    if expense_count is None:
+        expense_count = len(expenses)
+    if rates is None:
+        rates = RateTable()
+    doc = ProgressDocTemplate(file_name, expense_count, progress, is_cancelled, pagesize=letter,
+                              pageCompression=1)
+
+    # Build the PDF
+    try:
+        doc.build(LazyStory(report_story(report_number, user, expenses, total_huf, rates)))
+    except ReportCancelled:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        raise
+    return file_name
+
+
+def group_expenses(expenses, rates, by_month=False):
+    """Splits expenses into report groups in a single pass.
+
+    Returns {key: (expense list, total in HUF minor units)} where key is the user, or
+    (user, "YYYY-MM") when by_month is set. Totals use the RateTable rates.
+    """
+    groups = {}
+    for exp in expenses:
+        if by_month:
+            # Old entries have "N/A" as their date
+            month = exp.date[:7] if exp.date[:4].isdigit() else "undated"
+            key = (exp.user, month)
+        else:
+            key = exp.user
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = []
+        group.append(exp)
+    return {key: (rows, int(sum(amounts_huf(rows, rates)))) for key, rows in groups.items()}
+
+
+def file_name_part(text):
+    """Replaces the characters of text that are not safe in a file name."""
+    return "".join(char if char.isalnum() or char in "-_" else "_" for char in text)
+
+
+def _build_report_task(task):
+    """Builds one report of a batch; runs in a worker process."""
+    file_name, report_number, user, expenses, total_huf, rates = task
+    return build_report(file_name, report_number, user, expenses, total_huf, rates=rates)
+
+
+def build_all_reports(expenses, report_number, by_month=False, max_workers=None, progress=None, is_cancelled=None,
+                      rates=None):
+    """Builds one report per user (or per user and month) on a pool of processes.
+
+    Reports are named expense_report_<report_number>_<user>[_<YYYY-MM>].pdf.
+    progress(done, total) is called as reports finish. Returns the list of
+    files written and the elapsed time in seconds; raises ReportCancelled once
+    is_cancelled() returns True, after dropping the reports not started yet.
+    """
+    started = time.perf_counter()
+    if rates is None:
+        rates = RateTable()
+    tasks = []
+    for key, (group, total_huf) in sorted(group_expenses(expenses, rates, by_month).items()):
+        user = key[0] if by_month else key
+        number = f"{report_number}_{user}_{key[1]}" if by_month else f"{report_number}_{user}"
+        tasks.append((f"expense_report_{file_name_part(number)}.pdf", number, user, group, total_huf, rates))
+
+    files = []
+    # Where workers are spawned they import the calling script again, so scripts
+    # using this keep their start-up under if __name__ == "__main__"
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_build_report_task, task) for task in tasks]
+        for future in as_completed(futures):
+            files.append(future.result())
+            if progress is not None:
+                progress(len(files), len(tasks))
+            if is_cancelled is not None and is_cancelled():
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise ReportCancelled()
+    return sorted(files), time.perf_counter() - started
@@ -0,0 +1,334 @@
+import queue
+import threading
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    # Posting lists are then intersected in pure Python
+    np = None
+
+from expense_store import SEARCH_FIELDS
+
+# Separates the fields in an expense's search text so a match cannot span two fields
+FIELD_SEPARATOR = "\x00"
+
+# Candidates checked between two looks at whether the search was cancelled
+CANCEL_CHECK_ROWS = 20000
+
+# Array type code of the posting lists; ids are well below 2**31
+POSTING_TYPE = "i"
+
+# A posting list this many times longer than the candidates left is probed rather than read
+PROBE_RATIO = 16
+
+# Milliseconds to wait after the last keystroke before searching
+DEBOUNCE_MS = 150
+
+# Milliseconds between checks for a finished background search
+POLL_MS = 15
+
+
+def trigrams(text):
+    """Returns the set of three-character substrings of text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def search_text(record):
+    """Returns the lowercase text a search query is matched against."""
+    return FIELD_SEPARATOR.join(record[field].lower() for field in SEARCH_FIELDS)
+
+
+def _contains(posting, expense_id):
+    """Tells whether a sorted posting list holds expense_id."""
+    i = bisect_left(posting, expense_id)
+    return i < len(posting) and posting[i] == expense_id
+
+
+def _indexed(records):
+    """Returns the (postings, texts) of records, each posting a sorted array of ids."""
+    lists = {}
+    texts = {}
+    for record in records:
+        expense_id = record["id"]
+        text = search_text(record)
+        texts[expense_id] = text
+        for gram in trigrams(text):
+            ids = lists.get(gram)
+            if ids is None:
+                lists[gram] = [expense_id]
+            else:
+                ids.append(expense_id)
+    postings = {}
+    for gram in list(lists):
+        # Records come in id order, except those restored under an old id
+        postings[gram] = array(POSTING_TYPE, sorted(lists.pop(gram)))
+    return postings, texts
+
+
+class TrigramIndex:
+    """Inverted index from character trigrams to expense ids for substring search.
+
+    A query of three or more characters only looks at the ids found in the
+    posting list of every trigram it contains, then confirms each candidate
+    against its text. Posting lists are sorted arrays of ids, a few bytes
+    per entry, intersected smallest first. When a query extends the
+    previous one (more characters typed), the previous result is filtered
+    instead of starting over.
+
+    Searches may run on a worker thread; self.lock keeps them apart from the
+    updates made when the store changes. The index is built without the
+    lock, so the store is not held up meanwhile, and the changes made during
+    the build are applied before it is swapped in.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while building, so concurrent first searches build only once
+        self.build_lock = threading.Lock()
+        self.store = None
+        self.built = False
+        # Bumped by invalidate(); a build that started before is thrown away
+        self.generation = 0
+        # Changes made while a build runs, or None
+        self.backlog = None
+        self.postings = {}
+        self.texts = {}
+        self.last_query = None
+        self.last_result = None
+
+    def attach(self, store):
+        """Keeps the index in sync with store; it is built from the store on first search."""
+        self.store = store
+        store.subscribe(self.apply)
+
+    def invalidate(self):
+        """Makes the next search build the index again, after the store changed without telling it."""
+        with self.lock:
+            self.built = False
+            self.generation += 1
+            self.postings = {}
+            self.texts = {}
+            self.last_query = None
+
+    def build(self, records):
+        """Indexes every record from scratch."""
+        postings, texts = _indexed(records)
+        with self.lock:
+            self._swap(postings, texts)
+
+    def _swap(self, postings, texts):
+        self.postings = postings
+        self.texts = texts
+        self.built = True
+        self.last_query = None
+
+    def _ensure_built(self):
+        """Builds the index from the store unless it is up to date."""
+        with self.build_lock:
+            while True:
+                with self.lock:
+                    if self.built:
+                        return
+                    generation = self.generation
+                    self.backlog = []
+                try:
+                    postings, texts = _indexed(self.store.query())
+                except BaseException:
+                    with self.lock:
+                        self.backlog = None
+                    raise
+                with self.lock:
+                    backlog, self.backlog = self.backlog, None
+                    if generation != self.generation:
+                        continue
+                    self._swap(postings, texts)
+                    # The build may or may not have read these already; applying them again is harmless
+                    self._apply(backlog)
+                    return
+
+    def apply(self, changes):
+        """Updates the index from a list of store changes; suitable for store.subscribe()."""
+        with self.lock:
+            if self.backlog is not None:
+                self.backlog.extend(changes)
+            if self.built:
+                self._apply(changes)
+
+    def _apply(self, changes):
+        for op, expense_id, old, new in changes:
+            self._remove(expense_id)
+            if new is not None:
+                self._add(expense_id, new)
+        # Earlier results may now include deleted rows or miss new ones
+        self.last_query = None
+
+    def _add(self, expense_id, record):
+        text = search_text(record)
+        self.texts[expense_id] = text
+        for gram in trigrams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                self.postings[gram] = array(POSTING_TYPE, [expense_id])
+            elif not posting or posting[-1] < expense_id:
+                posting.append(expense_id)
+            else:
+                i = bisect_left(posting, expense_id)
+                if i == len(posting) or posting[i] != expense_id:
+                    posting.insert(i, expense_id)
+
+    def _remove(self, expense_id):
+        text = self.texts.pop(expense_id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            posting = self.postings.get(gram)
+            if posting is not None and _contains(posting, expense_id):
+                del posting[bisect_left(posting, expense_id)]
+                if not posting:
+                    del self.postings[gram]
+
+    def search(self, query, is_cancelled=None):
+        """Returns the ids of the expenses containing query in a searchable field, in id order.
+
+        is_cancelled is polled while candidates are checked; once it returns
+        True the search stops and returns None.
+        """
+        self._ensure_built()
+        with self.lock:
+            query = query.lower()
+            texts = self.texts
+
+            if self.last_query and self.last_query in query:
+                # Anything matching the longer query also matched the previous one
+                candidates = self.last_result
+            elif len(query) >= 3:
+                candidates = self._candidates(query)
+            else:
+                # Ids are handed out in increasing order, but records restored under an old id are not
+                candidates = sorted(texts)
+
+            result = []
+            for start in range(0, len(candidates), CANCEL_CHECK_ROWS):
+                if is_cancelled is not None and is_cancelled():
+                    return None
+                chunk = candidates[start:start + CANCEL_CHECK_ROWS]
+                result.extend([expense_id for expense_id in chunk if query in texts[expense_id]])
+
+            self.last_query = query
+            self.last_result = result
+            return result
+
+    def _candidates(self, query):
+        """Intersects the posting lists of the query's trigrams, smallest first; returns sorted ids."""
+        postings = []
+        for gram in trigrams(query):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        if np is not None:
+            # Views of the arrays, not copies
+            candidates = np.frombuffer(postings[0], dtype=np.int32)
+            for posting in postings[1:]:
+                posting = np.frombuffer(posting, dtype=np.int32)
+                found = posting[np.minimum(np.searchsorted(posting, candidates), len(posting) - 1)]
+                candidates = candidates[found == candidates]
+            return candidates.tolist()
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            if len(candidates) * PROBE_RATIO < len(posting):
+                # Few candidates left: look each one up rather than reading the whole list
+                candidates = [expense_id for expense_id in candidates if _contains(posting, expense_id)]
+            else:
+                candidates = set(candidates).intersection(posting)
+        return sorted(candidates)
+
+
+class SearchScheduler:
+    """Runs index searches on a worker thread so typing never waits for them.
+
+    schedule() is meant to be called on every keystroke: the search only starts
+    once typing pauses for delay milliseconds, and every new call bumps a
+    generation counter that cancels the searches still running for older
+    queries. Results are handed back on the Tk thread through widget.after(),
+    and only the one for the newest query reaches on_result(ids, *args).
+    """
+
+    def __init__(self, widget, index, on_result, delay=DEBOUNCE_MS):
+        self.widget = widget
+        self.index = index
+        self.on_result = on_result
+        self.delay = delay
+        self.generation = 0
+        self.submitted = None
+        self.pending = None
+        self.polling = False
+        self.request = None
+        self.condition = threading.Condition()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def schedule(self, query, *args):
+        """Searches for query once typing pauses, then calls on_result(ids, *args)."""
+        self.cancel()
+        self.pending = self.widget.after(self.delay, self._submit, self.generation, query, args)
+
+    def cancel(self):
+        """Drops the pending search and any search still running."""
+        self.generation += 1
+        if self.pending is not None:
+            self.widget.after_cancel(self.pending)
+            self.pending = None
+
+    def _submit(self, generation, query, args):
+        """Hands a query to the worker thread and starts waiting for its result."""
+        self.pending = None
+        self.submitted = generation
+        with self.condition:
+            self.request = (generation, query, args)
+            self.condition.notify()
+        if not self.polling:
+            self.polling = True
+            self.widget.after(POLL_MS, self._poll)
+
+    def _work(self):
+        """Worker thread: runs the newest request, giving up on it once it is stale."""
+        while True:
+            with self.condition:
+                while self.request is None:
+                    self.condition.wait()
+                generation, query, args = self.request
+                self.request = None
+            try:
+                ids = self.index.search(query, lambda: generation != self.generation)
+            except Exception as error:
+                # Re-raised on the Tk thread so the worker stays alive for the next query
+                self.results.put((generation, error, args))
+                continue
+            if ids is not None:
+                self.results.put((generation, ids, args))
+
+    def _poll(self):
+        """Tk thread: delivers the result of the newest query once it is ready."""
+        latest = None
+        while not self.results.empty():
+            generation, ids, args = self.results.get_nowait()
+            if generation == self.generation:
+                latest = (ids, args)
+        if latest is not None:
+            self.polling = False
+            ids, args = latest
+            if isinstance(ids, Exception):
+                raise ids
+            self.on_result(ids, *args)
+        elif self.submitted != self.generation:
+            # The newest query was cancelled or not submitted yet; _submit() polls again
+            self.polling = False
+        else:
+            self.widget.after(POLL_MS, self._poll)
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ledger import Ledger
+
+EXPENSE = {"amount": 10, "currency": "HUF", "category": "Food", "description": "lunch", "user": "A",
+           "date": "2024-01-01", "invoice": ""}
+
+
+class UndoAcrossStoresTest(unittest.TestCase):
+    """Two ledgers on the same file, standing in for two processes."""
+
+    def setUp(self):
+        # Opening a store may lock the old ledger files in the working directory
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.ledgers = []
+
+    def tearDown(self):
+        for ledger in self.ledgers:
+            ledger.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def open_two(self, backend, path):
+        for _ in range(2):
+            ledger = Ledger()
+            ledger.open(backend, path)
+            self.ledgers.append(ledger)
+        return self.ledgers
+
+    def check_undo_keeps_other_edit(self, backend, name):
+        a, b = self.open_two(backend, name)
+        expense_id = a.add(EXPENSE)
+        b.poll()
+        read = a.store.get(expense_id)
+        # b edits the expense before a, which has not polled, changes it too
+        b.update(expense_id, dict(b.store.get(expense_id), description="dinner"))
+        a.update(expense_id, dict(read, amount=20), expected=read)
+
+        self.assertEqual(a.undo(), "Modify expense")
+        record = a.store.get(expense_id)
+        self.assertEqual(record["amount"], 10)
+        self.assertEqual(record["description"], "dinner")
+
+        self.assertEqual(a.redo(), "Modify expense")
+        record = a.store.get(expense_id)
+        self.assertEqual(record["amount"], 20)
+        self.assertEqual(record["description"], "dinner")
+
+    def test_sqlite_undo_keeps_other_edit(self):
+        self.check_undo_keeps_other_edit("sqlite", "expenses.db")
+
+    def test_journal_undo_keeps_other_edit(self):
+        self.check_undo_keeps_other_edit("journal", "expenses.json")
+
+
+if __name__ == "__main__":
+    unittest.main()
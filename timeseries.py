@@ -0,0 +1,92 @@
+import datetime
+
+# Bucket sizes of the spending-over-time chart
+PERIODS = ("day", "week", "month")
+
+
+def period_start(ordinal, period):
+    """Returns the ordinal of the first day of the day, week (Monday) or month containing ordinal."""
+    if period == "day":
+        return ordinal
+    date = datetime.date.fromordinal(ordinal)
+    if period == "week":
+        return ordinal - date.weekday()
+    if period == "month":
+        return date.replace(day=1).toordinal()
+    raise ValueError(f"Unknown period {period!r}")
+
+
+def next_period(ordinal, period):
+    """Returns the ordinal of the first day of the period after the one starting at ordinal."""
+    if period == "day":
+        return ordinal + 1
+    if period == "week":
+        return ordinal + 7
+    date = datetime.date.fromordinal(ordinal)
+    if date.month == 12:
+        return date.replace(year=date.year + 1, month=1).toordinal()
+    return date.replace(month=date.month + 1).toordinal()
+
+
+def resample(ordinals, amounts, period):
+    """Sums daily totals into periods.
+
+    ordinals and amounts are the days and totals of the days with expenses,
+    sorted by day. Returns the start of every period from the first to the
+    last one, and its total; periods without expenses get 0.
+    """
+    sums = {}
+    for ordinal, amount in zip(ordinals, amounts):
+        start = period_start(ordinal, period)
+        sums[start] = sums.get(start, 0) + amount
+    if not sums:
+        return [], []
+    starts = []
+    start = min(sums)
+    last = max(sums)
+    while start <= last:
+        starts.append(start)
+        start = next_period(start, period)
+    return starts, [sums.get(start, 0.0) for start in starts]
+
+
+def lttb(xs, ys, threshold):
+    """Downsamples a series to threshold points with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. The points in between are split into
+    threshold - 2 buckets, and from each bucket the point that forms the
+    largest triangle with the previously kept point and the average of the
+    next bucket is kept, which preserves peaks and dips that plain striding
+    would miss. Series of up to threshold points are returned unchanged.
+    """
+    count = len(xs)
+    if threshold >= count or threshold < 3:
+        return list(xs), list(ys)
+
+    every = (count - 2) / (threshold - 2)
+    kept_x = [xs[0]]
+    kept_y = [ys[0]]
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, count)
+        next_size = next_end - end
+        average_x = sum(xs[end:next_end]) / next_size
+        average_y = sum(ys[end:next_end]) / next_size
+
+        point_x, point_y = xs[previous], ys[previous]
+        best_area = -1.0
+        best = start
+        for index in range(start, end):
+            area = abs((point_x - average_x) * (ys[index] - point_y) - (point_x - xs[index]) * (average_y - point_y))
+            if area > best_area:
+                best_area = area
+                best = index
+        kept_x.append(xs[best])
+        kept_y.append(ys[best])
+        previous = best
+
+    kept_x.append(xs[-1])
+    kept_y.append(ys[-1])
+    return kept_x, kept_y
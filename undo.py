@@ -0,0 +1,176 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from expense import FIELDS, Expense
+
+# Steps that can be undone; the oldest is forgotten once there are more
+UNDO_LIMIT = 100
+
+
+def _inverse(change):
+    """Returns what reverses one store change: ("delete", id, Expense), ("add", id, Expense) or ("modify", id, fields).
+
+    The Expense of a delete is the expense as it was added, checked before
+    it is removed again; that of an add is the deleted one. fields maps
+    each field a modify changed to (its new value, its old value); a
+    modify that changed nothing gives None.
+    """
+    op, expense_id, old, new = change
+    if old is None:
+        return ("delete", expense_id, Expense.from_dict(new, expense_id))
+    if new is None:
+        return ("add", expense_id, Expense.from_dict(old, expense_id))
+    fields = {field: (new[field], old[field]) for field in FIELDS if new[field] != old[field]}
+    return ("modify", expense_id, fields) if fields else None
+
+
+class UndoHistory:
+    """Multi-level undo and redo of ledger changes, kept as the operations that reverse them.
+
+    A step is everything applied inside one step() block, e.g. a single
+    edit or a whole CSV import, and is undone in one store transaction.
+    Rather than snapshots, a step holds per changed expense only what
+    reverses it: the added or the deleted expense, or the old and new
+    values of the fields a modify changed. Memory thus grows with the
+    changes, not the ledger, and an undo reaches the columns and indexes as
+    one ordinary batch of changes through their store listeners.
+
+    Only the changes the store reports writing for apply_many() on the
+    thread running the step are recorded; what other processes do
+    meanwhile, even to the same expenses, is never undone. An undone modify
+    is merged like any edit made against an old version (see
+    expense_store.rebase_edit), and an added expense someone else changed
+    since is not deleted again.
+    """
+
+    def __init__(self, limit=UNDO_LIMIT):
+        self.store = None
+        self.lock = threading.Lock()
+        self.undo_steps = deque(maxlen=limit)
+        self.redo_steps = deque(maxlen=limit)
+        # Per thread: the inverse operations of the open step
+        self.local = threading.local()
+
+    def attach(self, store):
+        """Starts recording the changes made to store, forgetting every earlier step."""
+        self.store = store
+        self.clear()
+
+    def clear(self):
+        """Forgets every step."""
+        with self.lock:
+            self.undo_steps.clear()
+            self.redo_steps.clear()
+
+    @contextmanager
+    def step(self, label):
+        """Makes every apply_many() inside the block one undo step named label.
+
+        A step nested in another one is part of the outer step. What was
+        applied before an exception is still recorded, as it stays applied.
+        """
+        if getattr(self.local, "step", None) is not None:
+            yield
+            return
+        self.local.step = []
+        try:
+            yield
+        finally:
+            inverse, self.local.step = self.local.step, None
+            if inverse:
+                with self.lock:
+                    self.undo_steps.append((label, inverse))
+                    self.redo_steps.clear()
+
+    def apply_many(self, operations, label="Change"):
+        """Applies operations with store.apply_many() as part of the open step, or as a step of its own."""
+        with self.step(label):
+            return self._apply(operations)
+
+    def _apply(self, operations):
+        """Applies operations and adds their inverses to the open step."""
+        written = []
+        ids = self.store.apply_many(operations, written)
+        for change in written:
+            inverse = _inverse(change)
+            if inverse is not None:
+                self.local.step.append(inverse)
+        return ids
+
+    def undo_label(self):
+        """Returns the label of the step undo() would reverse, or None."""
+        with self.lock:
+            return self.undo_steps[-1][0] if self.undo_steps else None
+
+    def redo_label(self):
+        """Returns the label of the step redo() would apply again, or None."""
+        with self.lock:
+            return self.redo_steps[-1][0] if self.redo_steps else None
+
+    def undo(self):
+        """Reverses the last step and returns its label, or None if there is nothing to undo.
+
+        Raises expense_store.ConflictError, keeping the step, if someone else
+        changed the same field of one of its expenses, or an expense it
+        added, since.
+        """
+        return self._replay(self.undo_steps, self.redo_steps)
+
+    def redo(self):
+        """Applies the last undone step again and returns its label, or None if there is none."""
+        return self._replay(self.redo_steps, self.undo_steps)
+
+    def _replay(self, source, target):
+        """Applies the inverse of the newest step of source and files the step that reverses it in target."""
+        with self.lock:
+            if not source:
+                return None
+            label, inverse = source.pop()
+        self.local.step = []
+        try:
+            self._apply(self._operations(inverse))
+        except BaseException:
+            with self.lock:
+                source.append((label, inverse))
+            raise
+        finally:
+            reverse, self.local.step = self.local.step, None
+        with self.lock:
+            target.append((label, reverse))
+        return label
+
+    def _operations(self, inverse):
+        """Turns the inverse of a step into store operations, newest change first.
+
+        A modify only sets the fields it changed back, checked against the
+        values it wrote, and an added expense is only deleted as it was
+        added; a deleted expense comes back under its old id unless that id
+        has been taken meanwhile.
+        """
+        ids = [entry[1] for entry in inverse if entry[0] != "delete"]
+        # The expenses as they will be when each operation runs
+        current = {record["id"]: record for record in self.store.get_many(ids)}
+        operations = []
+        for entry in reversed(inverse):
+            op, expense_id = entry[0], entry[1]
+            if op == "delete":
+                operations.append(("delete", expense_id, None, entry[2].to_dict()))
+                current.pop(expense_id, None)
+            elif op == "add":
+                record = entry[2].to_dict()
+                operations.append(("add", None if expense_id in current else expense_id, record))
+                current[expense_id] = record
+            else:
+                record = current.get(expense_id)
+                if record is None:
+                    # Deleted by someone else since; there is nothing to set back
+                    continue
+                expected = dict(record)
+                restored = dict(record)
+                for field, (new, old) in entry[2].items():
+                    expected[field] = new
+                    restored[field] = old
+                operations.append(("modify", expense_id, restored, expected))
+                current[expense_id] = restored
+        return operations
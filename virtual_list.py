@@ -0,0 +1,201 @@
+import tkinter as tk
+from tkinter import ttk
+
+from currency import format_minor, to_minor
+
+# Columns of the expense list: (record field, heading, width in pixels)
+COLUMNS = (
+    ("invoice", "Invoice #", 80),
+    ("date", "Date", 85),
+    ("amount", "Amount", 90),
+    ("currency", "Currency", 60),
+    ("category", "Category", 110),
+    ("description", "Description", 170),
+    ("user", "User", 50),
+)
+
+# Rows fetched above and below the visible ones, so short scrolls need no new query
+BUFFER_ROWS = 20
+
+
+def expense_row_values(exp):
+    """Returns the cell values shown for an expense."""
+    amount = format_minor(to_minor(exp["amount"], exp["currency"]), exp["currency"])
+    return (exp["invoice"], exp["date"], amount, exp["currency"],
+            exp["category"], exp["description"], exp["user"])
+
+
+class VirtualExpenseList(ttk.Frame):
+    """Scrollable expense list that only fetches and formats the rows in view.
+
+    The rows come from a source made of two callables: count() returning the
+    number of rows and fetch(offset, limit) returning that slice of expense
+    records. The Treeview holds one item per visible row and those items are
+    reused while scrolling, so a refresh costs the same for ten rows or ten
+    million.
+    """
+
+    def __init__(self, master, height=10, on_select=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_select = on_select
+        self.count = lambda: 0
+        self.fetch = lambda offset, limit: []
+        self.total = 0
+        self.top = 0
+        self.visible_rows = height
+        self.selected = None
+        self.cache_start = 0
+        self.cache = []
+        self.row_ids = []
+        self._rendering = False
+
+        self.tree = ttk.Treeview(self, columns=[field for field, _, _ in COLUMNS], show="headings",
+                                 height=height, selectmode="browse")
+        for field, heading, width in COLUMNS:
+            self.tree.heading(field, text=heading)
+            self.tree.column(field, width=width, anchor=tk.W, stretch=field == "description")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", self.on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_to(self.top - 3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_to(self.top + 3))
+        self.tree.bind("<Up>", lambda event: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda event: self.move_selection(1))
+        self.tree.bind("<Prior>", lambda event: self.move_selection(-self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self.move_selection(self.visible_rows))
+
+    def set_source(self, count, fetch, keep_position=False):
+        """Shows the rows of a new source, from the top unless keep_position is set."""
+        self.count = count
+        self.fetch = fetch
+        if not keep_position:
+            self.top = 0
+        self.selected = None
+        self.refresh()
+        if self.on_select is not None:
+            self.on_select(None)
+
+    def refresh(self):
+        """Re-reads the row count and redraws the visible rows, keeping the scroll position."""
+        self.total = self.count()
+        self.cache = []
+        self.top = max(0, min(self.top, self.total - self.visible_rows))
+        self.render()
+
+    def selected_id(self):
+        """Returns the id of the selected expense, or None."""
+        return self.selected
+
+    def set_selection(self, expense_id):
+        """Selects the expense with the given id, or clears the selection."""
+        self.selected = expense_id
+        self.render()
+        if self.on_select is not None:
+            self.on_select(None)
+
+    def rows(self, start, stop):
+        """Returns the records of rows start..stop, fetching a new window around them when needed."""
+        if start < self.cache_start or stop > self.cache_start + len(self.cache):
+            self.cache_start = max(0, start - BUFFER_ROWS)
+            limit = stop - self.cache_start + BUFFER_ROWS
+            self.cache = list(self.fetch(self.cache_start, limit))
+        return self.cache[start - self.cache_start:stop - self.cache_start]
+
+    def render(self):
+        """Updates the Treeview items to show the rows in view."""
+        stop = min(self.total, self.top + self.visible_rows)
+        records = self.rows(self.top, stop) if stop > self.top else []
+        items = self.tree.get_children()
+        # Reuse the existing items and only add or remove the difference
+        for index in range(len(items), len(records)):
+            self.tree.insert("", tk.END, iid=f"row{index}")
+        if len(items) > len(records):
+            self.tree.delete(*items[len(records):])
+
+        selected_item = ()
+        for index, exp in enumerate(records):
+            iid = f"row{index}"
+            self.tree.item(iid, values=expense_row_values(exp))
+            if exp["id"] == self.selected:
+                selected_item = (iid,)
+        self.row_ids = [exp["id"] for exp in records]
+        # Changing the Treeview selection fires <<TreeviewSelect>>; suppress that echo
+        self._rendering = True
+        self.tree.selection_set(selected_item)
+        self.after_idle(self._done_rendering)
+
+        if self.total > 0:
+            self.scrollbar.set(self.top / self.total, stop / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _done_rendering(self):
+        self._rendering = False
+
+    def scroll_to(self, top):
+        """Scrolls so that row top is the first visible row."""
+        top = max(0, min(int(top), self.total - self.visible_rows))
+        if top != self.top:
+            self.top = top
+            self.render()
+        return "break"
+
+    def on_scrollbar(self, action, amount, unit=None):
+        """Handles drags and clicks on the scrollbar."""
+        if action == tk.MOVETO:
+            self.scroll_to(float(amount) * self.total)
+        elif action == tk.SCROLL:
+            step = self.visible_rows if unit == tk.PAGES else 1
+            self.scroll_to(self.top + int(amount) * step)
+
+    def on_mousewheel(self, event):
+        """Scrolls three rows per wheel notch."""
+        notches = event.delta // 120 if abs(event.delta) >= 120 else (1 if event.delta > 0 else -1)
+        return self.scroll_to(self.top - 3 * notches)
+
+    def on_resize(self, event):
+        """Adjusts the number of rendered rows to the height the Treeview was given."""
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        first = self.tree.bbox("row0") if self.tree.exists("row0") else None
+        header_height = first[1] if first else row_height + 5
+        rows = max(1, (event.height - header_height) // row_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.top = max(0, min(self.top, self.total - rows))
+            self.render()
+
+    def on_tree_select(self, event):
+        """Remembers the selected expense by id so the selection survives scrolling."""
+        if self._rendering:
+            return
+        items = self.tree.selection()
+        if items:
+            index = self.tree.index(items[0])
+            self.selected = self.row_ids[index]
+        else:
+            self.selected = None
+        if self.on_select is not None:
+            self.on_select(event)
+
+    def move_selection(self, step):
+        """Moves the selection by step rows, scrolling it into view."""
+        if self.total == 0:
+            return "break"
+        if self.selected in self.row_ids:
+            row = self.top + self.row_ids.index(self.selected) + step
+        else:
+            row = self.top
+        row = max(0, min(row, self.total - 1))
+        if row < self.top:
+            self.top = row
+        elif row >= self.top + self.visible_rows:
+            self.top = row - self.visible_rows + 1
+        self.selected = self.rows(row, row + 1)[0]["id"]
+        self.render()
+        if self.on_select is not None:
+            self.on_select(None)
+        return "break"